@@ -0,0 +1,380 @@
+"""
+Modo async (ASGI), alternativo a gunicorn + gthread:
+
+    pip install ".[async]"
+    uvicorn app.asgi:app --workers 2 --port 5000
+
+Un event loop por proceso: el webhook responde 200 al toque y cada mensaje es
+una tarea. Graph y llama van por httpx (aio.py), SQLite por un executor propio
+y handle_message es el mismo core sincrónico que usa app.main.
+"""
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from dotenv import load_dotenv
+
+# =========================
+# ENV
+# =========================
+# antes de importar los servicios: varios leen su config del entorno al importarse
+load_dotenv()
+
+# mismo criterio que gunicorn.conf.py: con varios procesos el estado vive en
+# SQLite. Se fuerza (no setdefault): un .env copiado de .env.example o un
+# EnvironmentFile exportado no pueden dejar el cache write-behind/dedupe por proceso.
+_SHARED_STATE = {"SESSION_WRITE_MODE": "through", "DEDUPE_BACKEND": "sqlite"}
+if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+    for _key, _safe in _SHARED_STATE.items():
+        if os.environ.get(_key, "").strip().lower() != _safe:
+            if os.environ.get(_key):
+                logging.getLogger(__name__).warning(
+                    "%s=%s no es seguro con varios workers: uso %s", _key, os.environ[_key], _safe,
+                    extra={"event": "config.forced", "key": _key},
+                )
+            os.environ[_key] = _safe
+
+from app.db.conn import close_pool as close_db_pool, init_db  # noqa: E402
+from app.services import metrics  # noqa: E402
+from app.services.aio import AsyncWhatsAppClient, close_async_llama, get_async_llama  # noqa: E402
+from app.services.coalesce import COALESCE_MS, Coalescer  # noqa: E402
+from app.services.dedupe import DEDUPE_BACKEND, DEDUPE_CHECKS, get_dedupe  # noqa: E402
+from app.services.extract_cache import get_cache as get_extract_cache  # noqa: E402
+from app.services.extractor import aextract, get_extractor  # noqa: E402
+from app.services.log import log_context, setup_logging, stop_logging  # noqa: E402
+from app.services.menu import get_menu  # noqa: E402
+from app.services.order_writer import close_writer, get_writer as get_order_writer  # noqa: E402
+from app.services.outbox import OUTBOX_ENABLED, close_sender, get_sender as get_outbox_sender, outbox_rows  # noqa: E402
+from app.services.session_store import close_store, get_store as get_session_store  # noqa: E402
+from app.services.state_machine import handle_message, needs_extraction  # noqa: E402
+from app.services.webhook import WEBHOOK_FASTPATH, fast_ack, iter_messages, text_message  # noqa: E402
+from app.services.whatsapp_client import close_client  # noqa: E402
+from app.services.worker_pool import shard_for  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+APP_NAME = os.getenv("APP_NAME", "VENDOBOT")
+
+VERIFY_TOKEN = os.getenv("VERIFY_TOKEN", "")
+WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN", "")
+PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID", "")
+
+# threads para SQLite (sesiones, dedupe compartido, cache de extracción en disco)
+ASYNC_DB_WORKERS = int(os.getenv("ASYNC_DB_WORKERS", "4"))
+# tope de mensajes en proceso a la vez (el resto espera su turno en el loop)
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "256"))
+# cuánto espera el apagado a que terminen los mensajes en vuelo
+ASYNC_DRAIN_SEC = float(os.getenv("ASYNC_DRAIN_SEC", "20"))
+
+_LOCK_STRIPES = 256
+
+
+class AsyncBot:
+    """
+    Estado del proceso: executor de SQLite, locks por teléfono, cliente de
+    WhatsApp y el set de tareas en vuelo (para drenar al apagar).
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, ASYNC_DB_WORKERS), thread_name_prefix="asgi-db")
+        # mismo cliente => mismo lock: pasos en orden y sin pisarse el `data`
+        self.locks = [asyncio.Lock() for _ in range(_LOCK_STRIPES)]
+        self.inflight = asyncio.Semaphore(max(1, ASYNC_MAX_INFLIGHT))
+        self.tasks: set = set()
+        self.wa = AsyncWhatsAppClient(WHATSAPP_TOKEN, PHONE_NUMBER_ID)
+        # COALESCE_MS > 0: se crea en startup (necesita el loop)
+        self.coalescer: Coalescer | None = None
+        self.processed = 0
+        self.failed = 0
+        metrics.gauge("vendobot_queue_depth", "Trabajos esperando en cola", self._queue_depth, ("queue",))
+
+    def _queue_depth(self):
+        depth = {("asgi_tasks",): len(self.tasks), ("orders",): get_order_writer().stats()["pending"]}
+        if self.coalescer is not None:
+            depth[("coalesce",)] = self.coalescer.stats()["open"]
+        if OUTBOX_ENABLED:
+            depth[("outbox",)] = get_outbox_sender().stats()["pending"]
+        return depth
+
+    async def db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def seen_before(self, msg_id: str) -> bool:
+        # el dedupe en memoria es O(1) y sin I/O: no vale la pena saltar a un thread
+        if DEDUPE_BACKEND == "sqlite":
+            dup = await self.db(get_dedupe().seen, msg_id)
+        else:
+            dup = get_dedupe().seen(msg_id)
+        DEDUPE_CHECKS.inc("duplicate" if dup else "new")
+        return dup
+
+    async def forget(self, msg_id: str) -> None:
+        # mensaje rechazado: que el reintento de Meta no lo descarte como duplicado
+        if DEDUPE_BACKEND == "sqlite":
+            await self.db(get_dedupe().forget, msg_id)
+        else:
+            get_dedupe().forget(msg_id)
+
+    def dispatch(self, from_phone: str, text: str, msg_id: str = "") -> bool:
+        """
+        False si el mensaje no se tomó (coalescer ya cerrado): el webhook contesta 503.
+        """
+        if self.coalescer is not None:
+            return self.coalescer.add(from_phone, text, msg_id)
+        self.spawn(from_phone, text, msg_id)
+        return True
+
+    def spawn(self, from_phone: str, text: str, msg_id: str = "") -> None:
+        task = asyncio.create_task(self.process(from_phone, text, msg_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def process(self, from_phone: str, text: str, msg_id: str = "") -> None:
+        """
+        process_message() de app.main en versión async: lock del teléfono ->
+        load -> (IA afuera del step si hace falta) -> handle_message -> save -> envío.
+        Con OUTBOX_ENABLED la respuesta va con el save y la manda el sender del
+        outbox (threads, mismo que app.main); httpx queda para OUTBOX_ENABLED=0.
+        """
+        with log_context(from_phone, msg_id):
+            # primero el lock del teléfono: una ráfaga de un mismo cliente esperando
+            # su turno no ocupa los lugares de ASYNC_MAX_INFLIGHT de los demás
+            async with self.locks[shard_for(from_phone, _LOCK_STRIPES)], self.inflight:
+                try:
+                    store = get_session_store()
+                    state, data = await self.db(store.load, from_phone)
+
+                    extracted = None
+                    if needs_extraction(state, text):
+                        extracted = await aextract(text, self.executor)
+
+                    next_state, new_data, reply_text = handle_message(
+                        state, text, data, phone=from_phone, extracted=extracted
+                    )
+
+                    if OUTBOX_ENABLED:
+                        sending = get_outbox_sender().sending
+                        outbox = outbox_rows(from_phone, [reply_text], msg_id) if sending else []
+                        await self.db(store.save, from_phone, next_state, new_data, outbox)
+                    else:
+                        await self.db(store.save, from_phone, next_state, new_data)
+                        if reply_text:
+                            await self.send_whatsapp_text(from_phone, reply_text)
+                    self.processed += 1
+                except Exception:
+                    self.failed += 1
+                    logger.exception("async process exception", extra={"event": "asgi.process_failed"})
+
+    async def send_whatsapp_text(self, to_phone: str, text: str) -> None:
+        if not self.wa.configured:
+            logger.warning("WHATSAPP_TOKEN o PHONE_NUMBER_ID faltante. No envío nada.", extra={"event": "whatsapp.unconfigured"})
+            return
+        res = await self.wa.send_text(to_phone, text)
+        if res["ok"]:
+            logger.info("WhatsApp send", extra={"event": "whatsapp.sent", "status": res["status"], "attempts": res["attempts"]})
+        else:
+            logger.error("WhatsApp send failed", extra={
+                "event": "whatsapp.failed",
+                "status": res["status"],
+                "attempts": res["attempts"],
+                "error": res.get("error", ""),
+            })
+
+    async def startup(self) -> None:
+        # el listener de logs es un thread: se arranca acá, en el worker, nunca al importar
+        setup_logging()
+        # schema, menú, store/writer y dedupe tocan SQLite: fuera del loop
+        for fn in (init_db, get_menu, get_session_store, get_order_writer, get_dedupe):
+            await self.db(fn)
+        if OUTBOX_ENABLED:
+            await self.db(get_outbox_sender)
+        get_async_llama()
+        if COALESCE_MS > 0:
+            loop = asyncio.get_running_loop()
+            # el thread del coalescer despacha en orden; las tareas se crean en el loop en ese orden
+            self.coalescer = Coalescer(lambda phone, text, msg_id: loop.call_soon_threadsafe(self.spawn, phone, text, msg_id))
+        logger.info("asgi worker ready", extra={"event": "worker.ready", "ingest": "asgi"})
+
+    async def shutdown(self) -> None:
+        """
+        Mismo orden que app.main.shutdown: mensajes en vuelo -> flush de
+        sesiones/órdenes -> outbox -> clientes HTTP -> pool SQLite -> executor -> logs.
+        """
+        if self.coalescer is not None:
+            # ráfagas abiertas: salen ya; sleep(0) deja que el loop cree sus tareas
+            self.coalescer.close(ASYNC_DRAIN_SEC)
+            await asyncio.sleep(0)
+        if self.tasks:
+            _, pending = await asyncio.wait(set(self.tasks), timeout=ASYNC_DRAIN_SEC)
+            if pending:
+                logger.warning("asgi shutdown: mensajes sin terminar", extra={"event": "asgi.drain_incomplete", "pending": len(pending)})
+        for step in (close_store, close_writer, close_sender, close_client):
+            try:
+                await self.db(step)
+            except Exception as e:
+                logger.error("shutdown step failed", extra={"event": "shutdown.error", "step": step.__name__, "error": str(e)})
+        for step in (self.wa.aclose, close_async_llama):
+            try:
+                await step()
+            except Exception as e:
+                logger.error("shutdown step failed", extra={"event": "shutdown.error", "step": step.__name__, "error": str(e)})
+        try:
+            await self.db(close_db_pool)
+        except Exception as e:
+            logger.error("shutdown step failed", extra={"event": "shutdown.error", "step": "close_pool", "error": str(e)})
+        self.executor.shutdown(wait=True)
+        logger.info("asgi worker drained", extra={"event": "worker.drained"})
+        stop_logging()
+
+    def stats(self) -> dict:
+        return {
+            "ingest_mode": "asgi",
+            "inflight": len(self.tasks),
+            "coalesce": self.coalescer.stats() if self.coalescer is not None else None,
+            "processed": self.processed,
+            "failed": self.failed,
+            "whatsapp": self.wa.stats(),
+            "outbox": get_outbox_sender().stats() if OUTBOX_ENABLED else None,
+            "llama": get_async_llama().stats(),
+            "sessions": getattr(get_session_store(), "stats", dict)(),
+            "dedupe": get_dedupe().stats(),
+            "orders": get_order_writer().stats(),
+            "extract_cache": get_extract_cache().stats(),
+            "extractor": get_extractor().stats(),
+        }
+
+
+# =========================
+# HTTP (ASGI crudo, sin framework)
+# =========================
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, status: int, body, content_type: str = "application/json") -> None:
+    if not isinstance(body, (bytes, str)):
+        body = json.dumps(body, ensure_ascii=False)
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _webhook_verify(scope, send) -> None:
+    args = parse_qs(scope.get("query_string", b"").decode("utf-8", "replace"))
+    mode = args.get("hub.mode", [""])[0]
+    token = args.get("hub.verify_token", [""])[0]
+    challenge = args.get("hub.challenge", [""])[0]
+
+    if mode == "subscribe" and token == VERIFY_TOKEN:
+        await _respond(send, 200, challenge, "text/plain; charset=utf-8")
+    else:
+        await _respond(send, 403, "Forbidden", "text/plain; charset=utf-8")
+
+
+async def _webhook_receive(bot: AsyncBot, receive, send) -> None:
+    """
+    Dedupe + una tarea por mensaje (o por ráfaga, con COALESCE_MS); el 200 sale
+    sin esperar steps ni envíos.
+    """
+    try:
+        body = await _read_body(receive)
+        # statuses y no-texto: 200 sin parsear el JSON (ver app/services/webhook.py)
+        if WEBHOOK_FASTPATH and fast_ack(body):
+            await _respond(send, 200, {"ok": True})
+            return
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            payload = {}
+        rejected = False
+        for msg in iter_messages(payload if isinstance(payload, dict) else {}):
+            if await bot.seen_before(msg.get("id", "")):
+                # evita respuestas duplicadas
+                continue
+            parsed = text_message(msg)
+            # después de un rechazo, el resto del payload también vuelve con el reintento
+            if parsed and (rejected or not bot.dispatch(*parsed, msg.get("id", ""))):
+                rejected = True
+                await bot.forget(msg.get("id", ""))
+        if rejected:
+            await _respond(send, 503, {"ok": False, "error": "busy"})
+            return
+        await _respond(send, 200, {"ok": True})
+    except Exception as e:
+        logger.exception("webhook_receive exception", extra={"event": "webhook.error"})
+        await _respond(send, 500, {"ok": False, "error": str(e)})
+
+
+async def _lifespan(bot: AsyncBot, receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await bot.startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await bot.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def create_app():
+    """
+    App ASGI: `uvicorn app.asgi:app`. El AsyncBot se arma en el primer evento
+    (adentro del event loop del worker), nunca al importar; el logging arranca
+    en su startup.
+    """
+    bot = None
+
+    async def asgi_app(scope, receive, send):
+        nonlocal bot
+        if bot is None:
+            bot = AsyncBot()
+        kind = scope["type"]
+        if kind == "lifespan":
+            await _lifespan(bot, receive, send)
+            return
+        if kind != "http":
+            return
+
+        method, path = scope["method"], scope["path"]
+        if path == "/webhook" and method == "POST":
+            await _webhook_receive(bot, receive, send)
+        elif path == "/webhook" and method == "GET":
+            await _webhook_verify(scope, send)
+        elif path == "/health" and method == "GET":
+            await _respond(send, 200, {
+                "ok": True,
+                "app": APP_NAME,
+                "env_loaded": True,
+                "has_verify_token": bool(VERIFY_TOKEN),
+                "has_whatsapp_token": bool(WHATSAPP_TOKEN),
+                "has_phone_number_id": bool(PHONE_NUMBER_ID),
+            })
+        elif path == "/metrics" and method == "GET":
+            await _respond(send, 200, metrics.render(), metrics.CONTENT_TYPE)
+        elif path == "/debug/stats" and method == "GET":
+            await _respond(send, 200, bot.stats())
+        else:
+            await _respond(send, 404, {"ok": False, "error": "not found"})
+
+    return asgi_app
+
+
+app = create_app()
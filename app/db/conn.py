@@ -1,22 +1,126 @@
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
+# PRAGMAs por conexión (se aplican una sola vez, al abrirla)
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").strip().upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024)))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+
 
 def get_db_path() -> Path:
+    override = os.getenv("DB_PATH", "").strip()
+    if override:
+        return Path(override)
     # .../Vendobot/app/db/conn.py -> parents[2] = .../Vendobot
     base = Path(__file__).resolve().parents[2]
     return base / "vendobot.sqlite3"
 
 
-def get_connection() -> sqlite3.Connection:
-    db_path = get_db_path()
-    conn = sqlite3.connect(db_path)
+def _configure(conn: sqlite3.Connection) -> sqlite3.Connection:
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS};")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS};")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE};")
+    conn.execute("PRAGMA temp_store=MEMORY;")
     conn.execute("PRAGMA foreign_keys=ON;")
     return conn
 
 
+def get_connection() -> sqlite3.Connection:
+    """
+    Conexión nueva (el caller la cierra). Para el camino caliente usar get_pool().
+    """
+    db_path = get_db_path()
+    conn = sqlite3.connect(db_path)
+    return _configure(conn)
+
+
+class ConnectionPool:
+    """
+    Pool chico de conexiones SQLite de larga vida.
+
+    - cada conexión se abre y configura una sola vez (PRAGMAs incluidos)
+    - cached_statements: sqlite3 reusa el statement preparado para el mismo SQL
+    - una conexión la usa un solo thread por vez (check_same_thread=False es seguro así)
+    """
+
+    def __init__(self, db_path: Path | str, size: int = SQLITE_POOL_SIZE):
+        self.db_path = str(db_path)
+        self._size = max(1, int(size))
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        return _configure(conn)
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self._size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except Exception:
+            # si quedó una transacción abierta, no la devolvemos sucia al pool
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(get_db_path())
+    return _pool
+
+
 def init_db() -> None:
     schema_path = Path(__file__).resolve().parent / "schema.sql"
     sql = schema_path.read_text(encoding="utf-8")
@@ -27,3 +131,9 @@ def init_db() -> None:
         conn.commit()
     finally:
         conn.close()
+
+
+def close_pool() -> None:
+    p = _pool
+    if p is not None:
+        p.close()
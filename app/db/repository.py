@@ -1,54 +1,301 @@
 import json
+import time
 from datetime import datetime
 
-from app.db.conn import get_connection
+from app.db.conn import get_pool
 from app.domain.states import ConversationState
 
+# SQL constante: sqlite3 reusa el statement preparado por conexión (cached_statements)
+_SELECT_SESSION = "SELECT state, data, updated_at FROM sessions WHERE phone = ?"
+_UPSERT_SESSION = """
+    INSERT INTO sessions (phone, state, data, updated_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(phone) DO UPDATE SET
+      state = excluded.state,
+      data = excluded.data,
+      updated_at = excluded.updated_at
+"""
+_DELETE_SESSION = "DELETE FROM sessions WHERE phone = ?"
+_PURGE_SESSIONS = "DELETE FROM sessions WHERE state = ? AND updated_at <= ?"
 
-def get_session(phone: str) -> tuple[str, dict]:
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT state, data FROM sessions WHERE phone = ?", (phone,))
-        row = cur.fetchone()
+_SELECT_EXTRACT = "SELECT value FROM extract_cache WHERE key = ? AND expires_at > ?"
+_UPSERT_EXTRACT = """
+    INSERT INTO extract_cache (key, value, expires_at) VALUES (?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+"""
+_PURGE_EXTRACT = "DELETE FROM extract_cache WHERE expires_at <= ?"
+
+# inserta el wamid; si ya estaba pero venció, lo "renueva". rowcount 0 = duplicado vigente
+_MARK_SEEN = """
+    INSERT INTO seen_messages (msg_id, seen_at) VALUES (?, ?)
+    ON CONFLICT(msg_id) DO UPDATE SET seen_at = excluded.seen_at
+    WHERE seen_messages.seen_at <= ?
+"""
+_PURGE_SEEN = "DELETE FROM seen_messages WHERE seen_at <= ?"
+_FORGET_SEEN = "DELETE FROM seen_messages WHERE msg_id = ?"
+
+# idem_key repetido (mismo wamid entrante) = respuesta ya encolada: se ignora
+_INSERT_OUTBOX = """
+    INSERT OR IGNORE INTO outbox (idem_key, phone, body, next_at, created_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+_DUE_OUTBOX = """
+    SELECT id, idem_key, phone, body, attempts, created_at FROM outbox
+    WHERE status = 0 AND next_at <= ? ORDER BY id LIMIT ?
+"""
+_OUTBOX_SENT = "UPDATE outbox SET status = 1, attempts = attempts + 1, done_at = ?, last_error = NULL WHERE id = ?"
+_OUTBOX_RETRY = "UPDATE outbox SET attempts = attempts + 1, next_at = ?, last_error = ? WHERE id = ?"
+_OUTBOX_DEAD = "UPDATE outbox SET status = 2, attempts = attempts + 1, done_at = ?, last_error = ? WHERE id = ?"
+_OUTBOX_RELEASE = "UPDATE outbox SET next_at = ? WHERE id = ?"
+_PURGE_OUTBOX = "DELETE FROM outbox WHERE status <> 0 AND done_at <= ?"
+_PENDING_OUTBOX = "SELECT COUNT(*) FROM outbox WHERE status = 0"
+
+_INSERT_ORDER = """
+    INSERT INTO orders (
+      phone, items_json, delivery_method, address, name,
+      payment_method, proof_ok, total, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_ORDERS_BY_PHONE = """
+    SELECT * FROM orders WHERE phone = ? ORDER BY created_at DESC LIMIT ?
+"""
+_ORDERS_SINCE = """
+    SELECT * FROM orders WHERE created_at >= ? ORDER BY created_at ASC LIMIT ?
+"""
+
+
+def get_session(phone: str, done_before: str | None = None) -> tuple[str, dict]:
+    """
+    done_before: una sesión DONE sin cambios desde ese instante ISO se lee como
+    nueva (todavía no la borró purge_sessions).
+    """
+    with get_pool().connection() as conn:
+        row = conn.execute(_SELECT_SESSION, (phone,)).fetchone()
         if not row:
             return ConversationState.NEW, {}
+        if done_before and row["state"] == ConversationState.DONE.value and row["updated_at"] <= done_before:
+            return ConversationState.NEW, {}
         state = row["state"]
         data = json.loads(row["data"]) if row["data"] else {}
         return state, data
-    finally:
-        conn.close()
 
 
-def upsert_session(phone: str, state: str, data: dict) -> None:
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        now = datetime.utcnow().isoformat()
-        data_json = json.dumps(data or {}, ensure_ascii=False)
+def _outbox_params(outbox: list[tuple[str, str, str]]) -> list[tuple]:
+    now = time.time()
+    return [(key, phone, body, now, now) for key, phone, body in outbox]
+
+
+def upsert_session(phone: str, state: str, data: dict, outbox: list[tuple[str, str, str]] = ()) -> None:
+    """
+    outbox: respuestas (idem_key, phone, body) que quedan en la misma transacción que la sesión.
+    """
+    now = datetime.utcnow().isoformat()
+    data_json = json.dumps(data or {}, ensure_ascii=False)
 
-        cur.execute(
-            """
-            INSERT INTO sessions (phone, state, data, updated_at)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(phone) DO UPDATE SET
-              state = excluded.state,
-              data = excluded.data,
-              updated_at = excluded.updated_at
-            """,
-            (phone, state, data_json, now),
-        )
+    with get_pool().connection() as conn:
+        conn.execute(_UPSERT_SESSION, (phone, state, data_json, now))
+        if outbox:
+            conn.executemany(_INSERT_OUTBOX, _outbox_params(outbox))
         conn.commit()
-    finally:
-        conn.close()
+
+
+def upsert_sessions(rows: list[tuple[str, str, dict]], outbox: list[tuple[str, str, str]] = ()) -> int:
+    """
+    Upsert de varias sesiones (phone, state, data) en UNA transacción (un solo commit/fsync),
+    junto con sus respuestas pendientes (idem_key, phone, body).
+    """
+    if not rows and not outbox:
+        return 0
+    now = datetime.utcnow().isoformat()
+    params = [
+        (phone, state, json.dumps(data or {}, ensure_ascii=False), now)
+        for phone, state, data in rows
+    ]
+    with get_pool().connection() as conn:
+        conn.executemany(_UPSERT_SESSION, params)
+        if outbox:
+            conn.executemany(_INSERT_OUTBOX, _outbox_params(outbox))
+        conn.commit()
+    return len(params)
 
 
 def reset_session(phone: str) -> bool:
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("DELETE FROM sessions WHERE phone = ?", (phone,))
+    with get_pool().connection() as conn:
+        cur = conn.execute(_DELETE_SESSION, (phone,))
         conn.commit()
         return cur.rowcount > 0
-    finally:
-        conn.close()
+
+
+def purge_sessions(state: str, updated_before: str) -> int:
+    """
+    Borra las sesiones en `state` sin cambios desde un instante ISO (usa idx_sessions_state_updated).
+    """
+    with get_pool().connection() as conn:
+        cur = conn.execute(_PURGE_SESSIONS, (state, updated_before))
+        conn.commit()
+        return cur.rowcount
+
+
+def _order_params(order: dict) -> tuple:
+    proof_ok = order.get("proof_ok")
+    return (
+        order.get("phone"),
+        json.dumps(order.get("items") or [], ensure_ascii=False),
+        order.get("delivery_method"),
+        order.get("address") if order.get("delivery_method") == "envio" else None,
+        order.get("name"),
+        order.get("payment_method"),
+        None if proof_ok is None else int(bool(proof_ok)),
+        order.get("total"),
+        order.get("created_at") or datetime.utcnow().isoformat(),
+    )
+
+
+def insert_orders(orders: list[dict]) -> int:
+    """
+    Inserta varias órdenes en UNA transacción.
+    Cada orden: {"phone", "items", "delivery_method", "address", "name",
+                 "payment_method", "proof_ok", "total", "created_at"}
+    """
+    if not orders:
+        return 0
+    with get_pool().connection() as conn:
+        conn.executemany(_INSERT_ORDER, [_order_params(o) for o in orders])
+        conn.commit()
+    return len(orders)
+
+
+def _order_row(row) -> dict:
+    out = dict(row)
+    out["items"] = json.loads(out.pop("items_json") or "[]")
+    return out
+
+
+def get_orders_by_phone(phone: str, limit: int = 20) -> list[dict]:
+    """
+    Últimas órdenes de un cliente (usa idx_orders_phone_created).
+    """
+    with get_pool().connection() as conn:
+        rows = conn.execute(_ORDERS_BY_PHONE, (phone, limit)).fetchall()
+    return [_order_row(r) for r in rows]
+
+
+def get_orders_since(created_at: str, limit: int = 200) -> list[dict]:
+    """
+    Órdenes desde un instante ISO (tablero de cocina; usa idx_orders_created_at).
+    """
+    with get_pool().connection() as conn:
+        rows = conn.execute(_ORDERS_SINCE, (created_at, limit)).fetchall()
+    return [_order_row(r) for r in rows]
+
+
+def get_cached_extraction(key: str, now: float) -> dict | None:
+    with get_pool().connection() as conn:
+        row = conn.execute(_SELECT_EXTRACT, (key, now)).fetchone()
+    return json.loads(row["value"]) if row else None
+
+
+def put_cached_extraction(key: str, value: dict, expires_at: float) -> None:
+    with get_pool().connection() as conn:
+        conn.execute(_UPSERT_EXTRACT, (key, json.dumps(value, ensure_ascii=False), expires_at))
+        conn.commit()
+
+
+def purge_cached_extractions(now: float) -> int:
+    with get_pool().connection() as conn:
+        cur = conn.execute(_PURGE_EXTRACT, (now,))
+        conn.commit()
+        return cur.rowcount
+
+
+def mark_message_seen(msg_id: str, now: float, expired_before: float) -> bool:
+    """
+    True si el mensaje es nuevo (o su registro anterior ya venció), False si es duplicado.
+    Atómico entre procesos: el INSERT .. ON CONFLICT decide en una sola sentencia.
+    """
+    with get_pool().connection() as conn:
+        cur = conn.execute(_MARK_SEEN, (msg_id, now, expired_before))
+        conn.commit()
+        return cur.rowcount > 0
+
+
+def forget_message_seen(msg_id: str) -> None:
+    with get_pool().connection() as conn:
+        conn.execute(_FORGET_SEEN, (msg_id,))
+        conn.commit()
+
+
+def purge_seen_messages(expired_before: float) -> int:
+    with get_pool().connection() as conn:
+        cur = conn.execute(_PURGE_SEEN, (expired_before,))
+        conn.commit()
+        return cur.rowcount
+
+
+def enqueue_outbox(outbox: list[tuple[str, str, str]]) -> int:
+    """
+    Respuestas (idem_key, phone, body) sin sesión en la base (SESSION_BACKEND=memory).
+    """
+    if not outbox:
+        return 0
+    with get_pool().connection() as conn:
+        conn.executemany(_INSERT_OUTBOX, _outbox_params(outbox))
+        conn.commit()
+    return len(outbox)
+
+
+def claim_outbox(now: float, lease_until: float, limit: int) -> list[dict]:
+    """
+    Toma hasta `limit` respuestas vencidas, en orden de id, y las deja con
+    lease hasta lease_until (otro sender/worker no las ve mientras tanto).
+    De cada teléfono solo entran las que siguen a su pendiente más vieja: si
+    esa no venció (reintento en espera o tomada por otro), el teléfono espera.
+    BEGIN IMMEDIATE: leer y tomar es atómico entre procesos.
+    """
+    with get_pool().connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = [dict(r) for r in conn.execute(_DUE_OUTBOX, (now, limit)).fetchall()]
+        if rows:
+            phones = sorted({r["phone"] for r in rows})
+            marks = ",".join("?" * len(phones))
+            heads = dict(conn.execute(
+                f"SELECT phone, MIN(id) FROM outbox WHERE status = 0 AND phone IN ({marks}) GROUP BY phone",
+                phones,
+            ).fetchall())
+            ids = {r["id"] for r in rows}
+            rows = [r for r in rows if heads.get(r["phone"]) in ids]
+            conn.executemany(_OUTBOX_RELEASE, [(lease_until, r["id"]) for r in rows])
+        conn.commit()
+    return rows
+
+
+def finish_outbox(
+    sent: list[tuple[float, int]],
+    retry: list[tuple[float, str, int]],
+    dead: list[tuple[float, str, int]],
+    release: list[tuple[float, int]] = (),
+) -> None:
+    """
+    Resultado de un lote en UNA transacción: sent (done_at, id),
+    retry (next_at, error, id), dead (done_at, error, id) y release
+    (next_at, id): las que no se intentaron porque falló una anterior del mismo
+    teléfono; vuelven junto con esa.
+    """
+    with get_pool().connection() as conn:
+        conn.executemany(_OUTBOX_SENT, sent)
+        conn.executemany(_OUTBOX_RETRY, retry)
+        conn.executemany(_OUTBOX_DEAD, dead)
+        conn.executemany(_OUTBOX_RELEASE, release)
+        conn.commit()
+
+
+def purge_outbox(done_before: float) -> int:
+    with get_pool().connection() as conn:
+        cur = conn.execute(_PURGE_OUTBOX, (done_before,))
+        conn.commit()
+        return cur.rowcount
+
+
+def pending_outbox() -> int:
+    with get_pool().connection() as conn:
+        return conn.execute(_PENDING_OUTBOX).fetchone()[0]
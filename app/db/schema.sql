@@ -6,7 +6,10 @@ CREATE TABLE IF NOT EXISTS sessions (
   updated_at TEXT NOT NULL
 );
 
--- Tabla de órdenes (opcional / futura)
+-- purga de sesiones DONE vencidas (session_store.SqliteSessionStore.maybe_purge)
+CREATE INDEX IF NOT EXISTS idx_sessions_state_updated ON sessions(state, updated_at);
+
+-- Tabla de órdenes confirmadas (la escribe OrderWriter en lotes)
 CREATE TABLE IF NOT EXISTS orders (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   phone TEXT,
@@ -20,3 +23,42 @@ CREATE TABLE IF NOT EXISTS orders (
   created_at TEXT
 );
 
+-- historial por cliente y tablero de cocina (últimos pedidos)
+CREATE INDEX IF NOT EXISTS idx_orders_phone_created ON orders(phone, created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
+
+-- Cache de extracciones de la IA por texto normalizado (sobrevive reinicios)
+CREATE TABLE IF NOT EXISTS extract_cache (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL,
+  expires_at REAL NOT NULL
+);
+
+-- Dedupe de webhooks compartido entre workers (wamid ya procesados)
+CREATE TABLE IF NOT EXISTS seen_messages (
+  msg_id TEXT PRIMARY KEY,
+  seen_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_seen_messages_seen_at ON seen_messages(seen_at);
+
+-- Respuestas salientes: se escriben en la misma transacción que la sesión y
+-- las manda outbox.OutboxSender (sobreviven reinicios).
+-- status: 0 pendiente, 1 enviada, 2 descartada. next_at: próximo intento, o
+-- fin del lease mientras un sender la tiene tomada.
+CREATE TABLE IF NOT EXISTS outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  idem_key TEXT NOT NULL UNIQUE,
+  phone TEXT NOT NULL,
+  body TEXT NOT NULL,
+  status INTEGER NOT NULL DEFAULT 0,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_at REAL NOT NULL,
+  created_at REAL NOT NULL,
+  done_at REAL,
+  last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(next_at) WHERE status = 0;
+CREATE INDEX IF NOT EXISTS idx_outbox_phone ON outbox(phone, id) WHERE status = 0;
+CREATE INDEX IF NOT EXISTS idx_outbox_done ON outbox(done_at) WHERE status <> 0;
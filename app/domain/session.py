@@ -0,0 +1,180 @@
+# app/domain/session.py
+from __future__ import annotations
+
+import sys
+from typing import Any, Dict, Mapping, Tuple
+
+from app.domain.states import ConversationState
+
+# Representación compacta de una sesión en RAM (ver session_store.SessionTable).
+# El `data` de handle_message es un dict de dicts (~1 KB con dos ítems); acá:
+# - estado, modalidad y pago como códigos int (chicos: CPython los comparte)
+# - ítems del menú como tuplas (menu_id, qty, name, price): nombre y precio son
+#   los del momento en que se cargó el ítem (una recarga del menú no cambia un
+#   carrito en curso); mientras coinciden con el menú se guardan los mismos objetos
+# - ítems fuera del menú (IA) como (None, qty, name)
+# - cualquier otra cosa (claves nuevas, valores raros) va tal cual a `extra`
+# pack/unpack es ida y vuelta exacta: unpack(pack(d)) == d.
+_STATES = tuple(ConversationState)
+_STATE_CODE = {s.value: i for i, s in enumerate(_STATES)}
+STATE_DONE = _STATE_CODE[ConversationState.DONE.value]
+_DELIVERY = (None, "envio", "retiro")
+_DELIVERY_CODE = {v: i for i, v in enumerate(_DELIVERY) if v}
+_PAYMENT = (None, "efectivo", "transferencia")
+_PAYMENT_CODE = {v: i for i, v in enumerate(_PAYMENT) if v}
+
+_KNOWN = ("items", "delivery_method", "address", "payment_method", "name", "total")
+_MISSING = object()
+
+Item = Tuple[Any, ...]
+MenuItems = Mapping[str, Mapping[str, Any]]
+
+
+class Session:
+    __slots__ = ("state", "items", "delivery", "payment", "address", "name", "total", "extra", "touched")
+
+    def __init__(self, state: int = 0):
+        self.state = state
+        # None = sin clave "items"; () = "items": []
+        self.items: Tuple[Item, ...] | None = None
+        self.delivery = 0
+        self.payment = 0
+        self.address: str | None = None
+        self.name: str | None = None
+        self.total: int | None = None
+        self.extra: Dict[str, Any] | None = None
+        # lo actualiza SessionTable (monotonic)
+        self.touched = 0.0
+
+    @property
+    def state_value(self) -> str:
+        return _STATES[self.state].value
+
+    def nbytes(self) -> int:
+        """
+        Bytes propios de la sesión (objeto + lo que no comparte con el menú).
+        Los menu_id están internados, nombre y precio de un ítem del menú son
+        los objetos del menú y los ints chicos son compartidos: no suman.
+        """
+        n = sys.getsizeof(self) + sys.getsizeof(self.touched)
+        if self.items:
+            n += sys.getsizeof(self.items)
+            for it in self.items:
+                n += sys.getsizeof(it)
+                if it[0] is None:
+                    n += sys.getsizeof(it[2])
+        for s in (self.address, self.name):
+            if s is not None:
+                n += sys.getsizeof(s)
+        if self.total is not None:
+            n += sys.getsizeof(self.total)
+        if self.extra:
+            n += sys.getsizeof(self.extra) + sum(sys.getsizeof(v) for v in self.extra.values())
+        return n
+
+
+def _pack_items(items: Any, menu_items: MenuItems) -> Tuple[Item, ...] | None:
+    """
+    None si algún ítem no tiene la forma que arman _parse_items/_ai_items
+    (queda entero en `extra`).
+    """
+    if not isinstance(items, list):
+        return None
+    out = []
+    for it in items:
+        if not isinstance(it, dict):
+            return None
+        qty = it.get("qty")
+        if type(qty) is not int:
+            return None
+        item_id = it.get("id")
+        if item_id is None:
+            if len(it) != 2 or not isinstance(it.get("name"), str):
+                return None
+            out.append((None, qty, it["name"]))
+            continue
+        name, price = it.get("name"), it.get("price")
+        if len(it) != 4 or not isinstance(item_id, str) or not isinstance(name, str) or type(price) is not int:
+            return None
+        item = menu_items.get(item_id)
+        if item is not None:
+            # sin copias mientras el menú no cambie
+            name = item["name"] if item["name"] == name else name
+            price = item["price"] if item["price"] == price and type(item["price"]) is int else price
+        out.append((sys.intern(item_id), qty, name, price))
+    return tuple(out)
+
+
+def pack(state: Any, data: Dict[str, Any] | None, menu_items: MenuItems) -> Session:
+    """
+    (state, data) de handle_message -> Session. Estados desconocidos -> NEW
+    (handle_message los trata igual).
+    """
+    s = Session(_STATE_CODE.get(getattr(state, "value", state), 0))
+    data = data or {}
+    extra = {k: v for k, v in data.items() if k not in _KNOWN}
+
+    items = data.get("items", _MISSING)
+    if items is not _MISSING:
+        s.items = _pack_items(items, menu_items)
+        if s.items is None:
+            extra["items"] = items
+
+    for key, codes, attr in (
+        ("delivery_method", _DELIVERY_CODE, "delivery"),
+        ("payment_method", _PAYMENT_CODE, "payment"),
+    ):
+        value = data.get(key, _MISSING)
+        if value is _MISSING:
+            continue
+        code = codes.get(value) if isinstance(value, str) else None
+        if code:
+            setattr(s, attr, code)
+        else:
+            extra[key] = value
+
+    for key in ("address", "name"):
+        value = data.get(key, _MISSING)
+        if isinstance(value, str):
+            setattr(s, key, value)
+        elif value is not _MISSING:
+            extra[key] = value
+
+    total = data.get("total", _MISSING)
+    if type(total) is int:
+        s.total = total
+    elif total is not _MISSING:
+        extra["total"] = total
+
+    s.extra = extra or None
+    return s
+
+
+def unpack(s: Session, menu_items: MenuItems) -> Tuple[str, Dict[str, Any]]:
+    """
+    Session -> (state, data) nuevos (nada compartido con la sesión guardada).
+    """
+    data: Dict[str, Any] = {}
+    if s.items is not None:
+        items = []
+        for it in s.items:
+            if it[0] is None:
+                items.append({"name": it[2], "qty": it[1]})
+            else:
+                # tal cual se cargó, aunque el menú se haya recargado después
+                items.append({"id": it[0], "name": it[2], "qty": it[1], "price": it[3]})
+        data["items"] = items
+    if s.delivery:
+        data["delivery_method"] = _DELIVERY[s.delivery]
+    if s.address is not None:
+        data["address"] = s.address
+    if s.payment:
+        data["payment_method"] = _PAYMENT[s.payment]
+    if s.name is not None:
+        data["name"] = s.name
+    if s.total is not None:
+        data["total"] = s.total
+    if s.extra:
+        # copia de un nivel: handle_message reemplaza claves, no muta valores anidados de extra
+        data.update(s.extra)
+    return s.state_value, data
@@ -1,100 +1,242 @@
+import io
 import os
+import atexit
+import logging
+import threading
 import time
-import requests
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-
-from app.services.state_machine import handle_message
-from app.domain.states import ConversationState
+from flask import Blueprint, Flask, Response, request, jsonify
+from werkzeug.wsgi import get_input_stream
 
 # =========================
 # ENV
 # =========================
+# antes de importar los servicios: varios leen su config del entorno al importarse
 load_dotenv()
 
+from app.db.conn import close_pool as close_db_pool, init_db  # noqa: E402
+from app.db.repository import get_orders_by_phone  # noqa: E402
+from app.services import metrics  # noqa: E402
+from app.services.coalesce import COALESCE_MS, Coalescer  # noqa: E402
+from app.services.dedupe import DEDUPE_CHECKS, get_dedupe  # noqa: E402
+from app.services.extract_cache import get_cache as get_extract_cache  # noqa: E402
+from app.services.extractor import get_extractor  # noqa: E402
+from app.services.llama_client import close_batcher  # noqa: E402
+from app.services.log import log_context, setup_logging, stop_logging  # noqa: E402
+from app.services.menu import get_menu  # noqa: E402
+from app.services.order_writer import close_writer, get_writer as get_order_writer  # noqa: E402
+from app.services.outbox import OUTBOX_DRAIN_SEC, OUTBOX_ENABLED, close_sender, get_sender as get_outbox_sender, outbox_rows  # noqa: E402
+from app.services.session_store import close_store, get_store as get_session_store  # noqa: E402
+from app.services.state_machine import handle_message  # noqa: E402
+from app.services.webhook import WEBHOOK_FASTPATH, fast_ack, iter_messages, text_message  # noqa: E402
+from app.services.whatsapp_client import close_client, get_client as get_whatsapp_client  # noqa: E402
+from app.services.worker_pool import StripedLock, WorkerPool  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
 APP_NAME = os.getenv("APP_NAME", "VENDOBOT")
 
 VERIFY_TOKEN = os.getenv("VERIFY_TOKEN", "")
 WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN", "")
 PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID", "")
 
+# INGEST_MODE:
+# - "inline": procesa y responde dentro del request (comportamiento original)
+# - "queue": encola y devuelve 200 al toque; un pool de workers hace el step + envío
+INGEST_MODE = os.getenv("INGEST_MODE", "inline").strip().lower()
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "1000"))
+# cuánto espera el request si la cola del shard está llena antes de contestar 503 (Meta reintenta)
+INGEST_SUBMIT_TIMEOUT = float(os.getenv("INGEST_SUBMIT_TIMEOUT", "2"))
+
+# solo para `python -m app.main` (server de desarrollo); en producción va gunicorn.conf.py
+FLASK_DEBUG = os.getenv("FLASK_DEBUG", "0").strip() == "1"
+PORT = int(os.getenv("PORT", "5000"))
+
 # =========================
 # FLASK
 # =========================
-app = Flask(__name__)
-
-# memoria simple en RAM (por teléfono)
-sessions = {}
+bp = Blueprint("vendobot", __name__)
 
-# dedupe simple para webhooks (evita respuestas duplicadas)
-# guardamos msg_id -> timestamp, y limpiamos por TTL
-SEEN_MSG_TTL_SEC = 60 * 10
-seen_msg_ids = {}  # { "wamid.xxx": 1700000000.0 }
+# sesiones por teléfono: SESSION_BACKEND=sqlite (default, persiste) o memory
+# un lock por "franja" de teléfonos: mismo cliente => mismo lock (sin lock global)
+session_locks = StripedLock(256)
 
+# dedupe de webhooks (evita respuestas duplicadas): TTL + tope de memoria,
+# por proceso o compartido en SQLite (DEDUPE_BACKEND, ver dedupe.py)
 def _seen_before(msg_id: str) -> bool:
-    if not msg_id:
-        return False
-    now = time.time()
-    # cleanup ocasional
-    if len(seen_msg_ids) > 500:
-        cutoff = now - SEEN_MSG_TTL_SEC
-        for k, ts in list(seen_msg_ids.items()):
-            if ts < cutoff:
-                seen_msg_ids.pop(k, None)
-
-    if msg_id in seen_msg_ids:
-        return True
-
-    seen_msg_ids[msg_id] = now
-    return False
-
-
-def get_session(phone: str):
-    if phone not in sessions:
-        sessions[phone] = {
-            "state": ConversationState.NEW,
-            "data": {}
-        }
-    return sessions[phone]
+    dup = get_dedupe().seen(msg_id)
+    DEDUPE_CHECKS.inc("duplicate" if dup else "new")
+    return dup
 
 
 def send_whatsapp_text(to_phone: str, text: str):
     """
-    Envía un mensaje de texto usando WhatsApp Cloud API.
+    Envía un mensaje de texto usando WhatsApp Cloud API
+    (cliente compartido con keep-alive y reintentos, ver whatsapp_client.py).
     Requiere:
       - WHATSAPP_TOKEN
       - PHONE_NUMBER_ID
     """
     if not WHATSAPP_TOKEN or not PHONE_NUMBER_ID:
-        print("[WARN] WHATSAPP_TOKEN o PHONE_NUMBER_ID faltante. No envío nada.")
+        logger.warning("WHATSAPP_TOKEN o PHONE_NUMBER_ID faltante. No envío nada.", extra={"event": "whatsapp.unconfigured"})
         return
 
-    url = f"https://graph.facebook.com/v19.0/{PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": to_phone,
-        "type": "text",
-        "text": {"body": text}
-    }
+    res = get_whatsapp_client().send_text(to_phone, text)
+    if res["ok"]:
+        # uno por mensaje: muestreado (LOG_SAMPLE), el total exacto está en /metrics
+        logger.info("WhatsApp send", extra={"event": "whatsapp.sent", "status": res["status"], "attempts": res["attempts"]})
+    else:
+        logger.error("WhatsApp send failed", extra={
+            "event": "whatsapp.failed",
+            "status": res["status"],
+            "attempts": res["attempts"],
+            "error": res.get("error", ""),
+        })
 
-    try:
-        r = requests.post(url, headers=headers, json=payload, timeout=15)
-        if r.status_code >= 400:
-            print("[ERROR] WhatsApp send failed:", r.status_code, r.text)
-        else:
-            print("[OK] WhatsApp send:", r.status_code)
-    except Exception as e:
-        print("[ERROR] WhatsApp send exception:", str(e))
+
+def process_message(from_phone: str, text: str, msg_id: str = ""):
+    """
+    Un paso completo de conversación: state_machine + respuesta por WhatsApp.
+    Se ejecuta con el lock del teléfono tomado, así dos mensajes del mismo
+    cliente no se pisan el `data` y las respuestas salen en orden.
+
+    Con OUTBOX_ENABLED (default) la respuesta se guarda junto con la sesión y
+    la manda el sender del outbox: el paso no espera a Graph API.
+    """
+    store = get_session_store()
+    with log_context(from_phone, msg_id), session_locks.get(from_phone):
+        state, data = store.load(from_phone)
+
+        next_state, new_data, reply_text = handle_message(state, text, data, phone=from_phone)
+
+        if OUTBOX_ENABLED:
+            # get_outbox_sender: por si no pasó init_worker (test client, scripts)
+            sending = get_outbox_sender().sending
+            store.save(from_phone, next_state, new_data, outbox_rows(from_phone, [reply_text], msg_id) if sending else [])
+            return
+
+        store.save(from_phone, next_state, new_data)
+
+        if reply_text:
+            send_whatsapp_text(from_phone, reply_text)
+
+
+def iter_text_messages(payload: dict):
+    """
+    Recorre entry/changes/messages del webhook y devuelve (from_phone, text, msg_id)
+    para cada mensaje de texto nuevo (aplica dedupe).
+    """
+    for msg in iter_messages(payload):
+        msg_id = msg.get("id", "")
+        if _seen_before(msg_id):
+            # evita respuestas duplicadas
+            continue
+        parsed = text_message(msg)
+        if parsed:
+            yield parsed + (msg_id,)
+
+
+# =========================
+# INGEST (cola + workers)
+# =========================
+# Cada worker tiene su propia cola y los mensajes se reparten por teléfono:
+# un mismo cliente siempre cae en el mismo worker (orden estricto) y clientes
+# distintos se procesan en paralelo.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _run_job(job):
+    process_message(*job)
+
+
+def get_pool() -> WorkerPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = WorkerPool(
+                    _run_job,
+                    workers=INGEST_WORKERS,
+                    maxsize=INGEST_QUEUE_MAX,
+                    name="ingest",
+                )
+                pool.start()
+                atexit.register(pool.stop)
+                _pool = pool
+    return _pool
+
+
+def _queue_depth():
+    depth = {("orders",): get_order_writer().stats()["pending"]}
+    if _pool is not None:
+        depth[("ingest",)] = _pool.stats()["queue_depth"]
+    if _coalescer is not None:
+        depth[("coalesce",)] = _coalescer.stats()["open"]
+    if OUTBOX_ENABLED:
+        depth[("outbox",)] = get_outbox_sender().stats()["pending"]
+    return depth
+
+
+metrics.gauge("vendobot_queue_depth", "Trabajos esperando en cola", _queue_depth, ("queue",))
+
+
+def submit_message(from_phone: str, text: str, msg_id: str = "") -> bool:
+    if get_pool().submit((from_phone, text, msg_id), key=from_phone, timeout=INGEST_SUBMIT_TIMEOUT):
+        return True
+    # cola llena: nada de procesarlo inline (se adelantaría a lo que ya está
+    # encolado para el mismo teléfono); 503 y Meta lo vuelve a mandar
+    logger.warning("ingest queue full, rejecting", extra={
+        "event": "ingest.queue_full", "phone": from_phone, "msg_id": msg_id,
+    })
+    return False
+
+
+def dispatch_message(from_phone: str, text: str, msg_id: str = "") -> bool:
+    """
+    False si el mensaje no se tomó (cola llena, apagando): el webhook contesta 503 y Meta lo reintenta.
+    """
+    if COALESCE_MS > 0:
+        # la ráfaga sale al pool cuando cierra la ventana (aun con INGEST_MODE=inline)
+        return get_coalescer().add(from_phone, text, msg_id)
+    if INGEST_MODE == "queue":
+        return submit_message(from_phone, text, msg_id)
+    process_message(from_phone, text, msg_id)
+    return True
+
+
+# =========================
+# COALESCE (ráfagas del mismo cliente, ver coalesce.py)
+# =========================
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def submit_burst(from_phone: str, text: str, msg_id: str = "") -> bool:
+    """
+    Flush del Coalescer: encola sin bloquear su thread. Con el shard lleno
+    devuelve False y la ráfaga se reintenta en la ventana (nunca se procesa
+    fuera del orden del teléfono).
+    """
+    return get_pool().submit((from_phone, text, msg_id), key=from_phone)
+
+
+def get_coalescer() -> Coalescer:
+    global _coalescer
+    if _coalescer is None:
+        with _coalescer_lock:
+            if _coalescer is None:
+                coalescer = Coalescer(submit_burst)
+                atexit.register(coalescer.close)
+                _coalescer = coalescer
+    return _coalescer
 
 
 # =========================
 # HEALTH
 # =========================
-@app.route("/health", methods=["GET"])
+@bp.route("/health", methods=["GET"])
 def health():
     return jsonify({
         "ok": True,
@@ -109,7 +251,7 @@ def health():
 # =========================
 # WEBHOOK META (WhatsApp)
 # =========================
-@app.route("/webhook", methods=["GET"])
+@bp.route("/webhook", methods=["GET"])
 def webhook_verify():
     """
     Meta Webhook Verification
@@ -128,7 +270,7 @@ def webhook_verify():
     return "Forbidden", 403
 
 
-@app.route("/webhook", methods=["POST"])
+@bp.route("/webhook", methods=["POST"])
 def webhook_receive():
     """
     Recibe eventos de WhatsApp Cloud API.
@@ -137,78 +279,97 @@ def webhook_receive():
     payload = request.get_json(silent=True) or {}
 
     try:
-        entry = payload.get("entry", [])
-        for e in entry:
-            changes = e.get("changes", [])
-            for ch in changes:
-                value = ch.get("value", {})
-
-                messages = value.get("messages", [])
-                if not messages:
-                    continue
+        rejected = False
+        for from_phone, text, msg_id in iter_text_messages(payload):
+            # después de un rechazo, el resto del payload también vuelve con el reintento
+            if rejected or not dispatch_message(from_phone, text, msg_id):
+                rejected = True
+                get_dedupe().forget(msg_id)
+        if rejected:
+            return jsonify({"ok": False, "error": "busy"}), 503
 
-                for msg in messages:
-                    msg_id = msg.get("id", "")
-                    if _seen_before(msg_id):
-                        # evita respuestas duplicadas
-                        continue
-
-                    from_phone = msg.get("from")  # numero del cliente (string)
-                    msg_type = msg.get("type", "")
+        return jsonify({"ok": True}), 200
 
-                    # Solo soportamos texto por ahora (si no es texto, lo ignoramos)
-                    if msg_type != "text":
-                        continue
+    except Exception as e:
+        logger.exception("webhook_receive exception", extra={"event": "webhook.error"})
+        return jsonify({"ok": False, "error": str(e)}), 500
 
-                    text = (msg.get("text", {}) or {}).get("body", "")
-                    text = (text or "").strip()
 
-                    # Si llega vacío, no hagas nada (evita "No entendí" fantasma)
-                    if not from_phone or not text:
-                        continue
+_ACK = b'{"ok":true}\n'
 
-                    session = get_session(from_phone)
-                    state = session["state"]
-                    data = session["data"]
 
-                    next_state, new_data, reply_text = handle_message(state, text, data)
+class WebhookFastPath:
+    """
+    WSGI delante de Flask para POST /webhook: las entregas sin texto
+    (statuses, no-texto) se contestan 200 acá, sin request context, ruteo ni
+    JSON (ver fast_ack en app/services/webhook.py). Las demás siguen a Flask
+    con el body ya leído.
+    """
 
-                    session["state"] = next_state
-                    session["data"] = new_data
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
 
-                    if reply_text:
-                        send_whatsapp_text(from_phone, reply_text)
+    def __call__(self, environ, start_response):
+        if not WEBHOOK_FASTPATH or environ.get("REQUEST_METHOD") != "POST" or environ.get("PATH_INFO") != "/webhook":
+            return self.wsgi_app(environ, start_response)
+        body = get_input_stream(environ).read()
+        if fast_ack(body):
+            start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", str(len(_ACK)))])
+            return [_ACK]
+        environ["wsgi.input"] = io.BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+        return self.wsgi_app(environ, start_response)
 
-        return jsonify({"ok": True}), 200
 
-    except Exception as e:
-        print("[ERROR] webhook_receive exception:", str(e))
-        return jsonify({"ok": False, "error": str(e)}), 500
+@bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 # =========================
 # DEBUG ENDPOINTS
 # =========================
-@app.route("/debug/reset/<phone>", methods=["POST"])
+@bp.route("/debug/stats", methods=["GET"])
+def debug_stats():
+    return jsonify({
+        "ingest_mode": INGEST_MODE,
+        "queue": _pool.stats() if _pool is not None else None,
+        "coalesce": _coalescer.stats() if _coalescer is not None else None,
+        "whatsapp": get_whatsapp_client().stats(),
+        "outbox": get_outbox_sender().stats() if OUTBOX_ENABLED else None,
+        "sessions": getattr(get_session_store(), "stats", dict)(),
+        "dedupe": get_dedupe().stats(),
+        "orders": get_order_writer().stats(),
+        "extract_cache": get_extract_cache().stats(),
+        "extractor": get_extractor().stats(),
+    })
+
+
+@bp.route("/debug/reset/<phone>", methods=["POST"])
 def reset(phone):
-    sessions.pop(phone, None)
+    with session_locks.get(phone):
+        get_session_store().reset(phone)
     return jsonify({"ok": True, "phone": phone})
 
 
-@app.route("/debug/step", methods=["POST"])
+@bp.route("/debug/orders/<phone>", methods=["GET"])
+def debug_orders(phone):
+    return jsonify({"ok": True, "phone": phone, "orders": get_orders_by_phone(phone)})
+
+
+@bp.route("/debug/step", methods=["POST"])
 def debug_step():
     payload = request.get_json() or {}
     phone = payload.get("phone", "")
     text = payload.get("text", "")
 
-    session = get_session(phone)
-    state = session["state"]
-    data = session["data"]
+    store = get_session_store()
+    with session_locks.get(phone):
+        state, data = store.load(phone)
 
-    next_state, new_data, reply = handle_message(state, text, data)
+        next_state, new_data, reply = handle_message(state, text, data, phone=phone)
 
-    session["state"] = next_state
-    session["data"] = new_data
+        store.save(phone, next_state, new_data)
 
     return jsonify({
         "state_used": state,
@@ -219,10 +380,114 @@ def debug_step():
 
 
 # =========================
-# RUN
+# LIFECYCLE (una vez por worker)
+# =========================
+# Nada de lo de abajo corre al importar: cada worker (después del fork de
+# gunicorn) arma sus propios pools/threads/conexiones. Nunca se comparten
+# entre procesos.
+_worker_lock = threading.Lock()
+_worker_ready = False
+_worker_closed = False
+
+
+def init_worker():
+    """
+    Arranca el logging del proceso (listener de la cola de logs: un thread,
+    por eso acá y no al importar, que también pasa en el master de gunicorn
+    antes del fork) y calienta los servicios antes de la primera request: schema,
+    menú, store de sesiones, writer de órdenes, dedupe, cliente de WhatsApp,
+    sender del outbox (retoma lo que quedó pendiente) y (en INGEST_MODE=queue
+    o con COALESCE_MS) el pool de ingest. Idempotente.
+    """
+    global _worker_ready
+    with _worker_lock:
+        if _worker_ready:
+            return
+        setup_logging()
+        init_db()
+        get_menu()
+        get_session_store()
+        get_order_writer()
+        get_dedupe()
+        get_whatsapp_client()
+        if OUTBOX_ENABLED:
+            get_outbox_sender()
+        if INGEST_MODE == "queue" or COALESCE_MS > 0:
+            get_pool()
+        if COALESCE_MS > 0:
+            get_coalescer()
+        _worker_ready = True
+    logger.info("worker ready", extra={"event": "worker.ready", "ingest": INGEST_MODE})
+
+
+def shutdown(timeout: float = 20.0):
+    """
+    Drenado ordenado al apagar el worker:
+      0) las ráfagas abiertas salen ya, sin esperar su ventana
+      1) el pool de ingest termina lo encolado (pasos + envíos en vuelo)
+      2) flush de sesiones (con sus respuestas) y órdenes pendientes
+      3) el outbox manda lo pendiente (hasta OUTBOX_DRAIN_SEC; el resto queda en la tabla)
+      4) cierre de clientes HTTP (WhatsApp, llama) y del pool SQLite
+      5) flush de la cola de logs
+    `timeout` es el presupuesto de todo el apagado: cada paso con espera usa lo
+    que dejó el anterior. Idempotente; lo que no se creó no se toca.
+    """
+    global _worker_closed
+    with _worker_lock:
+        if _worker_closed:
+            return
+        _worker_closed = True
+    deadline = time.monotonic() + timeout
+
+    def left() -> float:
+        return max(0.0, deadline - time.monotonic())
+
+    if _coalescer is not None:
+        _coalescer.close(left())
+    if _pool is not None:
+        _pool.stop(left())
+    steps = (
+        ("close_store", close_store),
+        ("close_writer", lambda: close_writer(left())),
+        ("close_sender", lambda: close_sender(min(OUTBOX_DRAIN_SEC, left()))),
+        ("close_client", close_client),
+        ("close_batcher", close_batcher),
+        ("close_pool", close_db_pool),
+    )
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            logger.error("shutdown step failed", extra={"event": "shutdown.error", "step": name, "error": str(e)})
+    logger.info("worker drained", extra={"event": "worker.drained"})
+    # último: vacía la cola de logs
+    stop_logging()
+
+
+def create_app() -> Flask:
+    """
+    App factory: `gunicorn -c gunicorn.conf.py "app.main:create_app()"`.
+    No arranca threads: los servicios (y el logging) se crean perezosos en cada
+    worker; init_worker() los arranca y calienta.
+    """
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(bp)
+    flask_app.wsgi_app = WebhookFastPath(flask_app.wsgi_app)
+    return flask_app
+
+
+# compat: `from app.main import app` / server de desarrollo
+app = create_app()
+
+
+# =========================
+# RUN (desarrollo)
 # =========================
 if __name__ == "__main__":
     # IMPORTANTE:
-    # - use_reloader=False evita doble ejecución en debug (y mensajes duplicados)
-    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
+    # - use_reloader=False evita doble ejecución (y mensajes duplicados)
+    # - debug solo con FLASK_DEBUG=1, nunca en producción
+    init_worker()
+    atexit.register(shutdown)
+    app.run(host="0.0.0.0", port=PORT, debug=FLASK_DEBUG, use_reloader=False)
 
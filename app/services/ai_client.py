@@ -1,11 +1,23 @@
+from __future__ import annotations
+
 import os
-import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
 import requests
+from requests.adapters import HTTPAdapter
 
-LLAMA_BASE_URL = os.getenv("LLAMA_BASE_URL", "http://127.0.0.1:8080")
+from app.services.llama_client import LLAMA_CACHE_PROMPT, extract_first_json
+
+LLAMA_BASE_URL = os.getenv("LLAMA_BASE_URL", "http://127.0.0.1:8080").rstrip("/")
 LLAMA_MODEL = os.getenv("LLAMA_MODEL", "model")
-LLAMA_TIMEOUT = int(os.getenv("LLAMA_TIMEOUT", "20"))
+LLAMA_TIMEOUT = float(os.getenv("LLAMA_TIMEOUT", "20"))
+LLAMA_MAX_CONCURRENCY = int(os.getenv("LLAMA_MAX_CONCURRENCY", "4"))
 
+# Fijo y siempre primero (la plantilla de chat lo pone antes del mensaje del
+# cliente): con cache_prompt el server reusa su KV cache entre llamadas.
 SYSTEM_PROMPT = """Sos un extractor de datos para un bot de ventas.
 Tu tarea: devolver SOLO JSON válido, sin texto extra.
 
@@ -25,34 +37,69 @@ Reglas:
 - no inventes items
 """
 
-def llama_extract(text: str) -> dict:
-    if not text:
-        return {"ok": False}
+# sesión compartida (keep-alive) + tope de requests en vuelo
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_maxsize=LLAMA_MAX_CONCURRENCY, max_retries=0))
+_session.mount("https://", HTTPAdapter(pool_maxsize=LLAMA_MAX_CONCURRENCY, max_retries=0))
+_inflight = threading.BoundedSemaphore(LLAMA_MAX_CONCURRENCY)
+# el request corre acá y el caller espera con deadline de reloj: el timeout de
+# requests es por operación de socket y una respuesta que gotea lo pasaría
+_executor = ThreadPoolExecutor(max_workers=LLAMA_MAX_CONCURRENCY, thread_name_prefix="chat")
+
 
-    url = f"{LLAMA_BASE_URL}/v1/chat/completions"
-    payload = {
+def chat_payload(text: str) -> dict:
+    return {
         "model": LLAMA_MODEL,
         "messages": [
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": text}
         ],
         "temperature": 0,
+        "cache_prompt": LLAMA_CACHE_PROMPT,
     }
 
-    try:
-        r = requests.post(url, json=payload, timeout=LLAMA_TIMEOUT)
-        if r.status_code >= 400:
-            return {"ok": False, "error": f"{r.status_code} {r.text}"}
 
-        data = r.json()
-        content = data["choices"][0]["message"]["content"].strip()
+def parse_chat_response(data: dict) -> dict:
+    content = data["choices"][0]["message"]["content"].strip()
+    # el modelo debe devolver JSON directo (toleramos texto alrededor)
+    out = extract_first_json(content)
+    if isinstance(out, dict):
+        return out
+    return {"ok": False}
+
 
-        # el modelo debe devolver JSON directo
-        out = json.loads(content)
-        if isinstance(out, dict):
-            return out
+def _post_chat(text: str, deadline: float) -> dict:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise TimeoutError("chat deadline vencido esperando turno")
+    r = _session.post(f"{LLAMA_BASE_URL}/v1/chat/completions", json=chat_payload(text), timeout=remaining)
+    if r.status_code >= 400:
+        return {"ok": False, "error": f"{r.status_code} {r.text[:200]}"}
+    return parse_chat_response(r.json())
+
+
+def chat_extract(text: str, timeout: float | None = None) -> dict:
+    """
+    Backend "chat" del extractor (ver extractor.py): /v1/chat/completions con SYSTEM_PROMPT.
+    Todo (turno + request + respuesta) entra en `timeout` de reloj; si se pasa
+    devuelve error y el request sigue ocupando su lugar hasta que termine.
+    """
+    if not text:
         return {"ok": False}
 
+    budget = timeout or LLAMA_TIMEOUT
+    deadline = time.monotonic() + budget
+    if not _inflight.acquire(timeout=budget):
+        return {"ok": False, "error": "chat backend saturado"}
+    try:
+        fut = _executor.submit(_post_chat, text, deadline)
+    except Exception as e:
+        _inflight.release()
+        return {"ok": False, "error": str(e)}
+    fut.add_done_callback(lambda _: _inflight.release())
+    try:
+        return fut.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeout:
+        return {"ok": False, "error": f"chat deadline {budget}s"}
     except Exception as e:
         return {"ok": False, "error": str(e)}
-
@@ -0,0 +1,275 @@
+# app/services/aio.py
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict
+
+import httpx  # dependencia opcional: pip install ".[async]"
+
+from app.services import ai_client, llama_client
+from app.services.llama_client import (
+    StreamReader,
+    _parse_completion,
+    build_prompt,
+    completion_payload,
+    prompt_timings,
+)
+from app.services.stats import LatencyWindow
+from app.services.whatsapp_client import (
+    GRAPH_API_VERSION,
+    GRAPH_BASE_URL,
+    RETRY_STATUS,
+    SEND_SECONDS,
+    SENDS,
+    WHATSAPP_MAX_INFLIGHT,
+    WHATSAPP_ERROR_MAX,
+    WHATSAPP_MAX_RETRIES,
+    WHATSAPP_POOL_SIZE,
+    WHATSAPP_TIMEOUT,
+    backoff_delay,
+    text_payload,
+)
+
+# Clientes HTTP async para el server ASGI (asgi.py). Misma config, reintentos y
+# formato de respuesta que whatsapp_client.py / llama_client.py / ai_client.py,
+# pero cada envío o extracción en espera es una corrutina, no un thread.
+
+
+class AsyncWhatsAppClient:
+    """
+    Gemelo async de WhatsAppClient: httpx.AsyncClient con keep-alive,
+    reintentos con backoff en 429/5xx y errores de conexión (no en timeouts de
+    lectura, ver RETRY_STATUS) y tope de envíos en vuelo por número.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        phone_number_id: str,
+        base_url: str = GRAPH_BASE_URL,
+        api_version: str = GRAPH_API_VERSION,
+        timeout: float = WHATSAPP_TIMEOUT,
+        max_retries: int = WHATSAPP_MAX_RETRIES,
+        max_inflight: int = WHATSAPP_MAX_INFLIGHT,
+        pool_size: int = WHATSAPP_POOL_SIZE,
+    ):
+        self.token = token
+        self.phone_number_id = phone_number_id
+        self.base_url = base_url.rstrip("/")
+        self.api_version = api_version
+        self.max_retries = max(0, int(max_retries))
+        self.max_inflight = max(1, int(max_inflight))
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+        )
+        self._inflight: Dict[str, asyncio.Semaphore] = {}
+
+        self.latency = LatencyWindow()
+        self.status_counts: Dict[str, int] = {}
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.token and self.phone_number_id)
+
+    def _count(self, status: str, ok: bool, retried: int, elapsed: float) -> None:
+        # todo corre en el event loop: sin locks
+        self.latency.add(elapsed)
+        SEND_SECONDS.observe(elapsed)
+        SENDS.inc(status)
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        self.retries += retried
+        if ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+
+    async def send_text(self, to_phone: str, text: str, phone_number_id: str | None = None) -> Dict[str, Any]:
+        pnid = phone_number_id or self.phone_number_id
+        url = f"{self.base_url}/{self.api_version}/{pnid}/messages"
+        payload = text_payload(to_phone, text)
+        sem = self._inflight.setdefault(pnid, asyncio.Semaphore(self.max_inflight))
+
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            status = None
+            error = ""
+            retry_after = None
+            async with sem:
+                try:
+                    r = await self._client.post(url, json=payload)
+                    status = r.status_code
+                    if status < 400:
+                        self._count(str(status), True, attempt, time.perf_counter() - started)
+                        return {"ok": True, "status": status, "attempts": attempt + 1}
+                    error = r.text[:WHATSAPP_ERROR_MAX]
+                    retry_after = r.headers.get("Retry-After")
+                    retryable = status in RETRY_STATUS
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                    # el request no llegó a Graph
+                    error = str(e) or type(e).__name__
+                    retryable = True
+                except httpx.HTTPError as e:
+                    # ReadTimeout y compañía: el mensaje pudo haber salido
+                    error = str(e) or type(e).__name__
+                    retryable = False
+
+            if not retryable or attempt >= self.max_retries:
+                self._count(str(status) if status else "error", False, attempt, time.perf_counter() - started)
+                return {"ok": False, "status": status, "attempts": attempt + 1, "error": error, "retryable": retryable}
+
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
+            attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "status": dict(self.status_counts),
+            "latency_ms": self.latency.percentiles(),
+        }
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+class AsyncLlama:
+    """
+    Extracción contra el server de completions con httpx: stream + corte al
+    cerrar el JSON + gramática del menú + prefix cache con slot fijo (igual
+    que LlamaBatcher), con un tope de requests en vuelo = slots del server.
+    """
+
+    def __init__(
+        self,
+        base_url: str = llama_client.LLAMA_BASE_URL,
+        max_concurrency: int = llama_client.LLAMA_MAX_CONCURRENCY,
+        stream: bool = llama_client.LLAMA_STREAM,
+        pin_slots: bool = llama_client.LLAMA_PIN_SLOTS,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.stream = stream
+        self.pin_slots = pin_slots
+        # ids de slot libres: hace de semáforo y de id_slot a la vez
+        self._slots: asyncio.Queue = asyncio.Queue()
+        for i in range(max(1, int(max_concurrency))):
+            self._slots.put_nowait(i)
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self.ttr = LatencyWindow()
+        self.completions = 0
+        self.tokens = 0
+        self.early_stops = 0
+        self.prompt_latency = LatencyWindow()
+        self.ttft = LatencyWindow()
+
+    async def complete(self, prompt: str, timeout: float) -> str:
+        url = f"{self.base_url}/v1/completions"
+        slot = await self._slots.get()
+        try:
+            payload = completion_payload(prompt, slot=slot if self.pin_slots else None, stream=self.stream)
+            started = time.perf_counter()
+            first_at = None
+            if not self.stream:
+                r = await self._client.post(url, json=payload, timeout=timeout)
+                r.raise_for_status()
+                js = r.json()
+                text = (js.get("choices") or [{}])[0].get("text", "")
+                tokens, early = int((js.get("usage") or {}).get("completion_tokens") or 0), False
+            else:
+                reader = StreamReader()
+                # salir del `async with` sin leer todo cierra la conexión: el server deja de generar
+                async with self._client.stream("POST", url, json=payload, timeout=timeout) as r:
+                    r.raise_for_status()
+                    async for line in r.aiter_lines():
+                        if reader.feed(line):
+                            break
+                text, tokens, early = reader.text, reader.tokens, reader.early
+                js, first_at = reader.timings or {}, reader.first_at
+        finally:
+            self._slots.put_nowait(slot)
+        if first_at is not None:
+            self.ttft.add(first_at - started)
+        prompt_ms, _ = prompt_timings(js)
+        if prompt_ms is not None:
+            self.prompt_latency.add(prompt_ms / 1000.0)
+        self.ttr.add(time.perf_counter() - started)
+        self.completions += 1
+        self.tokens += tokens
+        self.early_stops += int(early)
+        return text
+
+    async def chat(self, text: str, timeout: float) -> Dict[str, Any]:
+        slot = await self._slots.get()
+        try:
+            r = await self._client.post(
+                f"{self.base_url}/v1/chat/completions", json=ai_client.chat_payload(text), timeout=timeout
+            )
+        finally:
+            self._slots.put_nowait(slot)
+        if r.status_code >= 400:
+            return {"ok": False, "error": f"{r.status_code} {r.text[:200]}"}
+        return ai_client.parse_chat_response(r.json())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stream": self.stream,
+            "completions": self.completions,
+            "avg_tokens": round(self.tokens / self.completions, 1) if self.completions else 0.0,
+            "early_stops": self.early_stops,
+            "time_to_result_ms": self.ttr.percentiles(),
+            "prompt_ms": self.prompt_latency.percentiles(),
+            "time_to_first_token_ms": self.ttft.percentiles(),
+        }
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+# uno por proceso/event loop; lo crea el primer uso y lo cierra asgi.py al apagar
+_llama: AsyncLlama | None = None
+
+
+def get_async_llama() -> AsyncLlama:
+    global _llama
+    if _llama is None:
+        _llama = AsyncLlama()
+    return _llama
+
+
+async def close_async_llama() -> None:
+    global _llama
+    if _llama is not None:
+        await _llama.aclose()
+        _llama = None
+
+
+async def allama_extract(user_text: str, timeout: float | None = None) -> Dict[str, Any]:
+    """
+    Backend async "completions" (ver extractor.aextract).
+    """
+    try:
+        text = await get_async_llama().complete(build_prompt(user_text), timeout or llama_client.LLAMA_DEADLINE_SEC)
+        return _parse_completion(text)
+    except Exception as e:
+        return {"ok": False, "error": str(e) or type(e).__name__}
+
+
+async def achat_extract(text: str, timeout: float | None = None) -> Dict[str, Any]:
+    """
+    Backend async "chat" (ver extractor.aextract).
+    """
+    if not text:
+        return {"ok": False}
+    try:
+        return await get_async_llama().chat(text, timeout or ai_client.LLAMA_TIMEOUT)
+    except Exception as e:
+        return {"ok": False, "error": str(e) or type(e).__name__}
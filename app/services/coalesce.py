@@ -0,0 +1,219 @@
+# app/services/coalesce.py
+from __future__ import annotations
+
+import heapq
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.services.metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+# Ráfagas del mismo cliente ("2 hamburguesas", "y una coca", "para envio") en
+# un solo paso de conversación: los mensajes que llegan dentro de la ventana
+# se juntan (en orden, uno por línea) y salen como UN handle_message, UNA
+# extracción de IA como mucho y UNA respuesta.
+# - la ventana se reinicia con cada mensaje (debounce) ...
+# - ... pero nunca se espera más de COALESCE_MAX_MS desde el primero (tope de latencia)
+# - con COALESCE_MAX_MSGS mensajes juntos sale sin esperar
+# Es por proceso: con varios workers una ráfaga puede repartirse entre procesos
+# y cada parte sale por su lado. COALESCE_MS=0 (default): cada mensaje es un paso.
+COALESCE_MS = int(os.getenv("COALESCE_MS", "0"))
+COALESCE_MAX_MS = int(os.getenv("COALESCE_MAX_MS", "4000"))
+COALESCE_MAX_MSGS = int(os.getenv("COALESCE_MAX_MSGS", "10"))
+
+COALESCE_BATCH = histogram(
+    "vendobot_coalesce_batch_messages", "Mensajes por paso de conversación", buckets=(1, 2, 3, 4, 6, 8, 10, 16)
+)
+# desde el primer mensaje de la ráfaga hasta que sale a procesarse
+COALESCE_WAIT = histogram("vendobot_coalesce_wait_seconds", "Espera de una ráfaga en la ventana")
+# why = quiet (terminó la ventana) | cap (tope de latencia) | full (tope de mensajes) | retry | close
+COALESCE_FLUSHES = counter("vendobot_coalesce_flushes", "Ráfagas despachadas por motivo", ("why",))
+# flush devolvió False (cola llena): la ráfaga se reintenta
+COALESCE_RETRIES = counter("vendobot_coalesce_retries", "Ráfagas que el pool no tomó y se reintentan")
+
+# flush(phone, text, msg_id): texto unido y wamid del primer mensaje. No tiene
+# que bloquear: si no hay lugar (ej: shard del pool lleno) devuelve False y la
+# ráfaga vuelve a la ventana para reintentarse.
+Flush = Callable[[str, str, str], Any]
+
+# reintento de una ráfaga que `flush` no tomó (mínimo, si la ventana es más corta)
+_RETRY_SEC = 0.05
+
+
+class _Burst:
+    __slots__ = ("texts", "msg_id", "first", "due", "why")
+
+    def __init__(self, msg_id: str, now: float):
+        self.texts: List[str] = []
+        self.msg_id = msg_id
+        self.first = now
+        self.due = now
+        self.why = "quiet"
+
+
+class Coalescer:
+    """
+    Una ráfaga abierta por teléfono y un thread que despacha las vencidas.
+    Despacha un solo thread, en orden de vencimiento: dos ráfagas del mismo
+    teléfono nunca salen desordenadas (la segunda se abre recién cuando la
+    primera ya salió). `flush` no bloquea: si devuelve False la ráfaga vuelve
+    a abrirse (con lo que haya llegado mientras tanto detrás) y se reintenta,
+    sin frenar los timers de los demás teléfonos.
+    """
+
+    def __init__(
+        self,
+        flush: Flush,
+        window_ms: int = COALESCE_MS,
+        max_ms: int = COALESCE_MAX_MS,
+        max_msgs: int = COALESCE_MAX_MSGS,
+    ):
+        self._flush = flush
+        self._window = max(0, int(window_ms)) / 1000.0
+        self._max_wait = max(self._window, max(0, int(max_ms)) / 1000.0)
+        self._max_msgs = max(1, int(max_msgs))
+        self._cond = threading.Condition()
+        self._open: Dict[str, _Burst] = {}
+        # (due, seq, phone); entradas viejas (la ráfaga se estiró o ya salió) se saltean
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = 0
+        self._stopped = False
+        self._closed = False
+
+        self.messages = 0
+        self.flushed = 0
+
+        self._thread = threading.Thread(target=self._run, name="coalesce", daemon=True)
+        self._thread.start()
+
+    def add(self, phone: str, text: str, msg_id: str = "") -> bool:
+        """
+        Suma el mensaje a la ráfaga abierta del teléfono. False si ya se cerró
+        (el caller lo rechaza y Meta lo reintenta).
+        """
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                return False
+            burst = self._open.get(phone)
+            if burst is None:
+                burst = self._open[phone] = _Burst(msg_id, now)
+            burst.texts.append(text)
+            self.messages += 1
+            cap = burst.first + self._max_wait
+            if len(burst.texts) >= self._max_msgs:
+                burst.due, burst.why = now, "full"
+            elif now + self._window >= cap:
+                burst.due, burst.why = cap, "cap"
+            else:
+                burst.due = now + self._window
+            self._push(phone, burst)
+        return True
+
+    def _push(self, phone: str, burst: _Burst) -> None:
+        self._seq += 1
+        heapq.heappush(self._heap, (burst.due, self._seq, phone))
+        if self._heap[0][1] == self._seq:
+            # vence antes que lo que esperaba el thread
+            self._cond.notify()
+
+    def _take_due(self, now: float) -> List[Tuple[str, _Burst]]:
+        out = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, phone = heapq.heappop(self._heap)
+            burst = self._open.get(phone)
+            if burst is not None and burst.due == due:
+                out.append((phone, self._open.pop(phone)))
+        return out
+
+    def _dispatch(self, phone: str, burst: _Burst, why: str) -> bool:
+        """
+        Siempre fuera del lock. False si `flush` no la tomó (hay que reintentarla).
+        """
+        try:
+            if self._flush(phone, "\n".join(burst.texts), burst.msg_id) is False:
+                COALESCE_RETRIES.inc()
+                return False
+        except Exception:
+            logger.exception("coalesce flush failed", extra={
+                "event": "coalesce.flush_failed", "phone": phone, "msg_id": burst.msg_id,
+            })
+        COALESCE_BATCH.observe(len(burst.texts))
+        COALESCE_WAIT.observe(time.monotonic() - burst.first)
+        COALESCE_FLUSHES.inc(why)
+        self.flushed += 1
+        return True
+
+    def _reopen(self, phone: str, burst: _Burst) -> None:
+        """
+        Ráfaga que flush no tomó: vuelve a la ventana delante de lo que llegó
+        mientras tanto del mismo teléfono, y vence en un rato.
+        """
+        with self._cond:
+            newer = self._open.get(phone)
+            if newer is not None:
+                burst.texts.extend(newer.texts)
+            burst.due = time.monotonic() + max(self._window, _RETRY_SEC)
+            burst.why = "retry"
+            self._open[phone] = burst
+            self._push(phone, burst)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    now = time.monotonic()
+                    due = self._take_due(now)
+                    if due:
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+            # fuera del lock: add() no espera a que el flush encole
+            for phone, burst in due:
+                if not self._dispatch(phone, burst, burst.why):
+                    self._reopen(phone, burst)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Rechaza mensajes nuevos (add devuelve False), frena el thread y
+        despacha ya todas las ráfagas abiertas, en orden de llegada; las que
+        flush no toma se reintentan hasta `timeout` y las que no entraron se
+        loguean como perdidas. Idempotente.
+        """
+        deadline = time.monotonic() + max(0.0, timeout)
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        with self._cond:
+            pending = sorted(self._open.items(), key=lambda kv: kv[1].first)
+            self._open.clear()
+            self._heap.clear()
+        for i, (phone, burst) in enumerate(pending):
+            while not self._dispatch(phone, burst, "close"):
+                if time.monotonic() + _RETRY_SEC > deadline:
+                    for lost_phone, lost in pending[i:]:
+                        logger.error("coalesce burst dropped on close", extra={
+                            "event": "coalesce.lost", "phone": lost_phone, "msg_id": lost.msg_id,
+                            "messages": len(lost.texts),
+                        })
+                    return
+                time.sleep(_RETRY_SEC)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "window_ms": round(self._window * 1000),
+                "max_ms": round(self._max_wait * 1000),
+                "open": len(self._open),
+                "messages": self.messages,
+                "steps": self.flushed,
+            }
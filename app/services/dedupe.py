@@ -0,0 +1,168 @@
+# app/services/dedupe.py
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+
+from app.db import repository
+from app.db.conn import init_db
+from app.services.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+# Meta reintenta entregas: mismo wamid puede llegar varias veces.
+# DEDUPE_BACKEND:
+# - "memory": por proceso (default)
+# - "sqlite": tabla seen_messages, compartida entre workers de gunicorn
+DEDUPE_BACKEND = os.getenv("DEDUPE_BACKEND", "memory").strip().lower()
+DEDUPE_TTL_SEC = float(os.getenv("DEDUPE_TTL_SEC", "600"))
+# tope duro de ids en memoria (los más viejos salen primero aunque no hayan vencido)
+DEDUPE_MAX = int(os.getenv("DEDUPE_MAX", "50000"))
+# sqlite: cada cuánto se borran los vencidos
+DEDUPE_PURGE_SEC = float(os.getenv("DEDUPE_PURGE_SEC", "60"))
+
+# lo incrementa quien consulta (app.main / app.asgi): result = new | duplicate
+DEDUPE_CHECKS = counter("vendobot_dedupe_checks", "Mensajes entrantes según el dedupe", ("result",))
+
+
+class MemoryDedupe:
+    """
+    msg_id -> timestamp en orden de llegada. Como los timestamps crecen con el
+    orden, los vencidos están siempre al principio: se sacan desde la cabeza
+    y el costo por mensaje es O(1) amortizado (nada de recorrer todo el dict).
+    """
+
+    def __init__(self, ttl_sec: float = DEDUPE_TTL_SEC, max_entries: int = DEDUPE_MAX):
+        self.ttl = ttl_sec
+        self.max_entries = max(1, int(max_entries))
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.duplicates = 0
+        self.evicted = 0
+
+    def _expire(self, now: float) -> None:
+        seen = self._seen
+        cutoff = now - self.ttl
+        while seen:
+            _, ts = next(iter(seen.items()))
+            if ts > cutoff:
+                break
+            seen.popitem(last=False)
+        while len(seen) >= self.max_entries:
+            seen.popitem(last=False)
+            self.evicted += 1
+
+    def seen(self, msg_id: str, now: float | None = None) -> bool:
+        """
+        True si msg_id ya pasó dentro del TTL. Si no, lo registra y devuelve False.
+        """
+        if not msg_id:
+            return False
+        now = time.time() if now is None else now
+        with self._lock:
+            ts = self._seen.get(msg_id)
+            if ts is not None and now - ts < self.ttl:
+                self.duplicates += 1
+                return True
+            if ts is not None:
+                del self._seen[msg_id]
+            self._expire(now)
+            self._seen[msg_id] = now
+            return False
+
+    def forget(self, msg_id: str) -> None:
+        """
+        Lo saca del dedupe: el mensaje no se procesó (ej: 503) y el reintento de Meta tiene que entrar.
+        """
+        with self._lock:
+            self._seen.pop(msg_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "size": len(self._seen),
+                "max": self.max_entries,
+                "duplicates": self.duplicates,
+                "evicted": self.evicted,
+            }
+
+
+class SqliteDedupe:
+    """
+    Dedupe compartido: un INSERT .. ON CONFLICT por mensaje en seen_messages.
+    Delante tiene un MemoryDedupe local: un duplicado que ya vio ESTE proceso
+    se descarta sin ir a la base (el caso común: Meta reintenta al mismo worker).
+    """
+
+    def __init__(self, ttl_sec: float = DEDUPE_TTL_SEC, max_entries: int = DEDUPE_MAX):
+        init_db()
+        self.ttl = ttl_sec
+        self._local = MemoryDedupe(ttl_sec, max_entries)
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+        self.duplicates = 0
+        self.db_checks = 0
+
+    def seen(self, msg_id: str, now: float | None = None) -> bool:
+        if not msg_id:
+            return False
+        now = time.time() if now is None else now
+        if self._local.seen(msg_id, now):
+            with self._lock:
+                self.duplicates += 1
+            return True
+        try:
+            fresh = repository.mark_message_seen(msg_id, now, now - self.ttl)
+        except Exception as e:
+            # sin base no bloqueamos mensajes: queda solo el dedupe local
+            logger.error("dedupe db check failed", extra={"event": "dedupe.db_failed", "error": str(e)})
+            return False
+        with self._lock:
+            self.db_checks += 1
+            if not fresh:
+                self.duplicates += 1
+            purge = now - self._purged_at >= DEDUPE_PURGE_SEC
+            if purge:
+                self._purged_at = now
+        if purge:
+            try:
+                repository.purge_seen_messages(now - self.ttl)
+            except Exception as e:
+                logger.error("dedupe purge failed", extra={"event": "dedupe.purge_failed", "error": str(e)})
+        return not fresh
+
+    def forget(self, msg_id: str) -> None:
+        if not msg_id:
+            return
+        self._local.forget(msg_id)
+        try:
+            repository.forget_message_seen(msg_id)
+        except Exception as e:
+            logger.error("dedupe forget failed", extra={"event": "dedupe.db_failed", "error": str(e)})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "local": self._local.stats(),
+                "duplicates": self.duplicates,
+                "db_checks": self.db_checks,
+            }
+
+
+_dedupe = None
+_dedupe_lock = threading.Lock()
+
+
+def get_dedupe():
+    global _dedupe
+    if _dedupe is None:
+        with _dedupe_lock:
+            if _dedupe is None:
+                _dedupe = SqliteDedupe() if DEDUPE_BACKEND == "sqlite" else MemoryDedupe()
+    return _dedupe
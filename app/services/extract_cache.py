@@ -0,0 +1,265 @@
+# app/services/extract_cache.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from app.db import repository
+from app.db.conn import init_db
+from app.services.menu import get_menu
+from app.services.menu_matcher import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Muchos clientes mandan exactamente lo mismo ("2 hamburguesas dobles y una coca"):
+# cacheamos la extracción por texto normalizado para no pagarle al modelo otra vez.
+# La clave lleva la versión del menú (mtime del snapshot): después de una recarga
+# no sale una extracción con ids/nombres que ya no existen.
+EXTRACT_CACHE_TTL_SEC = float(os.getenv("EXTRACT_CACHE_TTL_SEC", "3600"))
+# resultados "no encontré nada" ({"ok": false}) viven menos
+EXTRACT_CACHE_NEG_TTL_SEC = float(os.getenv("EXTRACT_CACHE_NEG_TTL_SEC", "300"))
+EXTRACT_CACHE_MAX = int(os.getenv("EXTRACT_CACHE_MAX", "5000"))
+# 1 = también en SQLite (tabla extract_cache), sobrevive reinicios
+EXTRACT_CACHE_PERSIST = os.getenv("EXTRACT_CACHE_PERSIST", "0").strip() == "1"
+
+
+def normalize_key(text: str) -> str:
+    """
+    "2 Hamburguesas,  1 coca!" -> "2 hamburguesas 1 coca"
+    """
+    return " ".join(tokenize(text))
+
+
+class _Flight:
+    __slots__ = ("event", "result")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Dict[str, Any] | None = None
+
+
+class ExtractionCache:
+    """
+    Cache LRU con TTL delante del extractor.
+
+    - get_or_compute(): hit en RAM -> hit en SQLite (si está activo) -> llamada al modelo
+    - single-flight: si llegan N pedidos iguales a la vez, uno llama al modelo y
+      el resto espera ese mismo resultado
+    - resultados con "error" (timeout, server caído) no se guardan
+    - al cambiar la versión del menú se vacía la RAM; en SQLite las claves
+      viejas dejan de matchear y vencen solas
+    """
+
+    def __init__(
+        self,
+        ttl_sec: float = EXTRACT_CACHE_TTL_SEC,
+        neg_ttl_sec: float = EXTRACT_CACHE_NEG_TTL_SEC,
+        max_entries: int = EXTRACT_CACHE_MAX,
+        persist: bool = EXTRACT_CACHE_PERSIST,
+    ):
+        self._ttl = ttl_sec
+        self._neg_ttl = neg_ttl_sec
+        self._max = max(1, int(max_entries))
+        self._persist = persist
+        # key -> (expires_at, result, costo en seg de la llamada original)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any], float]]" = OrderedDict()
+        self._inflight: Dict[str, _Flight] = {}
+        # single-flight del camino async (solo se toca desde el event loop)
+        self._ainflight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._menu_version: float | None = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.shared = 0
+        self.misses = 0
+        self.saved_sec = 0.0
+
+        if persist:
+            init_db()
+            repository.purge_cached_extractions(time.time())
+
+    def _get_mem(self, key: str, now: float) -> Dict[str, Any] | None:
+        # llamado con self._lock tomado
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result, cost = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_sec += cost
+        return result
+
+    def _put_mem(self, key: str, result: Dict[str, Any], expires_at: float, cost: float) -> None:
+        # llamado con self._lock tomado
+        self._entries[key] = (expires_at, result, cost)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max:
+            self._entries.popitem(last=False)
+
+    def _key(self, text: str) -> str:
+        norm = normalize_key(text)
+        if not norm:
+            return ""
+        version = get_menu().mtime
+        if version != self._menu_version:
+            with self._lock:
+                if version != self._menu_version:
+                    self._entries.clear()
+                    self._menu_version = version
+        return f"{version!r}:{norm}"
+
+    def get_or_compute(
+        self, text: str, compute: Callable[[str], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        key = self._key(text)
+        if not key:
+            return compute(text)
+
+        now = time.time()
+        with self._lock:
+            hit = self._get_mem(key, now)
+            if hit is not None:
+                return dict(hit)
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+
+        if not leader:
+            flight.event.wait()
+            with self._lock:
+                self.shared += 1
+            return dict(flight.result or {"ok": False})
+
+        result: Dict[str, Any] = {"ok": False}
+        try:
+            if self._persist:
+                disk = self._disk_get(key, now)
+                if disk is not None:
+                    result = disk
+                    return dict(result)
+
+            started = time.perf_counter()
+            result = compute(text)
+            expires_at = self._remember(key, result, time.perf_counter() - started)
+            if expires_at is not None and self._persist:
+                self._disk_put(key, result, expires_at)
+            return dict(result) if isinstance(result, dict) else {"ok": False}
+        finally:
+            flight.result = result if isinstance(result, dict) else {"ok": False}
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    async def aget_or_compute(
+        self,
+        text: str,
+        compute: Callable[[str], Awaitable[Dict[str, Any]]],
+        executor=None,
+    ) -> Dict[str, Any]:
+        """
+        Igual que get_or_compute pero para asyncio: los que esperan un mismo
+        texto esperan un Future (no un thread) y SQLite va al `executor`.
+        """
+        key = self._key(text)
+        if not key:
+            return await compute(text)
+
+        now = time.time()
+        with self._lock:
+            hit = self._get_mem(key, now)
+            if hit is not None:
+                return dict(hit)
+        flight = self._ainflight.get(key)
+        if flight is not None:
+            result = await asyncio.shield(flight)
+            with self._lock:
+                self.shared += 1
+            return dict(result)
+
+        loop = asyncio.get_running_loop()
+        flight = loop.create_future()
+        self._ainflight[key] = flight
+        result: Dict[str, Any] = {"ok": False}
+        try:
+            if self._persist:
+                disk = await loop.run_in_executor(executor, self._disk_get, key, now)
+                if disk is not None:
+                    result = disk
+                    return dict(result)
+
+            started = time.perf_counter()
+            result = await compute(text)
+            expires_at = self._remember(key, result, time.perf_counter() - started)
+            if expires_at is not None and self._persist:
+                await loop.run_in_executor(executor, self._disk_put, key, result, expires_at)
+            return dict(result) if isinstance(result, dict) else {"ok": False}
+        finally:
+            self._ainflight.pop(key, None)
+            if not flight.done():
+                flight.set_result(result if isinstance(result, dict) else {"ok": False})
+
+    def _disk_get(self, key: str, now: float) -> Dict[str, Any] | None:
+        disk = repository.get_cached_extraction(key, now)
+        if disk is not None:
+            with self._lock:
+                self.disk_hits += 1
+                self._put_mem(key, disk, now + self._ttl, 0.0)
+        return disk
+
+    def _disk_put(self, key: str, result: Dict[str, Any], expires_at: float) -> None:
+        try:
+            repository.put_cached_extraction(key, result, expires_at)
+        except Exception as e:
+            logger.error("extract cache persist failed", extra={"event": "extract_cache.persist_failed", "error": str(e)})
+
+    def _remember(self, key: str, result: Any, cost: float) -> float | None:
+        """
+        Guarda en RAM un resultado recién calculado. Devuelve expires_at si se
+        cacheó (None si no: errores/timeouts no se guardan).
+        """
+        with self._lock:
+            self.misses += 1
+        if not isinstance(result, dict) or "error" in result:
+            return None
+        ttl = self._ttl if result.get("ok") is True else self._neg_ttl
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._put_mem(key, result, expires_at, cost)
+        return expires_at
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.shared + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "shared": self.shared,
+                "misses": self.misses,
+                "hit_rate": round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+                "model_sec_saved": round(self.saved_sec, 3),
+            }
+
+
+_cache: ExtractionCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> ExtractionCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache()
+    return _cache
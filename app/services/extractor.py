@@ -0,0 +1,227 @@
+# app/services/extractor.py
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from app.services.metrics import counter, histogram
+from app.services.stats import LatencyWindow
+
+# Extractor único con backend elegible:
+# - "completions": /v1/completions con prompt armado (llama_client.py, micro-batching)
+# - "chat": /v1/chat/completions con SYSTEM_PROMPT (ai_client.py)
+AI_ENABLED = os.getenv("AI_ENABLED", "0").strip() == "1"
+EXTRACTOR_BACKEND = os.getenv("EXTRACTOR_BACKEND", "completions").strip().lower()
+# tiempo máximo que un paso de conversación espera a la IA
+EXTRACTOR_BUDGET_MS = int(os.getenv("EXTRACTOR_BUDGET_MS", "8000"))
+# circuit breaker: tras N fallas seguidas, cortamos directo al camino regex
+EXTRACTOR_CB_FAILURES = int(os.getenv("EXTRACTOR_CB_FAILURES", "3"))
+EXTRACTOR_CB_RESET_SEC = float(os.getenv("EXTRACTOR_CB_RESET_SEC", "30"))
+
+LLM_SECONDS = histogram("vendobot_llm_seconds", "Latencia de extracción con IA", ("backend",))
+# result: ok | error | circuit_open
+LLM_CALLS = counter("vendobot_llm_calls", "Llamadas al extractor de IA", ("backend", "result"))
+
+Backend = Callable[[str, float], Dict[str, Any]]
+AsyncBackend = Callable[[str, float], Awaitable[Dict[str, Any]]]
+
+
+class CircuitBreaker:
+    """
+    closed -> (N fallas seguidas) -> open -> (reset_sec) -> half_open -> 1 prueba
+    La prueba exitosa cierra; si falla vuelve a open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failures: int = EXTRACTOR_CB_FAILURES, reset_sec: float = EXTRACTOR_CB_RESET_SEC):
+        self._threshold = max(1, int(failures))
+        self._reset_sec = reset_sec
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self._reset_sec:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self._threshold:
+                if self.state != self.OPEN:
+                    self.opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+def _backend(name: str) -> Backend:
+    if name == "chat":
+        from app.services.ai_client import chat_extract
+
+        return chat_extract
+    from app.services.llama_client import llama_extract
+
+    return llama_extract
+
+
+def _abackend(name: str) -> AsyncBackend:
+    # httpx es dependencia opcional: solo se importa en el camino async
+    from app.services import aio
+
+    return aio.achat_extract if name == "chat" else aio.allama_extract
+
+
+def _backend_stats(name: str) -> Dict[str, Any] | None:
+    if name == "chat":
+        return None
+    from app.services.llama_client import batcher_stats
+
+    return batcher_stats()
+
+
+class Extractor:
+    """
+    extract(text) -> {"ok": bool, ...}. Nunca levanta excepción ni espera más que el budget.
+    Con el breaker abierto devuelve {"ok": False, "error": "circuit open"} al instante
+    y el state_machine sigue por el camino regex.
+    """
+
+    def __init__(
+        self,
+        backend: str = EXTRACTOR_BACKEND,
+        budget_ms: int = EXTRACTOR_BUDGET_MS,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.backend_name = backend
+        self._backend = _backend(backend)
+        self._abackend: AsyncBackend | None = None
+        self.budget = max(1, int(budget_ms)) / 1000.0
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self.latency = LatencyWindow()
+        self.calls = 0
+        self.failures = 0
+        self.short_circuits = 0
+
+    def extract(self, text: str) -> Dict[str, Any]:
+        if not self.breaker.allow():
+            return self._short_circuit()
+
+        started = time.perf_counter()
+        try:
+            out = self._backend(text, self.budget)
+        except Exception as e:
+            out = {"ok": False, "error": str(e)}
+        return self._finish(out, time.perf_counter() - started)
+
+    async def aextract(self, text: str) -> Dict[str, Any]:
+        """
+        extract() para asyncio: mismo breaker y budget, backend con httpx.
+        """
+        if not self.breaker.allow():
+            return self._short_circuit()
+
+        if self._abackend is None:
+            self._abackend = _abackend(self.backend_name)
+        started = time.perf_counter()
+        try:
+            out = await asyncio.wait_for(self._abackend(text, self.budget), self.budget)
+        except Exception as e:
+            out = {"ok": False, "error": str(e) or type(e).__name__}
+        return self._finish(out, time.perf_counter() - started)
+
+    def _short_circuit(self) -> Dict[str, Any]:
+        with self._lock:
+            self.short_circuits += 1
+        LLM_CALLS.inc(self.backend_name, "circuit_open")
+        return {"ok": False, "error": "circuit open"}
+
+    def _finish(self, out: Any, elapsed: float) -> Dict[str, Any]:
+        self.latency.add(elapsed)
+        failed = not isinstance(out, dict) or "error" in out or elapsed > self.budget
+        LLM_SECONDS.observe(elapsed, self.backend_name)
+        LLM_CALLS.inc(self.backend_name, "error" if failed else "ok")
+        with self._lock:
+            self.calls += 1
+            if failed:
+                self.failures += 1
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return out if isinstance(out, dict) else {"ok": False, "error": "respuesta inválida"}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": AI_ENABLED,
+                "backend": self.backend_name,
+                "budget_ms": int(self.budget * 1000),
+                "breaker": self.breaker.state,
+                "breaker_opened": self.breaker.opened,
+                "calls": self.calls,
+                "failures": self.failures,
+                "short_circuits": self.short_circuits,
+                "latency_ms": self.latency.percentiles(),
+                "completions": _backend_stats(self.backend_name),
+            }
+
+
+_extractor: Extractor | None = None
+_extractor_lock = threading.Lock()
+
+
+def get_extractor() -> Extractor:
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                _extractor = Extractor()
+    return _extractor
+
+
+def extract(text: str) -> Dict[str, Any]:
+    """
+    Punto de entrada del state_machine: cache (por texto normalizado) -> breaker -> backend.
+    Las frases repetidas salen del cache aunque el breaker esté abierto.
+    """
+    if not AI_ENABLED:
+        return {"ok": False}
+    from app.services.extract_cache import get_cache
+
+    return get_cache().get_or_compute(text, get_extractor().extract)
+
+
+async def aextract(text: str, executor=None) -> Dict[str, Any]:
+    """
+    extract() para el camino async (asgi.py): cache -> breaker -> backend httpx.
+    """
+    if not AI_ENABLED:
+        return {"ok": False}
+    from app.services.extract_cache import get_cache
+
+    return await get_cache().aget_or_compute(text, get_extractor().aextract, executor)
@@ -0,0 +1,122 @@
+# app/services/intents.py
+from __future__ import annotations
+
+from collections import deque
+from typing import Any, Dict, List, Tuple
+
+# Detección de intenciones en UNA pasada sobre el texto normalizado.
+#
+# Todas las palabras clave (saludo, menú, envío/retiro, pago) van a un único
+# autómata Aho-Corasick: se recorre el mensaje una vez, carácter por carácter,
+# y se juntan los patrones encontrados como bits de una máscara. La semántica
+# es la de siempre: "aparece como substring en cualquier parte".
+# si/no y los pedidos de menú "exactos" son match del texto completo (dict).
+
+_GREETING = ["hola", "buenas", "buen día", "buen dia", "buenas tardes", "buenas noches"]
+_MENU_SUB = ["menu", "menú"]
+_MENU_EXACT = ["menu", "menú", "carta", "que tienen", "qué tienen", "que hay", "qué hay"]
+_ENVIO = ["envio", "envío", "enviar", "delivery", "mandalo", "mandalo a casa", "a domicilio"]
+_RETIRO = ["retiro", "retira", "paso a buscar", "lo busco", "buscar", "retiro en local"]
+_TRANSFER = ["transfer", "transferencia", "tranfer", "trasnfer", "alias", "cbu", "mercadopago", "mp"]
+_YES = ["si", "sí", "s", "dale", "ok", "oka", "confirmo", "confirmar", "confirmo si"]
+_NO = ["no", "n", "cancelar", "cancelo"]
+
+INTENT_NAMES: Tuple[str, ...] = ("greeting", "menu", "delivery", "payment", "yes_no")
+
+
+class AhoCorasick:
+    """
+    Autómata multi-patrón. Las transiciones de falla se pliegan en la tabla
+    (DFA completo), así el scan es un dict.get por carácter sin retrocesos.
+    scan(text) devuelve la máscara OR de los bits de todos los patrones que
+    aparecen (aunque se superpongan).
+    """
+
+    __slots__ = ("_delta", "_out")
+
+    def __init__(self, patterns: Dict[str, int]):
+        goto: List[Dict[str, int]] = [{}]
+        out: List[int] = [0]
+        for pat, bit in patterns.items():
+            s = 0
+            for ch in pat:
+                nxt = goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[s][ch] = nxt
+                    goto.append({})
+                    out.append(0)
+                s = nxt
+            out[s] |= bit
+
+        # BFS por profundidad: fail links + plegado de las transiciones de la falla
+        fail = [0] * len(goto)
+        delta: List[Dict[str, int]] = [dict(goto[0])] + [{} for _ in goto[1:]]
+        queue = deque(goto[0].values())
+        while queue:
+            r = queue.popleft()
+            # la falla de r es menos profunda: su delta y su out ya están completos
+            merged = dict(delta[fail[r]])
+            merged.update(goto[r])
+            delta[r] = merged
+            out[r] |= out[fail[r]]
+            for ch, s in goto[r].items():
+                fail[s] = delta[fail[r]].get(ch, 0)
+                queue.append(s)
+
+        self._delta = delta
+        self._out = out
+
+    def scan(self, text: str) -> int:
+        delta = self._delta
+        out = self._out
+        s = 0
+        mask = 0
+        for ch in text:
+            s = delta[s].get(ch, 0)
+            mask |= out[s]
+        return mask
+
+
+def _bits(words: List[str], table: Dict[str, int]) -> int:
+    mask = 0
+    for w in words:
+        if w not in table:
+            table[w] = 1 << len(table)
+        mask |= table[w]
+    return mask
+
+
+_PATTERNS: Dict[str, int] = {}
+_M_GREETING = _bits(_GREETING, _PATTERNS)
+_M_MENU = _bits(_MENU_SUB, _PATTERNS)
+_M_QUE = _bits(["que"], _PATTERNS)
+_M_TIENEN = _bits(["tienen"], _PATTERNS)
+_M_ENVIO = _bits(_ENVIO, _PATTERNS)
+_M_RETIRO = _bits(_RETIRO, _PATTERNS)
+_M_EFECTIVO = _bits(["efectivo"], _PATTERNS)
+_M_TRANSFER = _bits(_TRANSFER, _PATTERNS)
+
+_AUTOMATON = AhoCorasick(_PATTERNS)
+
+_EXACT_MENU = frozenset(_MENU_EXACT)
+_YES_NO: Dict[str, bool] = {**{w: True for w in _YES}, **{w: False for w in _NO}}
+
+
+def classify(t: str) -> Dict[str, Any]:
+    """
+    Todas las intenciones de un mensaje ya normalizado (minúsculas, espacios
+    colapsados), con sus valores:
+      greeting: bool, menu: bool, delivery: "envio"|"retiro"|None,
+      payment: "efectivo"|"transferencia"|None, yes_no: True|False|None
+    Mismas prioridades que los parsers viejos (envío antes que retiro,
+    efectivo antes que transferencia).
+    """
+    m = _AUTOMATON.scan(t)
+    return {
+        "greeting": bool(m & _M_GREETING),
+        "menu": t in _EXACT_MENU or bool(m & _M_MENU) or (m & (_M_QUE | _M_TIENEN)) == (_M_QUE | _M_TIENEN),
+        "delivery": "envio" if m & _M_ENVIO else ("retiro" if m & _M_RETIRO else None),
+        "payment": "efectivo" if m & _M_EFECTIVO else ("transferencia" if m & _M_TRANSFER else None),
+        "yes_no": _YES_NO.get(t),
+    }
@@ -1,65 +1,732 @@
 # app/services/llama_client.py
+from __future__ import annotations
+
 import os
 import json
-import re
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from app.services.stats import LatencyWindow
+
+logger = logging.getLogger(__name__)
 
-AI_ENABLED = os.getenv("AI_ENABLED", "0").strip() == "1"
 LLAMA_BASE_URL = os.getenv("LLAMA_BASE_URL", "http://127.0.0.1:8080").rstrip("/")
 LLAMA_MODEL = os.getenv("LLAMA_MODEL", "model.gguf").strip()  # podés dejarlo vacío si querés
 
+# Concurrencia contra el server (idealmente = slots paralelos de llama.cpp, -np)
+LLAMA_MAX_CONCURRENCY = int(os.getenv("LLAMA_MAX_CONCURRENCY", "4"))
+# Micro-batching: juntamos pedidos durante unos ms y salen juntos
+LLAMA_BATCH_WINDOW_MS = float(os.getenv("LLAMA_BATCH_WINDOW_MS", "5"))
+LLAMA_BATCH_MAX = int(os.getenv("LLAMA_BATCH_MAX", "8"))
+# "parallel": cada prompt del lote en su request (en paralelo, hasta MAX_CONCURRENCY)
+# "prompt_list": un solo request con "prompt": [...] (servers que lo soportan)
+LLAMA_BATCH_MODE = os.getenv("LLAMA_BATCH_MODE", "parallel").strip().lower()
+# Tiempo máximo total por extracción (cola + request)
+LLAMA_DEADLINE_SEC = float(os.getenv("LLAMA_DEADLINE_SEC", "30"))
+LLAMA_MAX_TOKENS = int(os.getenv("LLAMA_MAX_TOKENS", "120"))
+# Streaming: cortamos la generación apenas cierra el objeto JSON (no pagamos tokens de más)
+LLAMA_STREAM = os.getenv("LLAMA_STREAM", "1").strip() == "1"
+# Salida restringida armada desde el menú: "json_schema" | "gbnf" | "off"
+# (llama.cpp acepta ambos; otros servers OpenAI-compatibles suelen ignorar el campo)
+LLAMA_GRAMMAR = os.getenv("LLAMA_GRAMMAR", "json_schema").strip().lower()
+# KV cache del prefijo fijo: llama.cpp reusa lo que el slot ya evaluó (cache_prompt)
+LLAMA_CACHE_PROMPT = os.getenv("LLAMA_CACHE_PROMPT", "1").strip() == "1"
+# cada request va a un slot fijo (id_slot) sacado de un pool: el slot ya tiene el prefijo.
+# Apagado por default: se activa recién cuando GET /slots dice cuántos slots tiene el
+# server (-np) y solo fija ids por debajo de eso; un id de más lo rechaza el server
+LLAMA_PIN_SLOTS = os.getenv("LLAMA_PIN_SLOTS", "0").strip() == "1"
+# al arrancar, evalúa el prefijo en cada slot (en background, requiere PIN_SLOTS)
+LLAMA_WARM_SLOTS = os.getenv("LLAMA_WARM_SLOTS", "0").strip() == "1"
+# slot save/restore (server con --slot-save-path): archivo con el KV del prefijo,
+# así un reinicio restaura en vez de re-evaluar
+LLAMA_SLOT_FILE = os.getenv("LLAMA_SLOT_FILE", "").strip()
+
+_STOP_SEQS = ["\n\nUsuario:", "\nUsuario:", "\nJSON:"]
+
+
+_DECODER = json.JSONDecoder()
+
 
-def _extract_first_json(s: str):
+def extract_first_json(s: str):
+    """
+    Primer objeto JSON {...} completo dentro de s (ignora texto antes y después).
+    A diferencia de un regex goloso, no se traga dos objetos ni la basura del medio.
+    """
     if not s:
         return None
-    # buscamos el primer objeto JSON {...}
-    m = re.search(r"\{.*\}", s, flags=re.DOTALL)
-    if not m:
-        return None
-    candidate = m.group(0).strip()
-    try:
-        return json.loads(candidate)
-    except Exception:
+    i = s.find("{")
+    while i != -1:
+        try:
+            obj, _ = _DECODER.raw_decode(s, i)
+            return obj
+        except ValueError:
+            i = s.find("{", i + 1)
+    return None
+
+
+class JsonObjectScanner:
+    """
+    Parser incremental mínimo para el stream: se le pasan pedazos de texto y
+    devuelve el primer objeto {...} de nivel superior apenas se cierra
+    (respeta strings y escapes). Antes de eso devuelve None.
+    """
+
+    __slots__ = ("buf", "_start", "_depth", "_in_str", "_esc")
+
+    def __init__(self):
+        self.buf = ""
+        self._start = -1
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+
+    def feed(self, piece: str) -> str | None:
+        base = len(self.buf)
+        self.buf += piece
+        for i, ch in enumerate(piece, base):
+            if self._start < 0:
+                if ch == "{":
+                    self._start = i
+                    self._depth = 1
+                continue
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                continue
+            if ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    return self.buf[self._start: i + 1]
         return None
 
 
-def llama_extract(user_text: str):
+_DELIVERY = ("envio", "retiro")
+_PAYMENT = ("efectivo", "transferencia")
+
+
+def json_schema_for(menu) -> dict:
     """
-    Devuelve dict:
-      {"ok": True, "items":[{"name":"coca","qty":1}], "delivery_method":..., "address":..., "payment_method":..., "name":...}
+    JSON schema de la respuesta: nombres de items limitados a los del menú.
     """
-    if not AI_ENABLED:
-        return {"ok": False}
-
-    prompt = (
-        "Devolvé SOLO JSON válido, sin texto extra.\n"
-        "Formato exacto:\n"
-        "{\"ok\":true,\"items\":[{\"name\":\"...\",\"qty\":1}]}\n"
-        "Reglas:\n"
-        "- items: lista de productos. qty entero. si no hay qty asumí 1.\n"
-        "- NO escribas explicaciones.\n"
-        "- NO agregues ejemplos.\n"
-        f"Usuario: {user_text}\n"
-        "JSON:\n"
-    )
+    names = sorted({it["name"] for it in menu.items})
+    return {
+        "type": "object",
+        "properties": {
+            "ok": {"type": "boolean"},
+            "items": {
+                "type": "array",
+                "maxItems": 10,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"enum": names},
+                        "qty": {"type": "integer", "minimum": 1, "maximum": 99},
+                    },
+                    "required": ["name", "qty"],
+                },
+            },
+            "delivery_method": {"enum": list(_DELIVERY)},
+            "payment_method": {"enum": list(_PAYMENT)},
+            "address": {"type": "string", "maxLength": 80},
+            "name": {"type": "string", "maxLength": 40},
+        },
+        "required": ["ok", "items"],
+    }
+
+
+def _gbnf_alt(values) -> str:
+    return " | ".join('"\\"' + v.replace('"', "").replace("\\", "") + '\\""' for v in values)
 
+
+def gbnf_for(menu) -> str:
+    """
+    La misma forma que json_schema_for, como gramática GBNF (campo "grammar" de llama.cpp).
+    """
+    names = sorted({it["name"] for it in menu.items})
+    return "\n".join([
+        'root ::= "{" ws "\\"ok\\":" ws bool ws "," ws "\\"items\\":" ws items (ws "," ws extra)* ws "}"',
+        'items ::= "[" ws (item (ws "," ws item){0,9})? ws "]"',
+        'item ::= "{" ws "\\"name\\":" ws name ws "," ws "\\"qty\\":" ws qty ws "}"',
+        f"name ::= {_gbnf_alt(names)}",
+        'qty ::= [1-9] [0-9]?',
+        f'extra ::= "\\"delivery_method\\":" ws ({_gbnf_alt(_DELIVERY)})'
+        f' | "\\"payment_method\\":" ws ({_gbnf_alt(_PAYMENT)})'
+        ' | "\\"address\\":" ws str | "\\"name\\":" ws str',
+        'str ::= "\\"" [^"\\\\\\n]{0,80} "\\""',
+        'bool ::= "true" | "false"',
+        'ws ::= [ ]?',
+    ]) + "\n"
+
+
+_constraint_cache: tuple = (None, None, {})
+
+
+def _constraint(mode: str) -> dict:
+    """
+    Campos extra del payload para restringir la salida. Se arman una vez por
+    snapshot del menú (si el menú se recarga, se regeneran).
+    """
+    global _constraint_cache
+    if mode not in ("json_schema", "gbnf"):
+        return {}
+    try:
+        from app.services.menu import get_menu
+
+        snap = get_menu()
+    except Exception:
+        return {}
+    cached = _constraint_cache
+    if cached[0] is snap and cached[1] == mode:
+        return cached[2]
+    fields = {"json_schema": json_schema_for(snap)} if mode == "json_schema" else {"grammar": gbnf_for(snap)}
+    _constraint_cache = (snap, mode, fields)
+    return fields
+
+
+# Parte fija del prompt: siempre primero y byte a byte igual, es lo que queda
+# en el KV cache del slot. Nada variable (menú, fecha, teléfono) puede ir acá;
+# el mensaje del cliente va solo en el sufijo. Termina en "\n" para que el
+# corte de tokens entre prefijo y sufijo sea estable.
+PROMPT_PREFIX = (
+    "Devolvé SOLO JSON válido, sin texto extra.\n"
+    "Formato exacto:\n"
+    "{\"ok\":true,\"items\":[{\"name\":\"...\",\"qty\":1}]}\n"
+    "Reglas:\n"
+    "- items: lista de productos. qty entero. si no hay qty asumí 1.\n"
+    "- NO escribas explicaciones.\n"
+    "- NO agregues ejemplos.\n"
+)
+
+
+def build_prompt(user_text: str) -> str:
+    return f"{PROMPT_PREFIX}Usuario: {user_text}\nJSON:\n"
+
+
+def completion_payload(prompt, model: str = LLAMA_MODEL, max_tokens: int = LLAMA_MAX_TOKENS,
+                       grammar: str = LLAMA_GRAMMAR, cache_prompt: bool = LLAMA_CACHE_PROMPT,
+                       slot: int | None = None, stream: bool = False) -> dict:
     payload = {
-        "model": LLAMA_MODEL if LLAMA_MODEL else "model.gguf",
+        "model": model or "model.gguf",
         "prompt": prompt,
         "temperature": 0,
-        "max_tokens": 120,
+        "max_tokens": max_tokens,
         # stops para cortar cuando empieza a inventar “Usuario: ...”
-        "stop": ["\n\nUsuario:", "\nUsuario:", "\nJSON:"]
+        "stop": _STOP_SEQS,
+        # campos de llama.cpp; otros servers OpenAI-compatibles los ignoran
+        "cache_prompt": cache_prompt,
     }
+    if slot is not None:
+        payload["id_slot"] = slot
+    if stream:
+        payload["stream"] = True
+        # "timings" en cada evento: si cortamos apenas cierra el JSON, el del final no llega
+        payload["timings_per_token"] = True
+    payload.update(_constraint(grammar))
+    return payload
 
-    try:
-        r = requests.post(f"{LLAMA_BASE_URL}/v1/completions", json=payload, timeout=30)
+
+def prompt_timings(js: dict) -> tuple:
+    """
+    (prompt_ms, tokens_cached) según llama.cpp: "timings.prompt_ms" y
+    "timings.cache_n" (o "tokens_cached" en versiones viejas). None si no vino.
+    """
+    t = js.get("timings") or {}
+    ms = t.get("prompt_ms")
+    cached = t.get("cache_n", js.get("tokens_cached"))
+    return (
+        float(ms) if ms is not None else None,
+        int(cached) if cached is not None else None,
+    )
+
+
+class StreamReader:
+    """
+    Líneas SSE de /v1/completions (stream) -> texto. Cada evento trae ~1 token.
+    feed() devuelve True cuando ya no hace falta leer más: cerró el objeto
+    JSON (early) o llegó [DONE]. Lo usan el cliente sync y el async.
+    """
+
+    __slots__ = ("scanner", "tokens", "result", "early", "first_at", "timings")
+
+    def __init__(self):
+        self.scanner = JsonObjectScanner()
+        self.tokens = 0
+        self.result: str | None = None
+        self.early = False
+        # primer token: lo que tardó el server en evaluar el prompt (+ red y cola del slot)
+        self.first_at: float | None = None
+        # último "timings" visto (llama.cpp con timings_per_token lo manda en cada evento)
+        self.timings: dict | None = None
+
+    def feed(self, line) -> bool:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        if not line.startswith("data:"):
+            return False
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return True
+        event = json.loads(data)
+        if "timings" in event:
+            self.timings = event
+        piece = (event.get("choices") or [{}])[0].get("text") or ""
+        if not piece:
+            return False
+        if self.first_at is None:
+            self.first_at = time.perf_counter()
+        self.tokens += 1
+        obj = self.scanner.feed(piece)
+        if obj is not None:
+            self.result = obj
+            self.early = True
+            return True
+        return False
+
+    @property
+    def text(self) -> str:
+        return self.result if self.result is not None else self.scanner.buf
+
+
+def _parse_completion(text: str) -> dict:
+    obj = extract_first_json(text)
+    if isinstance(obj, dict) and obj.get("ok") is True:
+        return obj
+    return {"ok": False}
+
+
+class _Request:
+    __slots__ = ("prompt", "deadline", "future")
+
+    def __init__(self, prompt: str, deadline: float):
+        self.prompt = prompt
+        self.deadline = deadline
+        self.future: Future = Future()
+
+
+class LlamaBatcher:
+    """
+    Cliente de completions compartido:
+
+    - requests.Session con pool keep-alive (no una conexión nueva por mensaje)
+    - como mucho max_concurrency requests en vuelo contra el server
+    - micro-batching: un thread junta pedidos durante window_ms (hasta batch_max)
+      y los despacha juntos (en paralelo o como una lista de prompts)
+    - deadline por pedido: si vence esperando en cola, ni se manda
+    - stream=True: lee la respuesta SSE con JsonObjectScanner y cierra la conexión
+      apenas cierra el objeto JSON (llama.cpp corta la generación del slot)
+    - grammar: json_schema/gbnf armado desde el menú para que la salida siempre parsee
+    - prefix cache: cache_prompt + un slot fijo por request (pool de id_slot) y
+      warm-up del PROMPT_PREFIX en cada slot: el server solo evalúa el sufijo.
+      Los ids se fijan solo por debajo de los slots que reporta GET /slots
+    """
+
+    def __init__(
+        self,
+        base_url: str = LLAMA_BASE_URL,
+        model: str = LLAMA_MODEL,
+        max_concurrency: int = LLAMA_MAX_CONCURRENCY,
+        window_ms: float = LLAMA_BATCH_WINDOW_MS,
+        batch_max: int = LLAMA_BATCH_MAX,
+        mode: str = LLAMA_BATCH_MODE,
+        stream: bool = LLAMA_STREAM,
+        grammar: str = LLAMA_GRAMMAR,
+        max_tokens: int = LLAMA_MAX_TOKENS,
+        cache_prompt: bool = LLAMA_CACHE_PROMPT,
+        pin_slots: bool = LLAMA_PIN_SLOTS,
+        warm_slots: bool = LLAMA_WARM_SLOTS,
+        slot_file: str = LLAMA_SLOT_FILE,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model or "model.gguf"
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.window = max(0.0, float(window_ms)) / 1000.0
+        self.batch_max = max(1, int(batch_max))
+        self.mode = mode
+        self.stream = stream
+        self.grammar = grammar
+        self.max_tokens = max(1, int(max_tokens))
+        self.cache_prompt = cache_prompt
+        self.pin_slots = pin_slots
+        self.slot_file = slot_file
+        # slots del server según GET /slots; hasta saberlo no se fija ningún id_slot
+        self.server_slots = 0
+
+        # ids de slot libres (uno por request en vuelo, igual que los slots del server)
+        self._slots: queue.Queue = queue.Queue()
+        for i in range(self.max_concurrency):
+            self._slots.put(i)
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="llama"
+        )
+
+        self._pending: list = []
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        self._lock = threading.Lock()
+        self.latency = LatencyWindow()
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.expired = 0
+        # por extracción: tokens generados y tiempo hasta tener el JSON
+        self.ttr = LatencyWindow()
+        self.completions = 0
+        self.tokens = 0
+        self.early_stops = 0
+        self.invalid = 0
+        # evaluación del prompt: la que reporta el server y el tiempo al primer token
+        self.prompt_latency = LatencyWindow()
+        self.ttft = LatencyWindow()
+        self.timed = 0
+        self.tokens_cached = 0
+        self.warmed = 0
+
+        self._thread = threading.Thread(target=self._run, name="llama-batcher", daemon=True)
+        self._thread.start()
+        if pin_slots:
+            threading.Thread(
+                target=self._init_slots, args=(warm_slots and cache_prompt,), name="llama-slots", daemon=True
+            ).start()
+
+    # ---------- API ----------
+    def submit(self, prompt: str, timeout: float = LLAMA_DEADLINE_SEC) -> Future:
+        req = _Request(prompt, time.monotonic() + timeout)
+        with self._cond:
+            self._pending.append(req)
+            self._cond.notify()
+        return req.future
+
+    def complete(self, prompt: str, timeout: float = LLAMA_DEADLINE_SEC) -> str:
+        """
+        Texto de la completion. Levanta TimeoutError si vence el deadline.
+        """
+        started = time.perf_counter()
+        fut = self.submit(prompt, timeout)
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            raise TimeoutError(f"llama deadline {timeout}s")
+        finally:
+            self.latency.add(time.perf_counter() - started)
+
+    # ---------- internos ----------
+    def _init_slots(self, warm: bool) -> None:
+        self.server_slots = self._probe_slots()
+        if warm and self.server_slots:
+            self.warm_slots()
+
+    def _probe_slots(self) -> int:
+        """
+        Slots del server (GET /slots, llama.cpp). 0 si no lo expone o no
+        contesta: entonces no se fija ningún id_slot y el server elige.
+        """
+        try:
+            r = self._session.get(f"{self.base_url}/slots", timeout=LLAMA_DEADLINE_SEC)
+            r.raise_for_status()
+            slots = r.json()
+            n = len(slots) if isinstance(slots, list) else 0
+        except (requests.RequestException, ValueError) as e:
+            logger.warning("llama slots unknown, pinning off", extra={"event": "llama.slots_unknown", "error": str(e)})
+            return 0
+        if n < self.max_concurrency:
+            logger.warning("llama server has fewer slots than LLAMA_MAX_CONCURRENCY", extra={
+                "event": "llama.slots_capped", "server_slots": n, "max_concurrency": self.max_concurrency,
+            })
+        return n
+
+    def warm_slots(self) -> int:
+        """
+        Deja PROMPT_PREFIX en el KV cache de cada slot: restaura slot_file si hay
+        (slot save/restore) o lo evalúa con una completion de 1 token y, la
+        primera vez, lo guarda. Toma los slots del pool de a uno, así no frena
+        el tráfico real. Devuelve cuántos slots quedaron calientes.
+        """
+        pending = set(range(min(self.max_concurrency, self.server_slots)))
+        saved = False
+        for _ in range(self.max_concurrency * 2):
+            if not pending or self._stopped:
+                break
+            slot = self._slots.get()
+            try:
+                if slot not in pending:
+                    continue
+                pending.discard(slot)
+                if self.slot_file and self._slot_action(slot, "restore"):
+                    self.warmed += 1
+                    continue
+                payload = completion_payload(PROMPT_PREFIX, self.model, 1, "off", True, slot)
+                self._post(payload, time.monotonic() + LLAMA_DEADLINE_SEC)
+                self.warmed += 1
+                if self.slot_file and not saved:
+                    saved = self._slot_action(slot, "save")
+            except Exception as e:
+                logger.warning("llama slot warm-up failed", extra={"event": "llama.warm_failed", "slot": slot, "error": str(e)})
+            finally:
+                self._slots.put(slot)
+        return self.warmed
+
+    def _slot_action(self, slot: int, action: str) -> bool:
+        try:
+            r = self._session.post(
+                f"{self.base_url}/slots/{slot}", params={"action": action},
+                json={"filename": self.slot_file}, timeout=LLAMA_DEADLINE_SEC,
+            )
+            return r.status_code < 400
+        except requests.RequestException:
+            return False
+
+    def _payload(self, prompt, slot: int | None = None, stream: bool = False) -> dict:
+        return completion_payload(
+            prompt, self.model, self.max_tokens, self.grammar, self.cache_prompt,
+            slot if self.pin_slots and slot is not None and slot < self.server_slots else None, stream,
+        )
+
+    def _acquire_slot(self, deadline: float) -> int:
+        try:
+            return self._slots.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            raise TimeoutError("llama deadline vencido esperando slot")
+
+    def _record_prompt(self, started: float, first_at: float | None, timings: dict | None) -> None:
+        if first_at is not None:
+            self.ttft.add(first_at - started)
+        prompt_ms, cached = prompt_timings(timings or {})
+        if prompt_ms is not None:
+            self.prompt_latency.add(prompt_ms / 1000.0)
+            with self._lock:
+                self.timed += 1
+                self.tokens_cached += cached or 0
+
+    def _record(self, text: str, tokens: int, started: float, early: bool) -> None:
+        self.ttr.add(time.perf_counter() - started)
+        # JSON roto: el primer objeto que parsea es un item suelto, no la respuesta
+        obj = extract_first_json(text)
+        valid = isinstance(obj, dict) and "ok" in obj
+        with self._lock:
+            self.completions += 1
+            self.tokens += tokens
+            if early:
+                self.early_stops += 1
+            if not valid:
+                self.invalid += 1
+
+    @staticmethod
+    def _usage_tokens(js: dict) -> int:
+        return int((js.get("usage") or {}).get("completion_tokens") or 0)
+
+    def _post(self, payload: dict, deadline: float) -> dict:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("llama deadline vencido")
+        r = self._session.post(f"{self.base_url}/v1/completions", json=payload, timeout=remaining)
         r.raise_for_status()
-        js = r.json()
-        text = (js.get("choices") or [{}])[0].get("text", "")
-        obj = _extract_first_json(text)
-        if isinstance(obj, dict) and obj.get("ok") is True:
-            return obj
-        return {"ok": False}
-    except Exception:
-        return {"ok": False}
+        return r.json()
+
+    def _stream_one(self, req: _Request, slot: int) -> str:
+        """
+        Completion en streaming. Cada evento SSE trae ~1 token; cuando el scanner
+        ve cerrar el objeto, salimos y el `with` cierra la conexión (no vuelve al
+        pool, pero el server deja de generar para este pedido).
+        """
+        remaining = req.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("llama deadline vencido")
+        payload = self._payload(req.prompt, slot, stream=True)
+        started = time.perf_counter()
+        reader = StreamReader()
+        with self._session.post(
+            f"{self.base_url}/v1/completions", json=payload, timeout=remaining, stream=True
+        ) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if reader.feed(line):
+                    break
+                if time.monotonic() > req.deadline:
+                    raise TimeoutError("llama deadline vencido en stream")
+        self._record_prompt(started, reader.first_at, reader.timings)
+        self._record(reader.text, reader.tokens, started, early=reader.early)
+        return reader.text
+
+    def _send_one(self, req: _Request) -> None:
+        if req.future.done():
+            return
+        slot = None
+        try:
+            slot = self._acquire_slot(req.deadline)
+            if self.stream:
+                text = self._stream_one(req, slot)
+            else:
+                started = time.perf_counter()
+                js = self._post(self._payload(req.prompt, slot), req.deadline)
+                text = (js.get("choices") or [{}])[0].get("text", "")
+                self._record_prompt(started, None, js)
+                self._record(text, self._usage_tokens(js), started, early=False)
+            req.future.set_result(text)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            req.future.set_exception(e)
+        finally:
+            if slot is not None:
+                self._slots.put(slot)
+
+    def _send_list(self, batch: list) -> None:
+        # una lista de prompts no se puede streamear: acá queda la gramática sola
+        deadline = min(r.deadline for r in batch)
+        started = time.perf_counter()
+        try:
+            js = self._post(self._payload([r.prompt for r in batch]), deadline)
+            choices = js.get("choices") or []
+            by_index = {c.get("index", i): c.get("text", "") for i, c in enumerate(choices)}
+            tokens = self._usage_tokens(js) // max(1, len(batch))
+            self._record_prompt(started, None, js)
+            for i, r in enumerate(batch):
+                text = by_index.get(i, "")
+                self._record(text, tokens, started, early=False)
+                r.future.set_result(text)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+
+    def _take_batch(self) -> list:
+        with self._cond:
+            while not self._pending and not self._stopped:
+                self._cond.wait()
+            if self._stopped and not self._pending:
+                return []
+            # ventana: esperamos un poco a que lleguen más, sin pasar batch_max
+            end = time.monotonic() + self.window
+            while len(self._pending) < self.batch_max and not self._stopped:
+                left = end - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            batch = self._pending[: self.batch_max]
+            del self._pending[: self.batch_max]
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if self._stopped:
+                    return
+                continue
+            now = time.monotonic()
+            live = []
+            for r in batch:
+                if r.deadline <= now:
+                    with self._lock:
+                        self.expired += 1
+                    r.future.set_exception(TimeoutError("llama deadline vencido en cola"))
+                else:
+                    live.append(r)
+            if not live:
+                continue
+            with self._lock:
+                self.batches += 1
+                self.requests += len(live)
+            if self.mode == "prompt_list" and len(live) > 1:
+                self._executor.submit(self._send_list, live)
+            else:
+                for r in live:
+                    self._executor.submit(self._send_one, r)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "errors": self.errors,
+                "expired": self.expired,
+                "pending": len(self._pending),
+                "latency_ms": self.latency.percentiles(),
+                "stream": self.stream,
+                "grammar": self.grammar,
+                "avg_tokens": round(self.tokens / self.completions, 1) if self.completions else 0.0,
+                "early_stops": self.early_stops,
+                "invalid_json": self.invalid,
+                "time_to_result_ms": self.ttr.percentiles(),
+                "cache_prompt": self.cache_prompt,
+                "pin_slots": self.pin_slots,
+                "server_slots": self.server_slots,
+                "warmed_slots": self.warmed,
+                "prompt_ms": self.prompt_latency.percentiles(),
+                "avg_tokens_cached": round(self.tokens_cached / self.timed, 1) if self.timed else 0.0,
+                "time_to_first_token_ms": self.ttft.percentiles(),
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout=5)
+        self._executor.shutdown(wait=True)
+        self._session.close()
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> LlamaBatcher:
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = LlamaBatcher()
+    return _batcher
+
+
+def batcher_stats() -> dict | None:
+    """
+    Stats del batcher si ya se creó (no lo levanta solo para mirar).
+    """
+    b = _batcher
+    return b.stats() if b is not None else None
+
+
+def llama_extract(user_text: str, timeout: float | None = None):
+    """
+    Backend "completions" del extractor (ver extractor.py).
+    Devuelve dict:
+      {"ok": True, "items":[{"name":"coca","qty":1}], "delivery_method":..., "address":..., "payment_method":..., "name":...}
+    Si falla la llamada: {"ok": False, "error": "..."}
+    """
+    try:
+        text = get_batcher().complete(build_prompt(user_text), timeout=timeout or LLAMA_DEADLINE_SEC)
+        return _parse_completion(text)
+    except Exception as e:
+        # con "error" el cache sabe que no tiene que guardar este resultado
+        return {"ok": False, "error": str(e)}
+
+
+def close_batcher() -> None:
+    b = _batcher
+    if b is not None:
+        b.close()
@@ -0,0 +1,196 @@
+# app/services/log.py
+from __future__ import annotations
+
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Iterator
+
+from app.services.metrics import counter
+
+# Logs JSON (una línea por evento) sin I/O en el thread que loguea:
+# - los loggers de `app.*` encolan el record (put_nowait) y vuelven
+# - un QueueListener en background arma el JSON y escribe a stdout
+# - si la cola se llena se descarta (nunca bloquea un request) y se cuenta
+# - eventos de mucho volumen se muestrean (LOG_SAMPLE)
+# - phone / msg_id salen de contextvars (log_context) en cada línea
+#
+# Uso: logger = logging.getLogger(__name__)
+#      logger.info("WhatsApp send", extra={"event": "whatsapp.sent", "status": 200})
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()
+LOG_QUEUE_MAX = int(os.getenv("LOG_QUEUE_MAX", "10000"))
+# evento=proporción que se loguea, separados por coma
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "whatsapp.sent=0.1")
+# tope por campo (ej: cuerpos de error de Graph API) y para tracebacks
+LOG_FIELD_MAX = int(os.getenv("LOG_FIELD_MAX", "300"))
+LOG_EXC_MAX = int(os.getenv("LOG_EXC_MAX", "4000"))
+
+LOG_DROPPED = counter("vendobot_log_dropped", "Líneas de log descartadas", ("reason",))
+
+_phone: contextvars.ContextVar[str] = contextvars.ContextVar("log_phone", default="")
+_msg_id: contextvars.ContextVar[str] = contextvars.ContextVar("log_msg_id", default="")
+
+# atributos propios de LogRecord: todo lo demás vino por `extra=` y va al JSON
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+@contextlib.contextmanager
+def log_context(phone: str = "", msg_id: str = "") -> Iterator[None]:
+    """
+    Correlación para todo lo que se loguee adentro (thread o tarea asyncio actual).
+    """
+    tokens = (_phone.set(phone), _msg_id.set(msg_id))
+    try:
+        yield
+    finally:
+        _phone.reset(tokens[0])
+        _msg_id.reset(tokens[1])
+
+
+def parse_sample(spec: str) -> Dict[str, float]:
+    rates: Dict[str, float] = {}
+    for part in spec.split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            try:
+                rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+            except ValueError:
+                pass
+    return rates
+
+
+class _ContextFilter(logging.Filter):
+    """
+    Corre en el thread que loguea (antes de encolar): muestreo + phone/msg_id.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = self.rates.get(getattr(record, "event", ""))
+        if rate is not None and rate < 1.0:
+            if random.random() >= rate:
+                LOG_DROPPED.inc("sampled")
+                return False
+            record.sample_rate = rate
+        if not hasattr(record, "phone"):
+            phone = _phone.get()
+            if phone:
+                record.phone = phone
+        if not hasattr(record, "msg_id"):
+            msg_id = _msg_id.get()
+            if msg_id:
+                record.msg_id = msg_id
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc("queue_full")
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # lo mínimo en el thread que loguea: el JSON se arma en el listener
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+def _clip(value, limit: int = LOG_FIELD_MAX):
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value).decode("utf-8", "replace")
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit] + f"...(+{len(value) - limit})"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": _clip(record.getMessage()),
+            "pid": record.process,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                out[key] = _clip(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            out["exc"] = _clip(record.exc_text, LOG_EXC_MAX)
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+_listener: QueueListener | None = None
+_handler: logging.Handler | None = None
+# después de stop_logging: el sink directo (sin cola)
+_fallback: logging.Handler | None = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(stream=None) -> None:
+    """
+    Engancha el handler de cola al logger `app` y arranca el listener.
+    Idempotente; se llama una vez por worker, ya forkeado (init_worker en
+    app.main, startup en app.asgi), nunca al importar.
+    """
+    global _listener, _handler, _fallback
+    with _setup_lock:
+        if _listener is not None:
+            return
+        logger = logging.getLogger("app")
+        if _fallback is not None:
+            logger.removeHandler(_fallback)
+            _fallback = None
+        sink = logging.StreamHandler(stream or sys.stdout)
+        sink.setFormatter(JsonFormatter())
+        q: queue.Queue = queue.Queue(maxsize=max(1, LOG_QUEUE_MAX))
+        handler = _NonBlockingQueueHandler(q)
+        handler.addFilter(_ContextFilter(parse_sample(LOG_SAMPLE)))
+
+        logger.setLevel(LOG_LEVEL)
+        logger.addHandler(handler)
+        # no duplicar por el root (gunicorn/uvicorn configuran el suyo)
+        logger.propagate = False
+
+        listener = QueueListener(q, sink, respect_handler_level=False)
+        listener.start()
+        _listener, _handler = listener, handler
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """
+    Vacía la cola y frena el listener (último paso del shutdown). Lo que se
+    loguee después sale directo, sin cola.
+    """
+    global _listener, _handler, _fallback
+    with _setup_lock:
+        listener, handler = _listener, _handler
+        _listener = _handler = None
+        if listener is None:
+            return
+        listener.stop()
+        logger = logging.getLogger("app")
+        logger.removeHandler(handler)
+        sink = listener.handlers[0]
+        sink.addFilter(_ContextFilter({}))
+        logger.addHandler(sink)
+        _fallback = sink
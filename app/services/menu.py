@@ -0,0 +1,124 @@
+# app/services/menu.py
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Dict, Mapping
+
+from app.services.menu_matcher import MenuMatcher
+
+logger = logging.getLogger(__name__)
+
+# Fuente única del menú (precios, alias, texto). Se recarga sola si cambia el archivo.
+MENU_PATH = os.getenv("MENU_PATH", "").strip()
+# cada cuánto como máximo se hace stat() del archivo
+MENU_RELOAD_CHECK_SEC = float(os.getenv("MENU_RELOAD_CHECK_SEC", "2"))
+DEFAULT_DELIVERY_FEE = 3000
+
+
+def get_menu_path() -> Path:
+    if MENU_PATH:
+        return Path(MENU_PATH)
+    # .../Vendobot/app/services/menu.py -> parents[2] = .../Vendobot
+    return Path(__file__).resolve().parents[2] / "menu.json"
+
+
+class MenuSnapshot:
+    """
+    Menú armado una sola vez por versión del archivo: texto renderizado, precios
+    e índice del matcher. No se modifica nunca; una recarga crea otro snapshot
+    y se reemplaza la referencia entera.
+    """
+
+    __slots__ = (
+        "mtime", "business", "delivery_fee", "items", "prices",
+        "text", "intro_text", "menu_reply", "matcher",
+    )
+
+    def __init__(self, raw: Dict[str, Any], mtime: float = 0.0):
+        items = tuple(MappingProxyType(dict(it)) for it in raw.get("items") or [])
+        if not items:
+            raise ValueError("menu sin items")
+        for it in items:
+            for key in ("id", "name", "price"):
+                if key not in it:
+                    raise ValueError(f"item de menú sin '{key}': {dict(it)}")
+
+        business = raw.get("business") or "Marietta"
+        title = raw.get("title") or "MENÚ"
+        lines = [f"📋 {title}", ""]
+        for it in items:
+            label = it.get("label") or it["name"].capitalize()
+            emoji = it.get("emoji") or "•"
+            lines.append(f"{emoji} {label} ${int(it['price'])}")
+        text = "\n".join(lines) + "\n"
+
+        object.__setattr__(self, "mtime", mtime)
+        object.__setattr__(self, "business", business)
+        object.__setattr__(self, "delivery_fee", int(raw.get("delivery_fee", DEFAULT_DELIVERY_FEE)))
+        object.__setattr__(self, "items", items)
+        object.__setattr__(self, "prices", MappingProxyType({it["id"]: int(it["price"]) for it in items}))
+        object.__setattr__(self, "text", text)
+        object.__setattr__(
+            self,
+            "menu_reply",
+            "📋 *Menú del día:*\n"
+            f"{text}\n"
+            "Decime tu pedido con cantidades (ej: *2 hamburguesas y 1 coca*).",
+        )
+        object.__setattr__(self, "intro_text", f"Hola! Somos *{business}* 👋\n{self.menu_reply}")
+        object.__setattr__(self, "matcher", MenuMatcher(items))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("MenuSnapshot es inmutable")
+
+    def item(self, item_id: str) -> Mapping[str, Any] | None:
+        return self.matcher.items.get(item_id)
+
+
+def load_menu(path: Path | str | None = None) -> MenuSnapshot:
+    p = Path(path) if path else get_menu_path()
+    mtime = p.stat().st_mtime
+    raw = json.loads(p.read_text(encoding="utf-8"))
+    return MenuSnapshot(raw, mtime)
+
+
+_current: MenuSnapshot | None = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def get_menu() -> MenuSnapshot:
+    """
+    Snapshot vigente. Como mucho cada MENU_RELOAD_CHECK_SEC mira el mtime del
+    archivo; si cambió, arma el snapshot nuevo y lo publica de una (asignación
+    atómica). Si el archivo nuevo está roto, sigue el anterior.
+    """
+    global _current, _checked_at
+    snap = _current
+    now = time.monotonic()
+    if snap is not None and now - _checked_at < MENU_RELOAD_CHECK_SEC:
+        return snap
+
+    with _lock:
+        snap = _current
+        if snap is not None and now - _checked_at < MENU_RELOAD_CHECK_SEC:
+            return snap
+        _checked_at = now
+        path = get_menu_path()
+        try:
+            mtime = path.stat().st_mtime
+            if snap is None or mtime != snap.mtime:
+                _current = load_menu(path)
+                if snap is not None:
+                    logger.info("menu reloaded", extra={"event": "menu.reloaded", "path": str(path)})
+        except Exception as e:
+            if snap is None:
+                raise
+            logger.error("menu reload failed, keeping previous", extra={"event": "menu.reload_failed", "error": str(e)})
+        return _current
@@ -0,0 +1,155 @@
+# app/services/menu_matcher.py
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Un solo regex para tokenizar: números o palabras (todo lo demás separa)
+_TOKEN_RE = re.compile(r"\d+|[a-záéíóúüñ]+")
+_ACCENTS = str.maketrans("áéíóúü", "aeiouu")
+
+# palabras de relleno que no cambian el ítem ("empanadas DE pollo")
+_FILLER = frozenset({"de", "del", "con", "la", "el", "los", "las"})
+
+WORD_NUM = {
+    "un": 1, "una": 1, "uno": 1,
+    "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6,
+    "siete": 7, "ocho": 8, "nueve": 9, "diez": 10,
+    "once": 11, "doce": 12,
+    "trece": 13, "catorce": 14, "quince": 15,
+    "dieciseis": 16, "diecisiete": 17, "dieciocho": 18, "diecinueve": 19,
+    "veinte": 20,
+}
+
+# "no quiero coca", "sin papas", "ni fanta": el ítem que sigue sin cantidad no se pide
+_NEGATION = frozenset({"no", "sin", "ni"})
+# cortan una negación pendiente: "hamburguesa sin cebolla y coca" pide la coca
+_CONNECTOR = frozenset({"y", "e", "pero"})
+
+_END = "\0"
+
+
+def _stem(tok: str) -> str:
+    """
+    Forma canónica de un token: sin tildes y sin plural simple ("hamburguesas" -> "hamburguesa").
+    Se aplica igual a los alias y al texto, así singular/plural matchean solos.
+    """
+    tok = tok.translate(_ACCENTS)
+    if len(tok) > 3 and tok.endswith("s"):
+        tok = tok[:-1]
+    return tok
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+class MenuMatcher:
+    """
+    Índice del menú compilado una vez: trie de tokens (alias + sinónimos + plurales)
+    -> id de ítem. parse() recorre el texto una sola vez y devuelve [(item_id, qty)].
+
+    items: [{"id": "coca", "name": "coca", "price": 2000, "aliases": ["coca", "coca cola"]}, ...]
+    """
+
+    def __init__(self, items: Iterable[Dict[str, Any]]):
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self._trie: Dict[str, Any] = {}
+        # token crudo -> (cantidad | None, token canónico); el vocabulario de los
+        # clientes es chico, así que casi siempre es un lookup
+        self._tok_cache: Dict[str, Tuple[int | None, str]] = {}
+        for item in items:
+            self.items[item["id"]] = item
+            for alias in [item["name"], *item.get("aliases", [])]:
+                self._add(alias, item["id"])
+
+    def _add(self, alias: str, item_id: str) -> None:
+        node = self._trie
+        for tok in tokenize(alias):
+            if tok in _FILLER:
+                continue
+            node = node.setdefault(_stem(tok), {})
+        node[_END] = item_id
+
+    def _longest(self, toks: List[str], i: int) -> Tuple[str | None, int]:
+        """
+        Match más largo arrancando en toks[i]. Devuelve (item_id, índice siguiente).
+        """
+        node = self._trie
+        found, end = None, i
+        j = i
+        while j < len(toks):
+            tok = toks[j]
+            if tok in _FILLER:
+                j += 1
+                continue
+            node = node.get(tok)
+            if node is None:
+                break
+            j += 1
+            if _END in node:
+                found, end = node[_END], j
+        return found, end
+
+    @staticmethod
+    def _classify(tok: str) -> Tuple[int | None, str]:
+        if tok.isdigit():
+            return int(tok), ""
+        qty = WORD_NUM.get(tok.translate(_ACCENTS))
+        return qty, (tok if tok in _FILLER else _stem(tok))
+
+    def parse(self, text: str) -> List[Tuple[str, int]]:
+        """
+        "2 hamburguesas dobles y una coca" -> [("hamburguesa_doble", 2), ("coca", 1)]
+        Un ítem sin cantidad cuenta 1, salvo que venga negado ("no quiero coca",
+        "sin papas"): ese no se pide. Con cantidad explícita sí cuenta ("no, quiero
+        2 hamburguesas"). Ítems repetidos se suman (respeta el orden).
+        """
+        cache = self._tok_cache
+        qty_of: List[int | None] = []
+        toks: List[str] = []
+        for tok in tokenize(text):
+            hit = cache.get(tok)
+            if hit is None:
+                hit = self._classify(tok)
+                if len(cache) < 50_000:
+                    cache[tok] = hit
+            qty_of.append(hit[0])
+            toks.append(hit[1])
+
+        out: Dict[str, int] = {}
+        pending: int | None = None
+        negated = False
+        i = 0
+        while i < len(toks):
+            if qty_of[i] is not None:
+                pending = qty_of[i]
+                negated = False
+                i += 1
+                continue
+            item_id, end = self._longest(toks, i)
+            if item_id is None:
+                if toks[i] in _NEGATION:
+                    negated = True
+                elif toks[i] in _CONNECTOR:
+                    negated = False
+                i += 1
+                continue
+            qty = pending if pending is not None else (0 if negated else 1)
+            if qty > 0:
+                out[item_id] = out.get(item_id, 0) + qty
+            pending = None
+            negated = False
+            i = end
+        return list(out.items())
+
+    def match_name(self, name: str) -> Dict[str, Any] | None:
+        """
+        Ítem del menú para un nombre suelto (ej: lo que devuelve la IA), o None.
+        """
+        found = self.parse(name)
+        return self.items[found[0][0]] if found else None
+
+    def price(self, item_id: str) -> int:
+        item = self.items.get(item_id)
+        return int(item["price"]) if item else 0
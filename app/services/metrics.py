@@ -0,0 +1,226 @@
+# app/services/metrics.py
+from __future__ import annotations
+
+import bisect
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+# Métricas estilo Prometheus para /metrics (formato de texto 0.0.4), sin dependencias.
+#
+# Counters e histogramas escriben en una celda POR THREAD: el camino caliente
+# no toma locks ni compite con otros threads (un dict.get + una suma). El
+# scrape suma las celdas de todos los threads. Las celdas de threads muertos
+# se pliegan en una sola, así la memoria no crece con threads efímeros.
+# Los gauges se calculan al momento del scrape (callback).
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").strip() == "1"
+
+# en segundos; arranca en 100µs porque un paso del state_machine anda por ahí
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+class _PerThread:
+    """
+    Una celda (dict) por thread. Solo el thread dueño la escribe.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cells: List[Tuple[threading.Thread, Dict[Labels, Any]]] = []
+        self._retired: Dict[Labels, Any] = {}
+
+    def cell(self) -> Dict[Labels, Any]:
+        try:
+            return self._local.cell
+        except AttributeError:
+            pass
+        cell: Dict[Labels, Any] = {}
+        with self._lock:
+            self._fold_dead()
+            self._cells.append((threading.current_thread(), cell))
+        self._local.cell = cell
+        return cell
+
+    def _fold_dead(self) -> None:
+        alive = []
+        for th, cell in self._cells:
+            if th.is_alive():
+                alive.append((th, cell))
+            else:
+                self._merge(self._retired, cell)
+        self._cells = alive
+
+    @staticmethod
+    def _merge(into: Dict[Labels, Any], cell: Dict[Labels, Any]) -> None:
+        for key, value in cell.items():
+            if isinstance(value, list):
+                acc = into.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    acc[i] += v
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def snapshot(self) -> Dict[Labels, Any]:
+        with self._lock:
+            cells = [cell for _, cell in self._cells]
+            out: Dict[Labels, Any] = {}
+            self._merge(out, self._retired)
+        for cell in cells:
+            # dict(cell) es atómico bajo el GIL: no choca con el thread que escribe
+            self._merge(out, {k: list(v) if isinstance(v, list) else v for k, v in dict(cell).items()})
+        return out
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._cells = _PerThread()
+
+    def inc(self, *labels: str, n: float = 1) -> None:
+        if not METRICS_ENABLED:
+            return
+        cell = self._cells.cell()
+        cell[labels] = cell.get(labels, 0) + n
+
+    def values(self) -> Dict[Labels, float]:
+        return self._cells.snapshot()
+
+    def samples(self) -> Iterable[Tuple[str, Labels, Labels, float]]:
+        for key, value in sorted(self.values().items()):
+            yield self.name + "_total", self.labelnames, key, value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._cells = _PerThread()
+
+    def observe(self, seconds: float, *labels: str) -> None:
+        if not METRICS_ENABLED:
+            return
+        cell = self._cells.cell()
+        slot = cell.get(labels)
+        if slot is None:
+            # [bucket_0 .. bucket_n-1, +Inf, sum]
+            slot = cell[labels] = [0] * (len(self.buckets) + 2)
+        slot[bisect.bisect_left(self.buckets, seconds)] += 1
+        slot[-1] += seconds
+
+    def samples(self) -> Iterable[Tuple[str, Labels, Labels, float]]:
+        names = self.labelnames + ("le",)
+        for key, slot in sorted(self._cells.snapshot().items()):
+            running = 0
+            for le, n in zip(self.buckets, slot):
+                running += n
+                yield self.name + "_bucket", names, key + (repr(le),), running
+            running += slot[-2]
+            yield self.name + "_bucket", names, key + ("+Inf",), running
+            yield self.name + "_sum", self.labelnames, key, slot[-1]
+            yield self.name + "_count", self.labelnames, key, running
+
+
+class Gauge:
+    """
+    Valor calculado al scrapear: fn() -> número, o {labels: número}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Any], labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.fn = fn
+
+    def samples(self) -> Iterable[Tuple[str, Labels, Labels, float]]:
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for key, v in sorted(value.items()):
+            yield self.name, self.labelnames, key, v
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        """
+        Mismo nombre -> misma métrica (counters/histogramas). Un gauge con el
+        mismo nombre reemplaza al anterior (ej: app.main y app.asgi en el mismo proceso).
+        """
+        with self._lock:
+            current = self._metrics.get(metric.name)
+            if current is not None and not isinstance(metric, Gauge):
+                return current
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            for name, labelnames, key, value in m.samples():
+                lines.append(f"{name}{_labels(labelnames, key)} {_num(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Labels, values: Labels) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _num(value: float) -> str:
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def gauge(name: str, help: str, fn: Callable[[], Any], labels: Iterable[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help, fn, labels))
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -1,30 +1,58 @@
 # app/services/order_writer.py
 from __future__ import annotations
 
+import atexit
+import logging
 import os
+import queue
+import threading
+import time
 from datetime import datetime
-from typing import Any, Dict
+from typing import Any, Dict, List
 
+from app.db import repository
+from app.db.conn import init_db
 
-def write_order(phone: str, data: Dict[str, Any], out_dir: str = "orders") -> str:
+logger = logging.getLogger(__name__)
+
+# Órdenes confirmadas -> tabla `orders`, en lotes (un commit cada ORDER_FLUSH_MS
+# u ORDER_BATCH_MAX órdenes). El .txt por pedido pasa a ser un export opcional.
+ORDER_FLUSH_MS = int(os.getenv("ORDER_FLUSH_MS", "200"))
+ORDER_BATCH_MAX = int(os.getenv("ORDER_BATCH_MAX", "100"))
+ORDER_TEXT_EXPORT = os.getenv("ORDER_TEXT_EXPORT", "0").strip() == "1"
+ORDER_TEXT_DIR = os.getenv("ORDER_TEXT_DIR", "orders").strip() or "orders"
+# lote que no se pudo insertar: se reintenta con backoff exponencial (tope en
+# seg). Son órdenes que el cliente ya vio confirmadas, no se descartan.
+ORDER_RETRY_MAX_SEC = float(os.getenv("ORDER_RETRY_MAX_SEC", "5"))
+
+_STOP = object()
+_RETRY_MIN_SEC = 0.1
+
+
+def _safe_phone(phone: str) -> str:
+    return "".join(c for c in (phone or "unknown") if c.isdigit() or c in ("+", "_", "-")) or "unknown"
+
+
+def export_order_text(phone: str, data: Dict[str, Any], out_dir: str = ORDER_TEXT_DIR) -> str:
     """
-    Guarda una orden en /orders con nombre timestamp_phone.txt
+    Guarda una orden como texto en /<out_dir>/<YYYYMMDD>/timestamp_phone.txt
+    (un subdirectorio por día para que no crezca un solo directorio para siempre).
     Devuelve el path generado.
     """
 
     # root del proyecto (2 niveles arriba: app/services -> app -> project)
     base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
-    out_path = os.path.join(base_dir, out_dir)
+    now = datetime.now()
+    out_path = os.path.join(base_dir, out_dir, now.strftime("%Y%m%d"))
     os.makedirs(out_path, exist_ok=True)
 
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    safe_phone = "".join(c for c in (phone or "unknown") if c.isdigit() or c in ("+", "_", "-")) or "unknown"
-    filename = f"{ts}_{safe_phone}.txt"
+    ts = now.strftime("%Y%m%d_%H%M%S")
+    filename = f"{ts}_{_safe_phone(phone)}.txt"
     fullpath = os.path.join(out_path, filename)
 
     items = data.get("items") or []
     lines = []
-    lines.append(f"Fecha: {datetime.now().isoformat(sep=' ', timespec='seconds')}")
+    lines.append(f"Fecha: {now.isoformat(sep=' ', timespec='seconds')}")
     lines.append(f"Telefono: {phone}")
     lines.append("")
 
@@ -43,13 +71,143 @@ def write_order(phone: str, data: Dict[str, Any], out_dir: str = "orders") -> st
     with open(fullpath, "w", encoding="utf-8") as f:
         f.write("\n".join(lines))
 
-    # opcional: último pedido por teléfono
-    try:
-        latest = os.path.join(out_path, f"latest_{safe_phone}.txt")
-        with open(latest, "w", encoding="utf-8") as f:
-            f.write("\n".join(lines))
-    except Exception:
-        pass
-
     return fullpath
 
+
+class OrderWriter:
+    """
+    Escritor en lotes: submit() encola y vuelve enseguida; un thread junta
+    órdenes e inserta cada lote en una sola transacción. Si ORDER_TEXT_EXPORT=1,
+    después del commit exporta los .txt desde el mismo thread (fuera del request).
+    Si el insert falla, el mismo lote se reintenta hasta que entre (o hasta el
+    plazo de close(); lo que quede va completo al log de error).
+    """
+
+    def __init__(
+        self,
+        flush_ms: int = ORDER_FLUSH_MS,
+        batch_max: int = ORDER_BATCH_MAX,
+        text_export: bool = ORDER_TEXT_EXPORT,
+    ):
+        self._interval = max(1, int(flush_ms)) / 1000.0
+        self._batch_max = max(1, int(batch_max))
+        self._text_export = text_export
+        self._queue: queue.Queue = queue.Queue()
+        self._closing = threading.Event()
+        self._deadline = 0.0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.batches = 0
+        init_db()
+        self._thread = threading.Thread(target=self._run, name="order-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, phone: str, data: Dict[str, Any]) -> None:
+        order = dict(data)
+        order["phone"] = phone
+        order["created_at"] = datetime.utcnow().isoformat()
+        self._queue.put(order)
+
+    def _drain(self, first: Any) -> List[Any]:
+        batch = [first]
+        while len(batch) < self._batch_max:
+            try:
+                batch.append(self._queue.get(timeout=self._interval))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, orders: List[Dict[str, Any]]) -> None:
+        if not orders:
+            return
+        delay = _RETRY_MIN_SEC
+        while True:
+            try:
+                repository.insert_orders(orders)
+                break
+            except Exception as e:
+                self.retries += 1
+                logger.error("order insert failed", extra={
+                    "event": "orders.insert_failed", "orders": len(orders), "error": str(e),
+                })
+            if self._closing.is_set():
+                # apagando: reintentos solo dentro del plazo de close()
+                left = self._deadline - time.monotonic()
+                if left <= 0:
+                    self.failed += len(orders)
+                    logger.error("orders not written", extra={"event": "orders.lost", "orders": orders})
+                    return
+                delay = min(delay, left)
+            time.sleep(delay)
+            delay = min(delay * 2, ORDER_RETRY_MAX_SEC)
+        self.written += len(orders)
+        self.batches += 1
+
+        if self._text_export:
+            for o in orders:
+                try:
+                    export_order_text(o.get("phone") or "unknown", o)
+                except Exception as e:
+                    logger.error("order text export failed", extra={"event": "orders.export_failed", "error": str(e)})
+
+    def _run(self) -> None:
+        while True:
+            batch = self._drain(self._queue.get())
+            stop = any(o is _STOP for o in batch)
+            self._write([o for o in batch if o is not _STOP])
+            if stop:
+                return
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Escribe lo pendiente (reintentando hasta `timeout`) y frena el thread.
+        """
+        if self._thread.is_alive():
+            self._deadline = time.monotonic() + timeout
+            self._closing.set()
+            self._queue.put(_STOP)
+            self._thread.join(timeout + 1.0)
+        left = self._queue.qsize()
+        if left:
+            logger.error("order writer closed with pending orders", extra={"event": "orders.lost", "pending": left})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+            "retries": self.retries,
+            "batches": self.batches,
+        }
+
+
+_writer: OrderWriter | None = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> OrderWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                w = OrderWriter()
+                atexit.register(w.close)
+                _writer = w
+    return _writer
+
+
+def write_order(phone: str, data: Dict[str, Any]) -> None:
+    """
+    Encola una orden confirmada para la tabla `orders` (no bloquea el paso de conversación).
+    """
+    get_writer().submit(phone, data)
+
+
+def close_writer(timeout: float = 10.0) -> None:
+    """
+    Escribe las órdenes pendientes si el writer ya se creó (shutdown del worker).
+    """
+    w = _writer
+    if w is not None:
+        w.close(timeout)
@@ -0,0 +1,311 @@
+# app/services/outbox.py
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from app.db import repository
+from app.db.conn import init_db
+from app.services.metrics import counter, histogram
+from app.services.whatsapp_client import RETRY_STATUS, get_client
+
+logger = logging.getLogger(__name__)
+
+# Outbox de respuestas: el paso de conversación no manda nada, deja la
+# respuesta en la tabla `outbox` en la misma transacción que la sesión (ver
+# session_store) y vuelve. Un thread por proceso la drena:
+# - toma lotes vencidos con lease (varios workers comparten la tabla sin pisarse)
+# - manda en paralelo entre teléfonos y en orden dentro de cada uno
+# - reintenta con backoff lo que Graph rechaza por 429/5xx o sin conexión, descarta
+#   lo demás (un timeout de lectura también: Graph pudo haberla aceptado)
+# - lo que quedó sin mandar (crash, deploy) sale cuando arranca el próximo proceso
+# OUTBOX_ENABLED=0: envío directo dentro del paso, como antes.
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1").strip() == "1"
+OUTBOX_BATCH_MAX = int(os.getenv("OUTBOX_BATCH_MAX", "64"))
+# teléfonos en paralelo (además vale WHATSAPP_MAX_INFLIGHT del cliente)
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS", "16"))
+# si no hay nada que mandar: cada cuánto mira la tabla (respuestas de otros workers,
+# reintentos vencidos); las de este proceso lo despiertan al toque con notify()
+OUTBOX_POLL_MS = int(os.getenv("OUTBOX_POLL_MS", "500"))
+# cuánto tiempo es "suya" una respuesta tomada; si el proceso muere, otro la
+# retoma después. Tiene que superar el peor envío (timeout * reintentos del cliente)
+OUTBOX_LEASE_SEC = float(os.getenv("OUTBOX_LEASE_SEC", "90"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))
+# enviadas/descartadas: cuánto quedan en la tabla antes de borrarse
+OUTBOX_KEEP_SEC = float(os.getenv("OUTBOX_KEEP_SEC", "86400"))
+OUTBOX_PURGE_SEC = float(os.getenv("OUTBOX_PURGE_SEC", "300"))
+# al apagar: cuánto espera a que salga lo pendiente (lo que no, queda en la tabla)
+OUTBOX_DRAIN_SEC = float(os.getenv("OUTBOX_DRAIN_SEC", "10"))
+
+# result = sent | retry | dead
+OUTBOX_SENDS = counter("vendobot_outbox_sends", "Respuestas del outbox por resultado", ("result",))
+# desde que se encoló hasta que Graph la aceptó (incluye reintentos)
+OUTBOX_LAG = histogram("vendobot_outbox_lag_seconds", "Demora de una respuesta en el outbox")
+
+Row = Tuple[str, str, str]
+
+_wake = threading.Event()
+
+
+def notify() -> None:
+    """
+    Hay respuestas nuevas commiteadas: despierta al sender de este proceso.
+    """
+    _wake.set()
+
+
+def outbox_rows(phone: str, replies: Iterable[str], msg_id: str = "") -> List[Row]:
+    """
+    (idem_key, phone, body) por respuesta no vacía. La clave sale del wamid
+    entrante: si Meta reentrega el mismo mensaje, la respuesta no se duplica.
+    """
+    base = msg_id or f"{phone}:{uuid.uuid4().hex}"
+    return [(f"{base}:{i}", phone, body) for i, body in enumerate(replies) if body]
+
+
+def retry_delay(attempts: int) -> float:
+    # full jitter, como backoff_delay del cliente pero en otra escala (minutos)
+    cap = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return random.uniform(cap / 2, cap)
+
+
+def _send_text(phone: str, body: str, idem_key: str) -> Dict[str, Any]:
+    return get_client().send_text(phone, body, idem_key=idem_key)
+
+
+class OutboxSender:
+    """
+    Un thread que drena la tabla `outbox` (ver claim_outbox en repository.py)
+    más un pool chico para mandar varios teléfonos a la vez.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, str, str], Dict[str, Any]] = _send_text,
+        batch_max: int = OUTBOX_BATCH_MAX,
+        senders: int = OUTBOX_SENDERS,
+        poll_ms: int = OUTBOX_POLL_MS,
+        lease_sec: float = OUTBOX_LEASE_SEC,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        start: bool = True,
+    ):
+        self._send = send
+        self._batch_max = max(1, int(batch_max))
+        self._poll = max(1, int(poll_ms)) / 1000.0
+        self._lease = max(1.0, float(lease_sec))
+        self._max_attempts = max(1, int(max_attempts))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(senders)), thread_name_prefix="outbox-send")
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._closed = False
+        self._purged_at = 0.0
+        # cuánto tardó el último lote: al apagar no se arranca uno que no entra en el plazo
+        self._batch_sec = 0.0
+        # False: WhatsApp sin configurar, el paso no encola respuestas (nadie las mandaría)
+        self.sending = start
+
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+        self.batches = 0
+
+        init_db()
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        if start:
+            self._thread.start()
+
+    def _send_phone(self, rows: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], Dict[str, Any] | None]]:
+        """
+        Las respuestas de un teléfono, en orden. Si una falla, las siguientes
+        no se intentan (resultado None): vuelven con ella.
+        """
+        out: List[Tuple[Dict[str, Any], Dict[str, Any] | None]] = []
+        failed = False
+        for row in rows:
+            if failed:
+                out.append((row, None))
+                continue
+            try:
+                res = self._send(row["phone"], row["body"], row["idem_key"])
+            except Exception as e:
+                res = {"ok": False, "status": None, "error": str(e), "retryable": False}
+            out.append((row, res))
+            failed = not res.get("ok")
+            if not failed:
+                OUTBOX_LAG.observe(time.time() - row["created_at"])
+        return out
+
+    def drain_once(self, deadline: float | None = None) -> int:
+        """
+        Un lote: tomar, mandar, registrar. Devuelve cuántas se tomaron.
+        Con `deadline` (monotonic) no espera más que eso: los teléfonos que no
+        arrancaron se liberan y los que están mandando quedan con su lease.
+        """
+        started = time.monotonic()
+        now = time.time()
+        rows = repository.claim_outbox(now, now + self._lease, self._batch_max)
+        if not rows:
+            return 0
+        by_phone: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_phone.setdefault(row["phone"], []).append(row)
+
+        sent, retry, dead, release = [], [], [], []
+        futures = [self._executor.submit(self._send_phone, phone_rows) for phone_rows in by_phone.values()]
+        finished, not_done = wait(futures, timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+        cut = 0
+        for fut, phone_rows in zip(futures, by_phone.values()):
+            if fut in not_done:
+                cut += len(phone_rows)
+                if fut.cancel():
+                    release.extend((time.time(), row["id"]) for row in phone_rows)
+        if cut:
+            logger.warning("outbox drain cut by deadline", extra={"event": "outbox.drain_cut", "rows": cut})
+        for fut in futures:
+            if fut not in finished:
+                continue
+            results = fut.result()
+            again_at = time.time()
+            for row, res in results:
+                done = time.time()
+                if res is None:
+                    release.append((again_at, row["id"]))
+                elif res.get("ok"):
+                    sent.append((done, row["id"]))
+                else:
+                    error = str(res.get("error") or res.get("status") or "")
+                    status = res.get("status")
+                    retryable = res.get("retryable", status in RETRY_STATUS)
+                    if retryable and row["attempts"] + 1 < self._max_attempts:
+                        again_at = done + retry_delay(row["attempts"] + 1)
+                        retry.append((again_at, error, row["id"]))
+                    else:
+                        again_at = done
+                        dead.append((done, error, row["id"]))
+                        logger.error("outbox reply dropped", extra={
+                            "event": "outbox.dead", "phone": row["phone"], "idem_key": row["idem_key"],
+                            "status": status, "attempts": row["attempts"] + 1, "error": error,
+                        })
+        try:
+            repository.finish_outbox(sent, retry, dead, release)
+        except Exception as e:
+            # quedan con lease: se retoman cuando venza (reenvío posible de las enviadas)
+            logger.error("outbox finish failed", extra={"event": "outbox.finish_failed", "error": str(e)})
+        OUTBOX_SENDS.inc("sent", n=len(sent))
+        OUTBOX_SENDS.inc("retry", n=len(retry))
+        OUTBOX_SENDS.inc("dead", n=len(dead))
+        with self._lock:
+            self.sent += len(sent)
+            self.retried += len(retry)
+            self.dead += len(dead)
+            self.batches += 1
+        self._batch_sec = time.monotonic() - started
+        return len(rows)
+
+    def _purge(self) -> None:
+        now = time.time()
+        if now - self._purged_at < OUTBOX_PURGE_SEC:
+            return
+        self._purged_at = now
+        try:
+            repository.purge_outbox(now - OUTBOX_KEEP_SEC)
+        except Exception as e:
+            logger.error("outbox purge failed", extra={"event": "outbox.purge_failed", "error": str(e)})
+
+    def _run(self) -> None:
+        while not self._stopped:
+            try:
+                taken = self.drain_once()
+            except Exception:
+                logger.exception("outbox drain failed", extra={"event": "outbox.drain_failed"})
+                taken = 0
+            if taken < self._batch_max:
+                # lote incompleto: no queda nada vencido, esperar respuestas nuevas
+                _wake.wait(self._poll)
+                _wake.clear()
+            self._purge()
+
+    def close(self, timeout: float = OUTBOX_DRAIN_SEC) -> None:
+        """
+        Manda lo que esté vencido y frena el thread, todo dentro de `timeout`
+        (el master de gunicorn no espera más): un lote arranca solo si entra en
+        lo que queda (según lo que tardó el anterior), cada lote se corta en el
+        plazo y los envíos que sigan en vuelo no se esperan. Lo que quede sin
+        mandar sigue en la tabla para el próximo proceso.
+        """
+        deadline = time.monotonic() + max(0.0, timeout)
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stopped = True
+        _wake.set()
+        if not self._thread.is_alive():
+            # nunca arrancó (WhatsApp sin configurar): todo queda en la tabla
+            self._executor.shutdown(wait=True)
+            return
+        self._thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        # el thread sigue en un lote: no drenar en paralelo con él
+        while not self._thread.is_alive() and deadline - time.monotonic() > self._batch_sec:
+            try:
+                if not self.drain_once(deadline):
+                    break
+            except Exception:
+                logger.exception("outbox drain failed", extra={"event": "outbox.drain_failed"})
+                break
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {
+                "sent": self.sent,
+                "retried": self.retried,
+                "dead": self.dead,
+                "batches": self.batches,
+            }
+        try:
+            out["pending"] = repository.pending_outbox()
+        except Exception:
+            out["pending"] = None
+        return out
+
+
+_sender: OutboxSender | None = None
+_sender_lock = threading.Lock()
+
+
+def get_sender() -> OutboxSender:
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                configured = get_client().configured
+                if not configured:
+                    # no se encolan respuestas (ver `sending`); lo que ya estaba en la
+                    # tabla sale cuando arranque un proceso configurado
+                    logger.warning("WHATSAPP_TOKEN o PHONE_NUMBER_ID faltante: el outbox no envía", extra={
+                        "event": "whatsapp.unconfigured",
+                    })
+                sender = OutboxSender(start=configured)
+                atexit.register(sender.close)
+                _sender = sender
+    return _sender
+
+
+def close_sender(timeout: float = OUTBOX_DRAIN_SEC) -> None:
+    """
+    Drenado final si el sender ya se creó (shutdown del worker, después de
+    close_store). `timeout` es lo que le queda al apagado, no más de OUTBOX_DRAIN_SEC.
+    """
+    s = _sender
+    if s is not None:
+        s.close(timeout)
@@ -0,0 +1,495 @@
+# app/services/session_store.py
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.db import repository
+from app.db.conn import init_db
+from app.domain.session import STATE_DONE, Session, pack, unpack
+from app.domain.states import ConversationState
+from app.services.menu import get_menu
+from app.services.metrics import counter, gauge
+from app.services.outbox import Row, notify as notify_outbox
+
+logger = logging.getLogger(__name__)
+
+# SESSION_BACKEND:
+# - "sqlite": tabla sessions (sobrevive reinicios)
+# - "memory": dict en RAM (como era antes; útil para pruebas)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite").strip().lower()
+
+# Solo para sqlite. SESSION_WRITE_MODE:
+# - "behind": cache LRU en RAM + flush agrupado cada SESSION_FLUSH_INTERVAL_MS o
+#   SESSION_FLUSH_MAX sesiones sucias (un commit por lote, no por mensaje).
+#   Ante un crash se pierde a lo sumo el último intervalo. Asume que un solo
+#   proceso atiende a cada teléfono. Un save con respuesta (outbox) no espera
+#   el intervalo: dispara el flush enseguida.
+# - "through": commit por mensaje (máxima durabilidad)
+SESSION_WRITE_MODE = os.getenv("SESSION_WRITE_MODE", "behind").strip().lower()
+SESSION_FLUSH_INTERVAL_MS = int(os.getenv("SESSION_FLUSH_INTERVAL_MS", "500"))
+SESSION_FLUSH_MAX = int(os.getenv("SESSION_FLUSH_MAX", "256"))
+
+# Sesiones en RAM (cache de sqlite o backend memory), topes duros: lo que no
+# entre sale por LRU. Con sqlite solo sale de RAM; con "memory" se olvida.
+SESSION_CACHE_MAX = int(os.getenv("SESSION_CACHE_MAX", "10000"))
+SESSION_MEM_MAX_MB = float(os.getenv("SESSION_MEM_MAX_MB", "64"))
+# Inactividad (0 = sin vencimiento). Mismo criterio que los topes: con sqlite
+# la sesión sigue en la base, solo deja de ocupar RAM.
+SESSION_IDLE_TTL_SEC = float(os.getenv("SESSION_IDLE_TTL_SEC", "86400"))
+# Sesiones en DONE (pedido cerrado): se olvidan antes, también de la tabla
+# sessions; el cliente que vuelve arranca de cero.
+SESSION_DONE_TTL_SEC = float(os.getenv("SESSION_DONE_TTL_SEC", "900"))
+# sqlite: cada cuánto se borran las DONE vencidas
+SESSION_PURGE_SEC = float(os.getenv("SESSION_PURGE_SEC", "60"))
+
+# lo que cuesta cada entrada en los OrderedDict además de la Session (nodo,
+# slot del hash); bench_replay --sessions compara contra tracemalloc
+_ENTRY_OVERHEAD = 104
+
+SESSIONS_EVICTED = counter(
+    "vendobot_sessions_evicted", "Sesiones que salieron de RAM (idle | done | cap)", ("reason",)
+)
+
+
+def _menu_items():
+    return get_menu().matcher.items
+
+
+def _entry_size(phone: str, s: Session) -> int:
+    # no se guarda en la sesión (serían 28 bytes más por entrada): una Session
+    # guardada no cambia salvo `touched`, así que se recalcula igual al sacarla
+    return s.nbytes() + sys.getsizeof(phone) + _ENTRY_OVERHEAD
+
+
+class SessionTable:
+    """
+    phone -> Session (compacta, ver domain/session.py) en orden LRU, con topes
+    de cantidad y de bytes y vencimiento por inactividad.
+
+    Como `touched` crece con el orden (igual que MemoryDedupe), las vencidas
+    están al principio: se sacan desde la cabeza, O(1) amortizado. Las que
+    están en DONE van además a una segunda cola con su TTL más corto.
+
+    No toma locks: cada store la usa bajo el suyo. pinned(phone) marca las que
+    todavía no se pueden sacar (sucias, sin bajar a la base).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SESSION_CACHE_MAX,
+        max_mb: float = SESSION_MEM_MAX_MB,
+        idle_ttl: float = SESSION_IDLE_TTL_SEC,
+        done_ttl: float = SESSION_DONE_TTL_SEC,
+        pinned: Callable[[str], bool] | None = None,
+    ):
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_mb * 1024 * 1024))
+        self.idle_ttl = idle_ttl
+        self.done_ttl = done_ttl
+        self._pinned = pinned or (lambda phone: False)
+        self._lru: "OrderedDict[str, Session]" = OrderedDict()
+        self._done: "OrderedDict[str, Session]" = OrderedDict()
+        self.nbytes = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _ttl(self, s: Session) -> float:
+        if s.state == STATE_DONE and self.done_ttl > 0:
+            return min(self.done_ttl, self.idle_ttl) if self.idle_ttl > 0 else self.done_ttl
+        return self.idle_ttl
+
+    def get(self, phone: str, now: float) -> Session | None:
+        s = self._lru.get(phone)
+        if s is None:
+            return None
+        ttl = self._ttl(s)
+        if ttl > 0 and now - s.touched >= ttl and not self._pinned(phone):
+            done = s.state == STATE_DONE
+            self._drop(phone, "done" if done else "idle")
+            # DONE vencida: se lee como sesión nueva aunque la base todavía la
+            # tenga (la borra maybe_purge); inactiva: con sqlite se relee de la base
+            return Session() if done else None
+        s.touched = now
+        self._lru.move_to_end(phone)
+        if s.state == STATE_DONE:
+            self._done.move_to_end(phone)
+        return s
+
+    def put(self, phone: str, s: Session, now: float) -> None:
+        self.pop(phone)
+        s.touched = now
+        self._lru[phone] = s
+        self.nbytes += _entry_size(phone, s)
+        if s.state == STATE_DONE:
+            self._done[phone] = s
+
+    def setdefault(self, phone: str, s: Session, now: float) -> Session:
+        found = self._lru.get(phone)
+        if found is not None:
+            return found
+        self.put(phone, s, now)
+        return s
+
+    def pop(self, phone: str) -> bool:
+        s = self._lru.pop(phone, None)
+        if s is None:
+            return False
+        self._done.pop(phone, None)
+        self.nbytes -= _entry_size(phone, s)
+        return True
+
+    def _drop(self, phone: str, reason: str) -> None:
+        self.pop(phone)
+        if reason == "cap":
+            self.evicted += 1
+        else:
+            self.expired += 1
+        SESSIONS_EVICTED.inc(reason)
+
+    def _expire(self, queue: "OrderedDict[str, Session]", ttl: float, now: float, reason: str) -> None:
+        cutoff = now - ttl
+        victims = []
+        for phone, s in queue.items():
+            if s.touched > cutoff:
+                break
+            if not self._pinned(phone):
+                victims.append(phone)
+        for phone in victims:
+            self._drop(phone, reason)
+
+    def trim(self, now: float) -> None:
+        """
+        DONE vencidas, después inactivas, después LRU hasta entrar en los topes.
+        """
+        if self._done and self.done_ttl > 0:
+            self._expire(self._done, self.done_ttl, now, "done")
+        if self.idle_ttl > 0:
+            self._expire(self._lru, self.idle_ttl, now, "idle")
+        over_n = len(self._lru) - self.max_entries
+        over_b = self.nbytes - self.max_bytes
+        if over_n <= 0 and over_b <= 0:
+            return
+        victims = []
+        for phone, s in self._lru.items():
+            if over_n <= 0 and over_b <= 0:
+                break
+            if self._pinned(phone):
+                continue
+            victims.append(phone)
+            over_n -= 1
+            over_b -= _entry_size(phone, s)
+        for phone in victims:
+            self._drop(phone, "cap")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._lru),
+            "done": len(self._done),
+            "bytes": self.nbytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+
+class MemorySessionStore:
+    """
+    Sesiones solo en RAM (se pierden al reiniciar), compactas y acotadas: las
+    que vencen o no entran en los topes se olvidan y el cliente arranca de cero.
+    """
+
+    def __init__(self, **limits: Any):
+        self._table = SessionTable(**limits)
+        self._lock = threading.Lock()
+
+    def load(self, phone: str) -> Tuple[str, Dict[str, Any]]:
+        with self._lock:
+            s = self._table.get(phone, time.monotonic())
+        if s is None:
+            return ConversationState.NEW.value, {}
+        return unpack(s, _menu_items())
+
+    def save(self, phone: str, state: str, data: Dict[str, Any], outbox: List[Row] = ()) -> None:
+        s = pack(state, data, _menu_items())
+        now = time.monotonic()
+        with self._lock:
+            self._table.put(phone, s, now)
+            self._table.trim(now)
+        if outbox:
+            # la sesión no es durable acá: la respuesta va sola a la tabla
+            repository.enqueue_outbox(outbox)
+            notify_outbox()
+
+    def reset(self, phone: str) -> bool:
+        with self._lock:
+            return self._table.pop(phone)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", **self._table.stats()}
+
+    def nbytes(self) -> int:
+        return self._table.nbytes
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+class SqliteSessionStore:
+    """
+    Sesiones en la tabla `sessions` vía repository (pool de conexiones, ver db/conn.py).
+    """
+
+    def __init__(self, done_ttl: float = SESSION_DONE_TTL_SEC):
+        init_db()
+        self.done_ttl = done_ttl
+        self._purge_lock = threading.Lock()
+        self._purged_at = 0.0
+
+    def load(self, phone: str) -> Tuple[str, Dict[str, Any]]:
+        state, data = repository.get_session(phone, done_before=self._done_before())
+        return str(getattr(state, "value", state)), data
+
+    def save(self, phone: str, state: str, data: Dict[str, Any], outbox: List[Row] = ()) -> None:
+        repository.upsert_session(phone, state, data, outbox)
+        if outbox:
+            notify_outbox()
+        self.maybe_purge()
+
+    def reset(self, phone: str) -> bool:
+        return repository.reset_session(phone)
+
+    def _done_before(self) -> str | None:
+        if self.done_ttl <= 0:
+            return None
+        return (datetime.utcnow() - timedelta(seconds=self.done_ttl)).isoformat()
+
+    def maybe_purge(self) -> int:
+        """
+        Borra las sesiones DONE sin actividad hace más de done_ttl (como mucho
+        cada SESSION_PURGE_SEC).
+        """
+        if self.done_ttl <= 0:
+            return 0
+        now = time.monotonic()
+        with self._purge_lock:
+            if now - self._purged_at < SESSION_PURGE_SEC:
+                return 0
+            self._purged_at = now
+        try:
+            return repository.purge_sessions(ConversationState.DONE.value, self._done_before())
+        except Exception as e:
+            logger.error("session purge failed", extra={"event": "sessions.purge_failed", "error": str(e)})
+            return 0
+
+
+class CachedSessionStore:
+    """
+    Cache LRU write-behind delante de SqliteSessionStore.
+
+    - load(): de RAM si está; si no, de la base (y queda cacheada)
+    - save(): solo marca la sesión como sucia; un thread la baja a la base en lote
+    - close(): flush final (se registra en atexit)
+
+    En RAM las sesiones van compactas (SessionTable): con tope de cantidad y de
+    bytes y vencimiento por inactividad. Las sucias nunca salen antes de llegar
+    a la base.
+    """
+
+    def __init__(
+        self,
+        backend: SqliteSessionStore,
+        max_entries: int = SESSION_CACHE_MAX,
+        flush_interval_ms: int = SESSION_FLUSH_INTERVAL_MS,
+        flush_max: int = SESSION_FLUSH_MAX,
+        **limits: Any,
+    ):
+        self._backend = backend
+        self._interval = max(1, int(flush_interval_ms)) / 1000.0
+        self._flush_max = max(1, int(flush_max))
+
+        self._dirty: Dict[str, Session] = {}
+        # lote que se está escribiendo ahora (tampoco se puede desalojar)
+        self._flushing: Dict[str, Session] = {}
+        # respuestas a commitear con el próximo lote de sesiones (en orden)
+        self._outbox: List[Row] = []
+        self._cache = SessionTable(max_entries=max_entries, pinned=self._pinned, **limits)
+        self._lock = threading.Lock()
+        # serializa flush vs reset (un reset no puede quedar pisado por un flush viejo)
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+        self.commits = 0
+        self.rows_flushed = 0
+
+        self._thread = threading.Thread(target=self._run, name="session-flush", daemon=True)
+        self._thread.start()
+
+    def _pinned(self, phone: str) -> bool:
+        return phone in self._dirty or phone in self._flushing
+
+    def load(self, phone: str) -> Tuple[str, Dict[str, Any]]:
+        with self._lock:
+            hit = self._cache.get(phone, time.monotonic())
+            if hit is not None:
+                self.hits += 1
+        if hit is None:
+            state, data = self._backend.load(phone)
+            packed = pack(state, data, _menu_items())
+            now = time.monotonic()
+            with self._lock:
+                self.misses += 1
+                hit = self._cache.setdefault(phone, packed, now)
+                self._cache.trim(now)
+            if hit is packed:
+                return state, data
+        # siempre un data nuevo: el flush nunca serializa un dict a medio modificar
+        return unpack(hit, _menu_items())
+
+    def save(self, phone: str, state: str, data: Dict[str, Any], outbox: List[Row] = ()) -> None:
+        entry = pack(state, data, _menu_items())
+        now = time.monotonic()
+        with self._lock:
+            self._cache.put(phone, entry, now)
+            self._dirty[phone] = entry
+            self._outbox.extend(outbox)
+            self.saves += 1
+            pending = len(self._dirty)
+            self._cache.trim(now)
+        # con respuesta no se espera al intervalo: flush ya (group commit de lo
+        # que se junte mientras tanto) y la respuesta sale apenas es durable
+        if outbox or pending >= self._flush_max:
+            self._wake.set()
+
+    def reset(self, phone: str) -> bool:
+        with self._flush_lock:
+            with self._lock:
+                in_cache = self._cache.pop(phone)
+                self._dirty.pop(phone, None)
+            return self._backend.reset(phone) or in_cache
+
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                batch, self._dirty = self._dirty, {}
+                outbox, self._outbox = self._outbox, []
+                self._flushing = batch
+            if not batch and not outbox:
+                return 0
+            menu_items = _menu_items()
+            rows = [(phone, *unpack(entry, menu_items)) for phone, entry in batch.items()]
+            try:
+                repository.upsert_sessions(rows, outbox)
+            except Exception as e:
+                # devolvemos el lote a sucias (salvo que ya haya algo más nuevo)
+                with self._lock:
+                    for phone, entry in batch.items():
+                        self._dirty.setdefault(phone, entry)
+                    self._outbox[:0] = outbox
+                    self._flushing = {}
+                logger.error("session flush failed", extra={"event": "sessions.flush_failed", "error": str(e)})
+                return 0
+            if outbox:
+                notify_outbox()
+            with self._lock:
+                self._flushing = {}
+                self.commits += 1
+                self.rows_flushed += len(rows)
+                self._cache.trim(time.monotonic())
+            return len(rows)
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            if not self.flush():
+                # sin nada que bajar igual vencen las inactivas
+                with self._lock:
+                    self._cache.trim(time.monotonic())
+            self._backend.maybe_purge()
+
+    def close(self) -> None:
+        self._stopped = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._cache.stats(),
+                "cached": len(self._cache),
+                "dirty": len(self._dirty),
+                "outbox_pending": len(self._outbox),
+                "hits": self.hits,
+                "misses": self.misses,
+                "saves": self.saves,
+                "commits": self.commits,
+                "rows_flushed": self.rows_flushed,
+            }
+
+    def nbytes(self) -> int:
+        return self._cache.nbytes
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if SESSION_BACKEND == "memory":
+                    _store = MemorySessionStore()
+                elif SESSION_WRITE_MODE == "through":
+                    _store = SqliteSessionStore()
+                else:
+                    store = CachedSessionStore(SqliteSessionStore())
+                    atexit.register(store.close)
+                    _store = store
+    return _store
+
+
+def _active_sessions():
+    # solo los stores con cache en memoria saben cuántas sesiones tienen vivas
+    store = _store
+    return len(store) if store is not None and hasattr(store, "__len__") else None
+
+
+def _session_bytes():
+    store = _store
+    return store.nbytes() if store is not None and hasattr(store, "nbytes") else None
+
+
+gauge("vendobot_sessions_active", "Sesiones en memoria del proceso", _active_sessions)
+gauge("vendobot_sessions_bytes", "Bytes estimados de las sesiones en memoria", _session_bytes)
+
+
+def close_store() -> None:
+    """
+    Flush final si el store ya se creó (shutdown del worker). No lo crea solo para cerrarlo.
+    """
+    store = _store
+    if store is not None:
+        getattr(store, "close", lambda: None)()
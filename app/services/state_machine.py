@@ -2,190 +2,67 @@
 from __future__ import annotations
 
 import re
-from enum import Enum
-from typing import Any, Dict, List, Tuple
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
 
+from app.domain.states import ConversationState
+from app.services.intents import INTENT_NAMES, classify
+from app.services.menu import MenuSnapshot, get_menu
+from app.services.metrics import counter, histogram
 
-class ConversationState(str, Enum):
-    NEW = "NEW"
-    AWAITING_ORDER = "AWAITING_ORDER"
-    ASK_DELIVERY = "ASK_DELIVERY"
-    ASK_ADDRESS = "ASK_ADDRESS"
-    ASK_PAYMENT = "ASK_PAYMENT"
-    ASK_NAME = "ASK_NAME"
-    ASK_CONFIRM = "ASK_CONFIRM"
-    DONE = "DONE"
 
-
-# ====== Config simple (podés moverlo a .env/archivo después) ======
-DELIVERY_FEE = 3000
-
-# Si tenés IA local integrada en llama_client.py, acá podés usarla sin romper nada:
-# - Si no existe o falla, el bot sigue con regex.
+# IA local vía extractor.py (backend completions/chat + cache + circuit breaker):
+# - Si no existe, falla o el breaker está abierto, el bot sigue con regex.
+# - Frases repetidas salen del cache de extracciones (no vuelven al modelo).
 try:
-    from app.services.llama_client import llama_extract  # type: ignore
+    from app.services.extractor import AI_ENABLED, extract as ai_extract  # type: ignore
 except Exception:
-    llama_extract = None
-
+    AI_ENABLED = False
+    ai_extract = None
 
-# ====== Menú (mantenemos tu texto actual) ======
-def _menu_text() -> str:
-    return (
-        "📋 MENÚ MARIETTA (HOY)\n\n"
-        "🍔 Hamburguesa simple $9000\n"
-        "🍔 Hamburguesa doble $12000\n"
-        "🍟 Papas $5000\n"
-        "🍝 Tallarines $10000\n"
-        "🥟 Empanadas de pollo $1500\n"
-        "🥟 Empanadas de carne $1500\n"
-        "🥤 Coca $2000\n"
-    )
+STEP_SECONDS = histogram("vendobot_step_seconds", "Duración de handle_message por estado de entrada", ("state",))
+# de dónde salió el pedido en AWAITING_ORDER: regex del menú, IA, o ninguno
+ORDER_PARSE = counter("vendobot_order_parse", "Pedidos parseados por origen", ("source",))
 
 
-def _menu_intro_text() -> str:
-    return (
-        "Hola! Somos *Marietta* 👋\n"
-        "📋 *Menú del día:*\n"
-        f"{_menu_text()}\n"
-        "Decime tu pedido con cantidades (ej: *2 hamburguesas y 1 coca*)."
-    )
+# ====== Menú ======
+# Texto, precios, costo de envío y alias salen de menu.json (ver services/menu.py).
+# Cada mensaje toma UN snapshot al entrar y lo usa de punta a punta, así una
+# recarga del archivo nunca se ve a medias dentro de un paso.
 
 
 # ====== Helpers texto ======
-_WORD_NUM = {
-    "un": 1, "una": 1, "uno": 1,
-    "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6,
-    "siete": 7, "ocho": 8, "nueve": 9, "diez": 10,
-    "once": 11, "doce": 12,
-    "trece": 13, "catorce": 14, "quince": 15,
-    "dieciseis": 16, "dieciséis": 16, "diecisiete": 17, "dieciocho": 18, "diecinueve": 19,
-    "veinte": 20,
-}
-
+# Las intenciones (saludo, menú, envío, pago, si/no) salen de intents.classify:
+# una sola pasada sobre el texto ya normalizado (Msg.text).
 def _norm(s: str) -> str:
     return re.sub(r"\s+", " ", s.strip().lower())
 
 
-def _looks_like_menu_request(text: str) -> bool:
-    t = _norm(text)
-    if t in ("menu", "menú", "carta", "que tienen", "qué tienen", "que hay", "qué hay"):
-        return True
-    if "menu" in t or "menú" in t:
-        return True
-    if "que" in t and "tienen" in t:
-        return True
-    return False
-
-
-def _is_greeting(text: str) -> bool:
-    t = _norm(text)
-    return any(x in t for x in ["hola", "buenas", "buen día", "buen dia", "buenas tardes", "buenas noches"])
+def _clean_item_name(name: str, menu: MenuSnapshot) -> str:
+    """
+    Nombre canónico del menú para un nombre suelto (ej: lo que devuelve la IA).
+    Si no está en el menú, devuelve el texto limpio tal cual.
+    """
+    item = menu.matcher.match_name(name)
+    if item:
+        return item["name"]
+    n = re.sub(r"[^a-záéíóúüñ\s]", " ", _norm(name))
+    return re.sub(r"\s+", " ", n).strip()
 
 
-def _parse_qty_token(tok: str) -> int | None:
-    tok = _norm(tok)
-    if tok.isdigit():
-        try:
-            return int(tok)
-        except Exception:
-            return None
-    return _WORD_NUM.get(tok)
-
-
-def _clean_item_name(name: str) -> str:
-    n = _norm(name)
-    n = n.replace("+", " ")
-    n = re.sub(r"[^a-záéíóúüñ\s]", " ", n)
-    n = re.sub(r"\s+", " ", n).strip()
-
-    # Normalizaciones típicas
-    # (ajustá acá si querés mapping más estricto)
-    if n in ("hamb", "hamburguesa", "hamburguesas"):
-        return "hamburguesa"
-    if "hamburguesa doble" in n:
-        return "hamburguesa doble"
-    if "hamburguesa simple" in n:
-        return "hamburguesa simple"
-    if "papa" in n or "papas" in n:
-        return "papas"
-    if "tallar" in n or "fideo" in n:
-        return "tallarines"
-    if "empanada" in n and "pollo" in n:
-        return "empanadas de pollo"
-    if "empanada" in n and "carne" in n:
-        return "empanadas de carne"
-    if "coca" in n:
-        return "coca"
-
-    return n
-
-
-def _parse_items_regex(text: str) -> List[Dict[str, Any]]:
+def _parse_items(text: str, menu: MenuSnapshot) -> List[Dict[str, Any]]:
     """
-    Soporta:
+    Soporta (una sola pasada sobre el texto, ver menu_matcher.py):
       - "2 hamburguesas y 1 coca"
       - "2 hamb + 1 coca"
       - "quiero 12 hamburguesas"
-      - "quiero doce hamburguesas"
+      - "quiero doce hamburguesas dobles y una coca cola"
+    Nombre y precio quedan fijos en el ítem: una recarga del menú no cambia un pedido en curso.
     """
-    t = _norm(text)
-
-    # atajo: "quiero 12 hamburguesas"
-    m = re.search(r"\b(quiero|dame|mandame|mandáme)?\s*(\d+|[a-záéíóúüñ]+)\s+([a-záéíóúüñ\s]+)\b", t)
-    # pero esto puede capturar basura; lo usamos solo si hay número/palabra-número clara
-    items: List[Dict[str, Any]] = []
-
-    # patrón clásico: "2 hamb", "1 coca", separados por y/+/, etc.
-    parts = re.split(r"\s*(?:,| y |\+|\/)\s*", t)
-    for p in parts:
-        p = _norm(p)
-        mm = re.match(r"^(?:(?:quiero|dame|mandame|mandáme)\s+)?(\d+|[a-záéíóúüñ]+)\s+(.+)$", p)
-        if not mm:
-            continue
-        qty = _parse_qty_token(mm.group(1))
-        if qty is None:
-            continue
-        name = _clean_item_name(mm.group(2))
-        if not name:
-            continue
-        items.append({"name": name, "qty": qty})
-
-    # si no detectó por parts, probamos captura simple "doce hamburguesas"
-    if not items and m:
-        qty = _parse_qty_token(m.group(2))
-        if qty is not None:
-            name = _clean_item_name(m.group(3))
-            if name:
-                items.append({"name": name, "qty": qty})
-
-    return items
-
-
-def _parse_delivery(text: str) -> str | None:
-    t = _norm(text)
-    if any(x in t for x in ["envio", "envío", "enviar", "delivery", "mandalo", "mandalo a casa", "a domicilio"]):
-        return "envio"
-    if any(x in t for x in ["retiro", "retira", "paso a buscar", "lo busco", "buscar", "retiro en local"]):
-        return "retiro"
-    return None
-
-
-def _parse_payment(text: str) -> str | None:
-    t = _norm(text)
-    if "efectivo" in t:
-        return "efectivo"
-    if any(x in t for x in ["transfer", "transferencia", "tranfer", "trasnfer", "alias", "cbu", "mercadopago", "mp"]):
-        return "transferencia"
-    return None
-
-
-def _parse_yes_no(text: str) -> bool | None:
-    t = _norm(text)
-    if t in ("si", "sí", "s", "dale", "ok", "oka", "confirmo", "confirmar", "confirmo si"):
-        return True
-    if t in ("no", "n", "cancelar", "cancelo"):
-        return False
-    return None
+    return [
+        {"id": item_id, "name": menu.matcher.items[item_id]["name"], "qty": qty, "price": menu.prices[item_id]}
+        for item_id, qty in menu.matcher.parse(text)
+    ]
 
 
 def _build_summary(data: Dict[str, Any]) -> str:
@@ -207,36 +84,24 @@ def _build_summary(data: Dict[str, Any]) -> str:
     return "\n".join(lines)
 
 
-# ====== TOTAL (simple, basado en nombres normalizados) ======
-_PRICE = {
-    "hamburguesa": 9000,            # por defecto "hamburguesa" -> simple
-    "hamburguesa simple": 9000,
-    "hamburguesa doble": 12000,
-    "papas": 5000,
-    "tallarines": 10000,
-    "empanadas de pollo": 1500,
-    "empanadas de carne": 1500,
-    "coca": 2000,
-}
-
-def _calc_total(data: Dict[str, Any]) -> int:
+# ====== TOTAL (precio guardado en el ítem, o por id del menú) ======
+def _calc_total(data: Dict[str, Any], menu: MenuSnapshot) -> int:
     total = 0
     for it in (data.get("items") or []):
-        name = _clean_item_name(str(it.get("name", "")))
         qty = int(it.get("qty") or 0)
-        price = _PRICE.get(name)
-        if price is None:
-            # fallback: si viene "hamburguesas" etc
-            if "doble" in name and "hamb" in name:
-                price = _PRICE["hamburguesa doble"]
-            elif "hamb" in name:
-                price = _PRICE["hamburguesa"]
-            else:
-                price = 0
-        total += price * qty
+        if type(it.get("price")) is int:
+            # precio del momento en que se cargó el ítem
+            total += it["price"] * qty
+            continue
+        item_id = it.get("id")
+        if not item_id:
+            # ítems viejos / de la IA sin id: los resolvemos por nombre
+            item = menu.matcher.match_name(str(it.get("name", "")))
+            item_id = item["id"] if item else None
+        total += menu.prices.get(item_id, 0) * qty
 
     if data.get("delivery_method") == "envio":
-        total += DELIVERY_FEE
+        total += menu.delivery_fee
     return total
 
 
@@ -247,117 +112,352 @@ except Exception:
     write_order = None
 
 
+# ====== Mensaje normalizado ======
+class Msg:
+    """
+    Un mensaje entrante, normalizado una vez. `intents` se llena con una sola
+    pasada del clasificador, y solo si el estado actual declara que las usa
+    (ver STATE_TABLE).
+    """
+
+    __slots__ = ("raw", "text", "intents", "extracted", "rest")
+
+    def __init__(self, raw: str, extracted: Dict[str, Any] | None = None):
+        self.raw = raw or ""
+        self.text = _norm(self.raw)
+        self.intents: Dict[str, Any] = {}
+        # resultado de la IA ya resuelto afuera (camino async); None = llamarla acá si hace falta
+        self.extracted = extracted
+        # líneas de una ráfaga que el handler no usó: van al estado siguiente (ver _step)
+        self.rest: List[str] = []
+
+    def parse(self, names: Tuple[str, ...]) -> "Msg":
+        if names and not self.intents:
+            self.intents = classify(self.text)
+        return self
+
+    def lines(self) -> List[str]:
+        """
+        Líneas no vacías del texto crudo. Una ráfaga unida por coalesce.py
+        trae un mensaje por línea; `text` ya las juntó en una sola.
+        """
+        return [ln.strip() for ln in self.raw.split("\n") if ln.strip()]
+
+    def __getitem__(self, name: str) -> Any:
+        return self.intents[name]
+
+    def find_line(self, name: str) -> Tuple[int, Any]:
+        """
+        (índice, valor) de la primera línea de la ráfaga con el intent `name`;
+        (-1, None) si ninguna lo tiene sola.
+        """
+        for i, line in enumerate(self.lines()):
+            value = classify(_norm(line))[name]
+            if value:
+                return i, value
+        return -1, None
+
+
+# ====== Tabla de estados ======
+# handler(msg, data, phone, menu) -> (próximo estado, data, respuesta)
+Step = Tuple[ConversationState, Dict[str, Any], str]
+Handler = Callable[[Msg, Dict[str, Any], str, MenuSnapshot], Step]
+
+
+class _Rule(NamedTuple):
+    handler: Handler
+    intents: Tuple[str, ...]
+
+
+STATE_TABLE: Dict[ConversationState, _Rule] = {}
+
+
+def on_state(state: ConversationState, intents: Tuple[str, ...] = ()):
+    """
+    Registra el handler de un estado y los parsers de intención que usa.
+    Agregar un estado = agregar una función decorada, sin tocar _step.
+    """
+    for name in intents:
+        if name not in INTENT_NAMES:
+            raise ValueError(f"intent desconocido: {name}")
+
+    def deco(fn: Handler) -> Handler:
+        STATE_TABLE[state] = _Rule(fn, tuple(intents))
+        return fn
+
+    return deco
+
+
 def handle_message(
     state: str | None,
     text: str,
-    data: Dict[str, Any] | None
+    data: Dict[str, Any] | None,
+    phone: str | None = None,
+    extracted: Dict[str, Any] | None = None,
 ) -> Tuple[str, Dict[str, Any], str]:
     """
     IMPORTANTE:
     - Debe devolver EXACTAMENTE 3 cosas (state, data, reply_text)
     - state es string (ConversationState.value)
+    - phone (opcional) se usa para registrar la orden confirmada
+    - extracted (opcional): resultado de la IA ya calculado por quien llama
+      (ver needs_extraction); así el núcleo no bloquea esperando al modelo
     """
     if data is None:
         data = {}
 
-    state_enum = ConversationState(state) if state in ConversationState._value2member_map_ else ConversationState.NEW
-    next_state, new_data, reply = _step(state_enum, text, data)
+    state_enum = _coerce_state(state)
+    msg = Msg(text, extracted)
+    started = time.perf_counter()
+    next_state, new_data, reply = _step(state_enum, msg, data, phone or data.get("phone") or "unknown", get_menu())
+    STEP_SECONDS.observe(time.perf_counter() - started, state_enum.value)
 
     # garantizamos salida
     return (next_state.value, new_data, reply)
 
 
+def _coerce_state(state: str | None) -> ConversationState:
+    # estados sin handler (ej: GREETING, que el bot no usa) arrancan como NEW
+    st = ConversationState._value2member_map_.get(state) if state else None
+    return st if st in STATE_TABLE else ConversationState.NEW
+
+
+def needs_extraction(state: str | None, text: str) -> bool:
+    """
+    True si handle_message(state, text, ...) va a terminar consultando a la IA:
+    AWAITING_ORDER (o una ráfaga que arranca un pedido en NEW/DONE), hay algo
+    además del saludo/menú y el parser del menú no encontró ítems.
+    El camino async la usa para resolver la extracción afuera y pasarla en `extracted`.
+    """
+    if not (AI_ENABLED and ai_extract):
+        return False
+    st = _coerce_state(state)
+    msg = Msg(text).parse(STATE_TABLE[ConversationState.AWAITING_ORDER].intents)
+    if st != ConversationState.AWAITING_ORDER:
+        starts = st == ConversationState.NEW or (st == ConversationState.DONE and msg["greeting"])
+        if not (starts and len(msg.lines()) > 1):
+            return False
+    menu = get_menu()
+    order = _order_part(msg, menu)
+    return order is not None and not _parse_items(order.text, menu)
+
+
 def _step(
     state: ConversationState,
-    text: str,
-    data: Dict[str, Any]
-) -> Tuple[ConversationState, Dict[str, Any], str]:
-    t = _norm(text)
-
-    # -------- NEW ----------
-    if state == ConversationState.NEW:
-        return (ConversationState.AWAITING_ORDER, {}, _menu_intro_text())
-
-    # -------- AWAITING_ORDER ----------
-    if state == ConversationState.AWAITING_ORDER:
-        # 1) Menú
-        if _is_greeting(t) or _looks_like_menu_request(t):
-            return (ConversationState.AWAITING_ORDER, data, _menu_intro_text() if _is_greeting(t) else _menu_intro_text().split("\n", 2)[1])
-
-        # 2) Regex items
-        items = _parse_items_regex(t)
-        if items:
-            data["items"] = items
-            return (ConversationState.ASK_DELIVERY, data, "Genial 👍 ¿Es para retiro o envío?")
-
-        # 3) Fallback IA (si está)
-        if llama_extract:
-            try:
-                ai = llama_extract(text)  # tu llama_client puede armar prompt/JSON
-                if isinstance(ai, dict) and ai.get("ok") is True:
-                    ai_items = ai.get("items")
-                    if ai_items:
-                        normalized = []
-                        for it in ai_items:
-                            name = _clean_item_name(str(it.get("name", "")))
-                            qty = it.get("qty", None)
-                            if qty is None:
-                                qty = 1
-                            try:
-                                qty = int(qty)
-                            except Exception:
-                                qty = 1
-                            if name:
-                                normalized.append({"name": name, "qty": qty})
-                        if normalized:
-                            data["items"] = normalized
-                            return (ConversationState.ASK_DELIVERY, data, "Genial 👍 ¿Es para retiro o envío?")
-
-                    # si IA detectó datos sueltos, los guardamos pero NO avanzamos de estado
-                    for k in ["delivery_method", "address", "payment_method", "name"]:
-                        if ai.get(k):
-                            data[k] = ai[k]
-                    return (ConversationState.AWAITING_ORDER, data, "Dale 🙂 decime tu pedido con cantidades (ej: 2 hamburguesas y 1 coca).")
-            except Exception:
-                pass
-
-        return (ConversationState.AWAITING_ORDER, data, "No entendí 😕 Decime tu pedido con cantidades (ej: *2 hamburguesas y 1 coca*).")
-
-    # -------- ASK_DELIVERY ----------
-    if state == ConversationState.ASK_DELIVERY:
-        dm = _parse_delivery(t)
-        if dm:
-            data["delivery_method"] = dm
-            if dm == "envio":
-                return (ConversationState.ASK_ADDRESS, data, "Pasame tu dirección completa")
-            return (ConversationState.ASK_PAYMENT, data, "¿Pagás en efectivo o transferencia?")
-        return (ConversationState.ASK_DELIVERY, data, "Decime si es retiro o envío")
-
-    # -------- ASK_ADDRESS ----------
-    if state == ConversationState.ASK_ADDRESS:
-        # guardamos tal cual (si el cliente bardea, lo guarda… eso después lo filtramos)
-        data["address"] = text.strip()
+    msg: Msg,
+    data: Dict[str, Any],
+    phone: str,
+    menu: MenuSnapshot,
+) -> Step:
+    rule = STATE_TABLE.get(state)
+    if rule is None:
+        return (ConversationState.AWAITING_ORDER, data, menu.intro_text)
+    step = rule.handler(msg.parse(rule.intents), data, phone, menu)
+    # ráfaga que contesta más de una pregunta ("efectivo\nJuan" en ASK_PAYMENT):
+    # lo que el handler no usó sigue en el estado al que pasó; vale la última respuesta
+    while msg.rest:
+        rule = STATE_TABLE.get(step[0])
+        if rule is None:
+            break
+        msg = Msg("\n".join(msg.rest))
+        step = rule.handler(msg.parse(rule.intents), step[1], phone, menu)
+    return step
+
+
+# -------- NEW ----------
+@on_state(ConversationState.NEW)
+def _on_new(msg: Msg, data: Dict[str, Any], phone: str, menu: MenuSnapshot) -> Step:
+    if len(msg.lines()) > 1:
+        return _start_order(msg, phone, menu)
+    return (ConversationState.AWAITING_ORDER, {}, menu.intro_text)
+
+
+def _start_order(msg: Msg, phone: str, menu: MenuSnapshot) -> Step:
+    """
+    Ráfaga que abre una conversación ("hola\n2 hamburguesas"): el pedido que
+    venga adentro se toma como en AWAITING_ORDER; si no hay pedido, la bienvenida.
+    """
+    msg.parse(STATE_TABLE[ConversationState.AWAITING_ORDER].intents)
+    next_state, data, reply = _on_awaiting_order(msg, {}, phone, menu)
+    if next_state == ConversationState.AWAITING_ORDER:
+        return (next_state, data, menu.intro_text)
+    return (next_state, data, reply)
+
+
+# -------- AWAITING_ORDER ----------
+def _order_part(msg: Msg, menu: MenuSnapshot) -> Msg | None:
+    """
+    Lo que hay que leer como pedido; None si es solo saludo/menú. En una
+    ráfaga se sacan las líneas de saludo/menú sin ítems y se lee el resto:
+    "hola\nquiero 2 hamburguesas" es un pedido, no un pedido de menú.
+    """
+    lines = msg.lines()
+    if len(lines) < 2:
+        return None if msg["greeting"] or msg["menu"] else msg
+    keep = []
+    for line in lines:
+        t = _norm(line)
+        found = classify(t)
+        if (found["greeting"] or found["menu"]) and not menu.matcher.parse(t):
+            continue
+        keep.append(line)
+    if not keep:
+        return None
+    if len(keep) == len(lines):
+        return msg
+    return Msg("\n".join(keep), msg.extracted).parse(STATE_TABLE[ConversationState.AWAITING_ORDER].intents)
+
+
+def _after_items(msg: Msg, data: Dict[str, Any]) -> Step:
+    """
+    Pedido cargado. Si el mismo texto ya dice envío/retiro (ej: ráfaga unida
+    por coalesce.py: "2 hamburguesas\ny una coca\npara envio") no se pregunta.
+    El pago no se toma de acá: "mp" aparece adentro de "empanadas".
+    """
+    dm = msg["delivery"]
+    if not dm:
+        return (ConversationState.ASK_DELIVERY, data, "Genial 👍 ¿Es para retiro o envío?")
+    data["delivery_method"] = dm
+    if dm == "envio":
+        return (ConversationState.ASK_ADDRESS, data, "Genial 👍 Pasame tu dirección completa")
+    return (ConversationState.ASK_PAYMENT, data, "Genial 👍 ¿Pagás en efectivo o transferencia?")
+
+
+@on_state(ConversationState.AWAITING_ORDER, intents=("greeting", "menu", "delivery"))
+def _on_awaiting_order(msg: Msg, data: Dict[str, Any], phone: str, menu: MenuSnapshot) -> Step:
+    # 1) Menú
+    order = _order_part(msg, menu)
+    if order is None:
+        return (ConversationState.AWAITING_ORDER, data, menu.intro_text if msg["greeting"] else menu.menu_reply)
+
+    # 2) Regex items
+    items = _parse_items(order.text, menu)
+    if items:
+        ORDER_PARSE.inc("regex")
+        data["items"] = items
+        return _after_items(order, data)
+
+    # 3) Fallback IA (si está)
+    if ai_extract or msg.extracted is not None:
+        try:
+            ai = msg.extracted if msg.extracted is not None else ai_extract(msg.raw)
+            if isinstance(ai, dict) and ai.get("ok") is True:
+                normalized = _ai_items(ai.get("items"), menu)
+                if normalized:
+                    ORDER_PARSE.inc("llm")
+                    data["items"] = normalized
+                    return _after_items(order, data)
+
+                # si IA detectó datos sueltos, los guardamos pero NO avanzamos de estado
+                for k in ["delivery_method", "address", "payment_method", "name"]:
+                    if ai.get(k):
+                        data[k] = ai[k]
+                ORDER_PARSE.inc("none")
+                return (ConversationState.AWAITING_ORDER, data, "Dale 🙂 decime tu pedido con cantidades (ej: 2 hamburguesas y 1 coca).")
+        except Exception:
+            pass
+
+    ORDER_PARSE.inc("none")
+    return (ConversationState.AWAITING_ORDER, data, "No entendí 😕 Decime tu pedido con cantidades (ej: *2 hamburguesas y 1 coca*).")
+
+
+def _ai_items(ai_items: Any, menu: MenuSnapshot) -> List[Dict[str, Any]]:
+    """
+    Items que devolvió la IA -> mismos dicts que _parse_items (id cuando está en el menú).
+    """
+    normalized = []
+    for it in ai_items or []:
+        raw_name = str(it.get("name", ""))
+        item = menu.matcher.match_name(raw_name)
+        name = item["name"] if item else _clean_item_name(raw_name, menu)
+        qty = it.get("qty", None)
+        if qty is None:
+            qty = 1
+        try:
+            qty = int(qty)
+        except Exception:
+            qty = 1
+        if name:
+            entry = {"name": name, "qty": qty}
+            if item:
+                entry["id"] = item["id"]
+                entry["price"] = menu.prices[item["id"]]
+            normalized.append(entry)
+    return normalized
+
+
+# -------- ASK_DELIVERY ----------
+@on_state(ConversationState.ASK_DELIVERY, intents=("delivery",))
+def _on_ask_delivery(msg: Msg, data: Dict[str, Any], phone: str, menu: MenuSnapshot) -> Step:
+    dm = msg["delivery"]
+    if dm and len(msg.lines()) > 1:
+        # "envio\ncalle 123": la dirección sigue en ASK_ADDRESS
+        i, line_dm = msg.find_line("delivery")
+        if i >= 0:
+            dm, msg.rest = line_dm, msg.lines()[i + 1:]
+    if dm:
+        data["delivery_method"] = dm
+        if dm == "envio":
+            return (ConversationState.ASK_ADDRESS, data, "Pasame tu dirección completa")
         return (ConversationState.ASK_PAYMENT, data, "¿Pagás en efectivo o transferencia?")
+    return (ConversationState.ASK_DELIVERY, data, "Decime si es retiro o envío")
+
+
+# -------- ASK_ADDRESS ----------
+@on_state(ConversationState.ASK_ADDRESS)
+def _on_ask_address(msg: Msg, data: Dict[str, Any], phone: str, menu: MenuSnapshot) -> Step:
+    # guardamos tal cual (si el cliente bardea, lo guarda… eso después lo filtramos)
+    data["address"] = msg.raw.strip()
+    lines = msg.lines()
+    for i in range(1, len(lines)):
+        # ráfaga "calle 123\nefectivo": el pago va a ASK_PAYMENT. Una línea con
+        # números es dirección aunque tenga "mp" adentro ("Campana 450")
+        if classify(_norm(lines[i]))["payment"] and not any(ch.isdigit() for ch in lines[i]):
+            data["address"] = "\n".join(lines[:i])
+            msg.rest = lines[i:]
+            break
+    return (ConversationState.ASK_PAYMENT, data, "¿Pagás en efectivo o transferencia?")
+
+
+# -------- ASK_PAYMENT ----------
+@on_state(ConversationState.ASK_PAYMENT, intents=("payment",))
+def _on_ask_payment(msg: Msg, data: Dict[str, Any], phone: str, menu: MenuSnapshot) -> Step:
+    pm = msg["payment"]
+    if pm and len(msg.lines()) > 1:
+        # "efectivo\nJuan": el nombre sigue en ASK_NAME
+        i, line_pm = msg.find_line("payment")
+        if i >= 0:
+            pm, msg.rest = line_pm, msg.lines()[i + 1:]
+    if pm:
+        data["payment_method"] = pm
+        return (ConversationState.ASK_NAME, data, "¿A nombre de quién preparo el pedido?")
+    return (ConversationState.ASK_PAYMENT, data, "Efectivo o transferencia?")
+
+
+# -------- ASK_NAME ----------
+_SOY = re.compile(r"^\s*soy\s+", re.IGNORECASE)
+
 
-    # -------- ASK_PAYMENT ----------
-    if state == ConversationState.ASK_PAYMENT:
-        pm = _parse_payment(t)
-        if pm:
-            data["payment_method"] = pm
-            return (ConversationState.ASK_NAME, data, "¿A nombre de quién preparo el pedido?")
-        return (ConversationState.ASK_PAYMENT, data, "Efectivo o transferencia?")
+@on_state(ConversationState.ASK_NAME, intents=("payment", "delivery"))
+def _on_ask_name(msg: Msg, data: Dict[str, Any], phone: str, menu: MenuSnapshot) -> Step:
+    # ráfaga que arranca con el pago/envío atrasado ("efectivo\nJuan"): el guard
+    # rail toma la primera línea y el resto sigue en el estado que corresponda
+    lines = msg.lines()
+    if len(lines) > 1:
+        first = classify(_norm(lines[0]))
+        if first["payment"] or first["delivery"]:
+            msg.intents = first
+            msg.rest = lines[1:]
 
-    # -------- ASK_NAME ----------
-    if state == ConversationState.ASK_NAME:
     # Guard rail: si el usuario manda "transferencia/efectivo" acá,
     # es que todavía estaba respondiendo el pago.
-    pm = _parse_payment(t)
+    pm = msg["payment"]
     if pm:
         data["payment_method"] = pm
         return (ConversationState.ASK_NAME, data, "Perfecto 👍 ¿A nombre de quién preparo el pedido?")
 
     # Otro guard rail: si te responde "envio/retiro" acá, es delivery atrasado
-    dm = _parse_delivery(t)
+    dm = msg["delivery"]
     if dm:
         data["delivery_method"] = dm
         if dm == "envio":
@@ -365,38 +465,48 @@ def _step(
         return (ConversationState.ASK_PAYMENT, data, "Buenísimo 🙂 ¿Pagás en efectivo o transferencia?")
 
     # Nombre normal
-    name = re.sub(r"^\s*soy\s+", "", text.strip(), flags=re.IGNORECASE).strip()
-    data["name"] = name if name else text.strip()
+    text = msg.raw.strip()
+    name = _SOY.sub("", text).strip()
+    data["name"] = name if name else text
     return (ConversationState.ASK_CONFIRM, data, _build_summary(data))
 
 
-    # -------- ASK_CONFIRM ----------
-    if state == ConversationState.ASK_CONFIRM:
-        yn = _parse_yes_no(t)
-        if yn is None:
-            return (ConversationState.ASK_CONFIRM, data, "Respondé si o no")
-        if yn is False:
-            return (ConversationState.DONE, {}, "Listo 👍 Si querés hacer otro pedido escribí *hola* 🙂")
-
-        # Confirmado
-        total = _calc_total(data)
-        data["total"] = total
-
-        # escribir orden si existe el writer
-        if write_order:
-            try:
-                write_order(phone=data.get("phone", "unknown"), data=data)
-            except Exception:
-                # no rompemos el bot por fallo de escritura
-                pass
-
-        # mensaje final con total
-        return (ConversationState.DONE, data, f"Pedido confirmado ✅ Total: ${total}. En breve te confirmo el tiempo de entrega.")
-
-    # -------- DONE ----------
-    if state == ConversationState.DONE:
-        if _is_greeting(t):
-            return (ConversationState.AWAITING_ORDER, {}, _menu_intro_text())
-        return (ConversationState.DONE, data, "Si querés hacer otro pedido escribí *hola* 🙂")
-
-    return (ConversationState.AWAITING_ORDER, data, _menu_intro_text())
+# -------- ASK_CONFIRM ----------
+@on_state(ConversationState.ASK_CONFIRM, intents=("yes_no",))
+def _on_ask_confirm(msg: Msg, data: Dict[str, Any], phone: str, menu: MenuSnapshot) -> Step:
+    yn = msg["yes_no"]
+    if yn is None and len(msg.lines()) > 1:
+        # ráfaga ("si\ndale"): vale la última línea que sea un si/no
+        for line in reversed(msg.lines()):
+            yn = classify(_norm(line))["yes_no"]
+            if yn is not None:
+                break
+    if yn is None:
+        return (ConversationState.ASK_CONFIRM, data, "Respondé si o no")
+    if yn is False:
+        return (ConversationState.DONE, {}, "Listo 👍 Si querés hacer otro pedido escribí *hola* 🙂")
+
+    # Confirmado
+    total = _calc_total(data, menu)
+    data["total"] = total
+
+    # registrar orden si existe el writer (se encola, no bloquea)
+    if write_order:
+        try:
+            write_order(phone=phone, data=data)
+        except Exception:
+            # no rompemos el bot por fallo de escritura
+            pass
+
+    # mensaje final con total
+    return (ConversationState.DONE, data, f"Pedido confirmado ✅ Total: ${total}. En breve te confirmo el tiempo de entrega.")
+
+
+# -------- DONE ----------
+@on_state(ConversationState.DONE, intents=("greeting",))
+def _on_done(msg: Msg, data: Dict[str, Any], phone: str, menu: MenuSnapshot) -> Step:
+    if msg["greeting"]:
+        if len(msg.lines()) > 1:
+            return _start_order(msg, phone, menu)
+        return (ConversationState.AWAITING_ORDER, {}, menu.intro_text)
+    return (ConversationState.DONE, data, "Si querés hacer otro pedido escribí *hola* 🙂")
@@ -0,0 +1,38 @@
+# app/services/stats.py
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Dict, Iterable
+
+
+class LatencyWindow:
+    """
+    Ventana circular con las últimas N latencias (en segundos).
+    Sirve para sacar percentiles baratos sin que la memoria crezca con el tráfico.
+    """
+
+    def __init__(self, size: int = 2048):
+        self._samples: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def percentiles(self, ps: Iterable[int] = (50, 90, 99)) -> Dict[str, float]:
+        """
+        Devuelve {"p50": ms, "p90": ms, ...}. Con la ventana vacía devuelve 0.0.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        out: Dict[str, float] = {}
+        for p in ps:
+            if not samples:
+                out[f"p{p}"] = 0.0
+                continue
+            idx = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+            out[f"p{p}"] = round(samples[idx] * 1000.0, 2)
+        return out
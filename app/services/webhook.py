@@ -0,0 +1,91 @@
+# app/services/webhook.py
+from __future__ import annotations
+
+import os
+import re
+from typing import Any, Dict, Iterator, Tuple
+
+from app.services.metrics import counter
+
+# Recorrido del payload de WhatsApp Cloud API, compartido por el server
+# Flask (main.py) y el ASGI (asgi.py). El dedupe lo aplica cada uno, porque
+# en asyncio el backend sqlite se consulta fuera del event loop.
+
+# La mayoría de los POST de Meta son solo `statuses` (sent/delivered/read de
+# nuestras respuestas) o mensajes que no atendemos (audio, imagen, sticker).
+# Con el fast path se reconocen en los bytes crudos y se contesta 200 sin
+# decodificar el JSON ni tocar dedupe/sesiones. WEBHOOK_FASTPATH=0: como antes.
+WEBHOOK_FASTPATH = os.getenv("WEBHOOK_FASTPATH", "1").strip() == "1"
+# contar los statuses por tipo en vendobot_whatsapp_statuses (un regex más por entrega)
+WEBHOOK_STATUS_COUNTS = os.getenv("WEBHOOK_STATUS_COUNTS", "0").strip() == "1"
+
+# kind = text | nontext | status | other
+WEBHOOK_DELIVERIES = counter("vendobot_webhook_deliveries", "Entregas del webhook por tipo", ("kind",))
+WHATSAPP_STATUSES = counter("vendobot_whatsapp_statuses", "Statuses de mensajes enviados", ("status",))
+
+# como clave: el valor "messages" de "field" está en todas las entregas
+_MESSAGES = re.compile(rb'"messages"\s*:')
+_STATUSES = b'"statuses"'
+_TEXT_TYPE = re.compile(rb'"type"\s*:\s*"text"')
+_STATUS = re.compile(rb'"status"\s*:\s*"([a-z_]+)"')
+# cardinalidad acotada: lo que no está acá cuenta como "other"
+_KNOWN_STATUSES = {b"sent", b"delivered", b"read", b"failed", b"deleted"}
+
+
+def classify(body: bytes) -> str:
+    """
+    Tipo de entrega mirando los bytes, sin parsear:
+    - "text": trae algún mensaje de texto (hay que parsear y despachar)
+    - "nontext": trae mensajes pero ninguno de texto
+    - "status": sin mensajes, con statuses
+    - "other": nada de eso (vacío, JSON roto, otro field)
+    Un falso "text" (la clave dentro del cuerpo de un mensaje) solo cuesta el
+    parseo completo. Al revés haría falta que Meta escape las claves (\\u0022),
+    y no lo hace.
+    """
+    if _MESSAGES.search(body):
+        return "text" if _TEXT_TYPE.search(body) else "nontext"
+    return "status" if _STATUSES in body else "other"
+
+
+def fast_ack(body: bytes) -> bool:
+    """
+    True si la entrega se puede contestar sin parsear (no trae texto).
+    Cuenta la entrega y, con WEBHOOK_STATUS_COUNTS=1, sus statuses.
+    """
+    kind = classify(body)
+    WEBHOOK_DELIVERIES.inc(kind)
+    if WEBHOOK_STATUS_COUNTS and _STATUSES in body:
+        for status in _STATUS.findall(body):
+            WHATSAPP_STATUSES.inc(status.decode() if status in _KNOWN_STATUSES else "other")
+    return kind != "text"
+
+
+def iter_messages(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Cada mensaje de entry/changes/value.messages, en orden de llegada.
+    """
+    for e in payload.get("entry", []):
+        for ch in e.get("changes", []):
+            value = ch.get("value", {})
+            for msg in value.get("messages", []) or []:
+                yield msg
+
+
+def text_message(msg: Dict[str, Any]) -> Tuple[str, str] | None:
+    """
+    (from_phone, text) si es un mensaje de texto con contenido; si no, None.
+    """
+    from_phone = msg.get("from")  # numero del cliente (string)
+
+    # Solo soportamos texto por ahora (si no es texto, lo ignoramos)
+    if msg.get("type", "") != "text":
+        return None
+
+    text = (msg.get("text", {}) or {}).get("body", "")
+    text = (text or "").strip()
+
+    # Si llega vacío, no hagas nada (evita "No entendí" fantasma)
+    if not from_phone or not text:
+        return None
+    return from_phone, text
@@ -0,0 +1,262 @@
+# app/services/whatsapp_client.py
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from app.services.metrics import counter, histogram
+from app.services.stats import LatencyWindow
+
+GRAPH_BASE_URL = os.getenv("GRAPH_BASE_URL", "https://graph.facebook.com").rstrip("/")
+GRAPH_API_VERSION = os.getenv("GRAPH_API_VERSION", "v19.0").strip()
+WHATSAPP_TIMEOUT = float(os.getenv("WHATSAPP_TIMEOUT", "15"))
+WHATSAPP_MAX_RETRIES = int(os.getenv("WHATSAPP_MAX_RETRIES", "3"))
+WHATSAPP_BACKOFF_BASE = float(os.getenv("WHATSAPP_BACKOFF_BASE", "0.5"))
+WHATSAPP_BACKOFF_MAX = float(os.getenv("WHATSAPP_BACKOFF_MAX", "8"))
+# máximo de envíos simultáneos por PHONE_NUMBER_ID (Meta limita por número emisor)
+WHATSAPP_MAX_INFLIGHT = int(os.getenv("WHATSAPP_MAX_INFLIGHT", "16"))
+WHATSAPP_POOL_SIZE = int(os.getenv("WHATSAPP_POOL_SIZE", "32"))
+# cuánto del cuerpo de un error de Graph API se guarda (un 502 puede traer una página HTML entera)
+WHATSAPP_ERROR_MAX = int(os.getenv("WHATSAPP_ERROR_MAX", "300"))
+
+# se reintenta solo lo que Graph seguro no procesó: estos status y los errores
+# de conexión. Un timeout de lectura (o un corte después de mandar) NO: Graph
+# pudo haber aceptado el mensaje y un reintento lo duplicaría.
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# compartidas con el cliente async (aio.py); status = código HTTP final o "error" (red)
+SEND_SECONDS = histogram("vendobot_whatsapp_send_seconds", "Latencia de envío a Graph API (con reintentos)")
+SENDS = counter("vendobot_whatsapp_sends", "Envíos a Graph API por status final", ("status",))
+
+
+def backoff_delay(attempt: int, retry_after: str | None) -> float:
+    if retry_after:
+        try:
+            return min(WHATSAPP_BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    # "full jitter": uniforme entre 0 y el techo exponencial
+    cap = min(WHATSAPP_BACKOFF_MAX, WHATSAPP_BACKOFF_BASE * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+def text_payload(to_phone: str, text: str, idem_key: str = "") -> Dict[str, Any]:
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": to_phone,
+        "type": "text",
+        "text": {"body": text},
+    }
+    if idem_key:
+        # Graph lo devuelve en los webhooks de status: correlaciona reenvíos del outbox
+        payload["biz_opaque_callback_data"] = idem_key
+    return payload
+
+
+def _never_connected(e: requests.ConnectionError) -> bool:
+    """
+    True si el error es de antes de conectar (ConnectTimeout, o un
+    NewConnectionError en la cadena: DNS, conexión rechazada).
+    """
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    seen = set()
+    todo: List[Any] = [e]
+    while todo:
+        err = todo.pop()
+        if err is None or id(err) in seen:
+            continue
+        seen.add(id(err))
+        if isinstance(err, NewConnectionError):
+            return True
+        # requests -> MaxRetryError.reason -> NewConnectionError
+        todo.extend(a for a in getattr(err, "args", ()) if isinstance(a, BaseException))
+        todo.extend((getattr(err, "reason", None), getattr(err, "__cause__", None), getattr(err, "__context__", None)))
+    return False
+
+
+class WhatsAppClient:
+    """
+    Cliente compartido para WhatsApp Cloud API.
+
+    - requests.Session con pool de conexiones keep-alive (no hay handshake TCP+TLS por mensaje)
+    - reintentos con backoff exponencial + jitter en 429/5xx y errores de conexión
+    - tope de envíos en vuelo por phone_number_id
+    - percentiles de latencia por envío
+    """
+
+    def __init__(
+        self,
+        token: str,
+        phone_number_id: str,
+        base_url: str = GRAPH_BASE_URL,
+        api_version: str = GRAPH_API_VERSION,
+        timeout: float = WHATSAPP_TIMEOUT,
+        max_retries: int = WHATSAPP_MAX_RETRIES,
+        max_inflight: int = WHATSAPP_MAX_INFLIGHT,
+        pool_size: int = WHATSAPP_POOL_SIZE,
+    ):
+        self.token = token
+        self.phone_number_id = phone_number_id
+        self.base_url = base_url.rstrip("/")
+        self.api_version = api_version
+        self.timeout = timeout
+        self.max_retries = max(0, int(max_retries))
+        self.max_inflight = max(1, int(max_inflight))
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, int(pool_size)), max_retries=0)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        })
+
+        self._inflight: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+        self.latency = LatencyWindow()
+        self.status_counts: Dict[str, int] = {}
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.token and self.phone_number_id)
+
+    def _semaphore(self, phone_number_id: str) -> threading.BoundedSemaphore:
+        sem = self._inflight.get(phone_number_id)
+        if sem is None:
+            with self._lock:
+                sem = self._inflight.setdefault(
+                    phone_number_id, threading.BoundedSemaphore(self.max_inflight)
+                )
+        return sem
+
+    def _count(self, status: str, ok: bool, retried: int, elapsed: float) -> None:
+        self.latency.add(elapsed)
+        SEND_SECONDS.observe(elapsed)
+        SENDS.inc(status)
+        with self._lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            self.retries += retried
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+
+    def send_text(
+        self, to_phone: str, text: str, phone_number_id: str | None = None, idem_key: str = ""
+    ) -> Dict[str, Any]:
+        """
+        Envía un texto. Devuelve {"ok": bool, "status": int|None, "attempts": int, ...};
+        si falla, "retryable" dice si reintentarlo más tarde no puede duplicarlo.
+        Nunca levanta excepción.
+        """
+        pnid = phone_number_id or self.phone_number_id
+        url = f"{self.base_url}/{self.api_version}/{pnid}/messages"
+        payload = text_payload(to_phone, text, idem_key)
+
+        sem = self._semaphore(pnid)
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            status = None
+            error = ""
+            retry_after = None
+            with sem:
+                try:
+                    r = self._session.post(url, json=payload, timeout=self.timeout)
+                    status = r.status_code
+                    if status < 400:
+                        self._count(str(status), True, attempt, time.perf_counter() - started)
+                        return {"ok": True, "status": status, "attempts": attempt + 1}
+                    error = r.text[:WHATSAPP_ERROR_MAX]
+                    retry_after = r.headers.get("Retry-After")
+                    retryable = status in RETRY_STATUS
+                except requests.ConnectionError as e:
+                    # solo si la conexión nunca se hizo; "Connection aborted",
+                    # RemoteDisconnected y compañía pasan con el body ya mandado
+                    error = str(e)
+                    retryable = _never_connected(e)
+                except requests.RequestException as e:
+                    # ReadTimeout y compañía: el mensaje pudo haber salido
+                    error = str(e)
+                    retryable = False
+
+            if not retryable or attempt >= self.max_retries:
+                self._count(str(status) if status else "error", False, attempt, time.perf_counter() - started)
+                return {"ok": False, "status": status, "attempts": attempt + 1, "error": error, "retryable": retryable}
+
+            time.sleep(backoff_delay(attempt, retry_after))
+            attempt += 1
+
+    def send_many(self, messages: Iterable[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Envía varios (to_phone, text) en paralelo respetando el tope en vuelo.
+        Devuelve los resultados en el mismo orden.
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_inflight, thread_name_prefix="wa-send"
+                    )
+        futures = [self._executor.submit(self.send_text, to, txt) for to, txt in messages]
+        return [f.result() for f in futures]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            status_counts = dict(self.status_counts)
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "status": status_counts,
+            "latency_ms": self.latency.percentiles(),
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._session.close()
+
+
+_client: WhatsAppClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> WhatsAppClient:
+    """
+    Cliente compartido del proceso (se crea la primera vez que se usa).
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = WhatsAppClient(
+                    token=os.getenv("WHATSAPP_TOKEN", ""),
+                    phone_number_id=os.getenv("PHONE_NUMBER_ID", ""),
+                )
+    return _client
+
+
+def close_client() -> None:
+    """
+    Espera envíos en vuelo y cierra el pool HTTP, si el cliente ya se creó.
+    """
+    c = _client
+    if c is not None:
+        c.close()
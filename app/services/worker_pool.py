@@ -0,0 +1,160 @@
+# app/services/worker_pool.py
+from __future__ import annotations
+
+import itertools
+import logging
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List
+
+from app.services.stats import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def shard_for(key: str, n: int) -> int:
+    """
+    Shard estable para una key (crc32, igual en todos los procesos, a diferencia de hash()).
+    """
+    return zlib.crc32((key or "").encode("utf-8")) % n
+
+
+class StripedLock:
+    """
+    N locks repartidos por key: dos keys iguales siempre comparten lock,
+    keys distintas casi nunca se pisan (sin un lock global que serialice todo).
+    """
+
+    def __init__(self, stripes: int = 256):
+        self._locks = [threading.RLock() for _ in range(max(1, int(stripes)))]
+
+    def get(self, key: str):
+        return self._locks[shard_for(key, len(self._locks))]
+
+
+class WorkerPool:
+    """
+    Pool acotado de threads, una cola FIFO por worker (shard).
+
+    - submit(job, key) manda todos los jobs de la misma key al mismo worker:
+      se procesan en orden de llegada, y keys distintas corren en paralelo.
+    - submit() no bloquea (o bloquea a lo sumo `timeout` seg): si la cola del shard
+      sigue llena devuelve False y el caller decide qué hacer (ej: contestar 503).
+    - stats() expone profundidad de cola y latencias (espera en cola y ejecución).
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], None],
+        workers: int = 4,
+        maxsize: int = 1000,
+        name: str = "worker",
+    ):
+        self._handler = handler
+        self._workers = max(1, int(workers))
+        per_shard = max(1, -(-int(maxsize) // self._workers))
+        self._queues: List[queue.Queue] = [
+            queue.Queue(maxsize=per_shard) for _ in range(self._workers)
+        ]
+        self._rr = itertools.count()
+        # stop() pedido: los workers salen cuando vacían su cola aunque el _STOP no haya entrado
+        self._stopping = threading.Event()
+        self._name = name
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._count_lock = threading.Lock()
+
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_latency = LatencyWindow()
+        self.run_latency = LatencyWindow()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self._workers):
+                th = threading.Thread(
+                    target=self._run, args=(self._queues[i],), name=f"{self._name}-{i}", daemon=True
+                )
+                th.start()
+                self._threads.append(th)
+
+    def submit(self, job: Any, key: str | None = None, timeout: float = 0.0) -> bool:
+        if key is None:
+            # sin key no hay orden que respetar: round-robin
+            idx = next(self._rr) % self._workers
+        else:
+            idx = shard_for(key, self._workers)
+        try:
+            self._queues[idx].put((time.perf_counter(), job), block=timeout > 0, timeout=timeout or None)
+        except queue.Full:
+            self._bump("rejected")
+            return False
+        self._bump("submitted")
+        return True
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Deja terminar lo que ya está encolado y frena los workers, sin pasarse de `timeout`
+        (una cola llena no bloquea el apagado).
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            threads, self._threads = self._threads, []
+        self._stopping.set()
+        if threads:
+            for q in self._queues:
+                try:
+                    q.put((time.perf_counter(), _STOP), timeout=max(0.001, deadline - time.monotonic()))
+                except queue.Full:
+                    logger.warning("pool queue full on stop", extra={"event": "pool.stop_full", "pool": self._name, "depth": q.qsize()})
+        for th in threads:
+            th.join(max(0.0, deadline - time.monotonic()))
+
+    def _run(self, q: queue.Queue) -> None:
+        while True:
+            enqueued_at, job = q.get()
+            try:
+                if job is _STOP:
+                    return
+                started = time.perf_counter()
+                self.wait_latency.add(started - enqueued_at)
+                try:
+                    self._handler(job)
+                    self._bump("processed")
+                except Exception:
+                    self._bump("failed")
+                    logger.exception("job exception", extra={"event": "pool.job_failed", "pool": self._name})
+                finally:
+                    self.run_latency.add(time.perf_counter() - started)
+            finally:
+                q.task_done()
+            if self._stopping.is_set() and q.empty():
+                return
+
+    def _bump(self, attr: str) -> None:
+        with self._count_lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self._workers,
+            "running": len(self._threads),
+            "queue_depth": sum(q.qsize() for q in self._queues),
+            "queue_max": sum(q.maxsize for q in self._queues),
+            "shard_depth": [q.qsize() for q in self._queues],
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_ms": self.wait_latency.percentiles(),
+            "run_ms": self.run_latency.percentiles(),
+        }
@@ -0,0 +1,215 @@
+# bench/bench_coalesce.py
+"""
+Ráfagas de mensajes del mismo cliente con y sin ventana de coalesce
+(COALESCE_MS), en tiempo real: cada cliente parte el pedido en varios
+mensajes seguidos ("2 hamburguesas", "y 1 coca", "para envio"), a veces
+precedido por algo que solo entiende la IA, y contesta cada pregunta un rato
+después. Graph -> bench/mock_graph.py, llama -> bench/fake_llama.py, SQLite en un tmp.
+
+Reporta pasos de conversación, requests a la IA, envíos a Graph, órdenes
+con los ítems completos y cuánto tarda la respuesta desde el último mensaje
+de cada ráfaga (p50/p99).
+
+    python -m bench.bench_coalesce --phones 200 --window-ms 400 --max-ms 1500
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+from bench import payloads as gen
+from bench.corpus import ORDER_PHRASES
+from bench.fake_llama import start_fake_llama
+from bench.mock_graph import start_mock_graph
+
+# conectores por los que la gente corta un pedido en varios mensajes
+_SPLIT = re.compile(r"\s*,\s*|\s+(?=y\s)|\s*[+/]\s*")
+_AI_ONLY = ["me tentaste con algo rico", "lo de siempre porfa"]
+
+# (t, phone, text, burst) con t relativo al arranque, burst = índice de la ráfaga
+Event = Tuple[float, str, str, int]
+
+
+def _configure(graph_url: str, llama_url: str, tmpdir: str, window_ms: int, max_ms: int) -> None:
+    # antes de importar app.*: los servicios leen la config al importarse
+    os.environ.update({
+        "DB_PATH": os.path.join(tmpdir, "bench.sqlite3"),
+        "GRAPH_BASE_URL": graph_url,
+        "WHATSAPP_TOKEN": "bench-token",
+        "PHONE_NUMBER_ID": gen.PHONE_NUMBER_ID,
+        "LLAMA_BASE_URL": llama_url,
+        "AI_ENABLED": "1",
+        # la IA siempre va al modelo: que el cache de extracciones no esconda la diferencia
+        "EXTRACT_CACHE_TTL_SEC": "0",
+        "EXTRACT_CACHE_NEG_TTL_SEC": "0",
+        "ORDER_TEXT_EXPORT": "0",
+        "INGEST_MODE": "queue",
+        "COALESCE_MS": str(window_ms),
+        "COALESCE_MAX_MS": str(max_ms),
+        "LOG_LEVEL": "ERROR",
+    })
+
+
+def _fmt(name: str, res: Dict[str, Any]) -> str:
+    return f"{name:9s} " + "  ".join(f"{k}={v}" for k, v in res.items())
+
+
+def _orders() -> List[str]:
+    from app.services.intents import classify
+    from app.services.state_machine import _norm
+
+    # sin saludo adentro: un solo mensaje "hola quiero ..." en AWAITING_ORDER contesta el menú
+    return [p for p in ORDER_PHRASES if not classify(_norm(p))["greeting"]]
+
+
+def _script(rnd: random.Random, orders: List[str], ai_rate: float) -> Tuple[List[List[str]], str]:
+    """
+    Ráfagas de una conversación y el pedido completo (para validar la orden).
+    """
+    order = rnd.choice(orders)
+    envio = rnd.random() < 0.5
+    burst = ([rnd.choice(_AI_ONLY)] if rnd.random() < ai_rate else []) + _SPLIT.split(order)
+    burst.append("para envio" if envio else "lo paso a buscar")
+    # la mitad saluda en la misma ráfaga del pedido ("hola" + "2 hamburguesas" + ...)
+    bursts = [["hola"] + burst] if rnd.random() < 0.5 else [["hola"], burst]
+    if envio:
+        bursts.append(["San Martín 1234"])
+    bursts += [[rnd.choice(["efectivo", "transferencia"])], ["soy Ana"], ["si"]]
+    return bursts, order
+
+
+def build(phones: int, base: int, seed: int, gap_ms: Tuple[int, int], think_ms: Tuple[int, int], ai_rate: float):
+    rnd = random.Random(seed)
+    orders = _orders()
+    events: List[Event] = []
+    bursts: List[List[int]] = []
+    expected: Dict[str, str] = {}
+    for i in range(phones):
+        phone = gen.phone_for(base + i)
+        script, expected[phone] = _script(rnd, orders, ai_rate)
+        t = rnd.uniform(0, 2.0)
+        for texts in script:
+            idx = []
+            for k, text in enumerate(texts):
+                if k:
+                    t += rnd.uniform(*gap_ms) / 1000.0
+                idx.append(len(events))
+                events.append((t, phone, text, len(bursts)))
+            bursts.append(idx)
+            t += rnd.uniform(*think_ms) / 1000.0
+    order_ix = sorted(range(len(events)), key=lambda j: events[j][0])
+    return events, order_ix, bursts, expected
+
+
+def _items_ok(expected: Dict[str, str]) -> int:
+    from app.db.repository import get_orders_by_phone
+    from app.services.menu import get_menu
+    from app.services.state_machine import _norm
+
+    matcher = get_menu().matcher
+    ok = 0
+    for phone, order in expected.items():
+        want = sorted(matcher.parse(_norm(order)))
+        got = get_orders_by_phone(phone, limit=1)
+        if got and sorted((it.get("id"), it.get("qty")) for it in got[0]["items"]) == want:
+            ok += 1
+    return ok
+
+
+def run_mode(graph, llama, label: str, coalesce: bool, plan) -> Dict[str, Any]:
+    import app.main as main
+    from app.services.order_writer import get_writer
+    from app.services.stats import LatencyWindow
+
+    events, order_ix, bursts, expected = plan
+    from app.services import coalesce as co
+
+    # la ventana la lee dispatch_message; el Coalescer toma la config del entorno
+    main.COALESCE_MS = co.COALESCE_MS if coalesce else 0
+    client = main.app.test_client()
+    pool = main.get_pool()
+    steps0, llama0, sends0 = pool.stats()["processed"], llama.received, len(graph.accepted_keys)
+
+    ids = [f"wamid.{label}.{j}" for j in range(len(events))]
+    sent_at = [0.0] * len(events)
+    started = time.monotonic()
+    for j in order_ix:
+        t, phone, text, _ = events[j]
+        delay = started + t - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        sent_at[j] = time.monotonic()
+        client.post("/webhook", json=gen._payload([[gen._value(messages=[
+            gen._text_message(phone, ids[j], int(t), text),
+        ])]]))
+
+    # esperar que cada ráfaga tenga su respuesta
+    keys = [f"{ids[j]}:0" for j in range(len(events))]
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if all(any(keys[j] in graph.accepted_at for j in idx) for idx in bursts):
+            break
+        time.sleep(0.02)
+    lat = LatencyWindow(size=len(bursts))
+    for idx in bursts:
+        answered = [graph.accepted_at[keys[j]] for j in idx if keys[j] in graph.accepted_at]
+        if answered:
+            lat.add(max(answered) - max(sent_at[j] for j in idx))
+    # el writer junta lotes por ORDER_FLUSH_MS: listo cuando deja de escribir
+    written = -1
+    while time.monotonic() < deadline:
+        st = get_writer().stats()
+        if not st["pending"] and st["written"] == written:
+            break
+        written = st["written"]
+        time.sleep(0.5)
+    return {
+        "msgs": len(events),
+        "bursts": len(bursts),
+        "steps": pool.stats()["processed"] - steps0,
+        "llm_requests": llama.received - llama0,
+        "graph_sends": len(graph.accepted_keys) - sends0,
+        "orders_ok": f"{_items_ok(expected)}/{len(expected)}",
+        "reply_ms": lat.percentiles((50, 99)),
+    }
+
+
+def run(phones: int, seed: int, window_ms: int, max_ms: int, gap_ms: Tuple[int, int], think_ms: Tuple[int, int],
+        ai_rate: float, graph_latency_ms: float, llama_latency_ms: float) -> None:
+    graph, graph_url = start_mock_graph(latency_ms=graph_latency_ms)
+    llama, llama_url = start_fake_llama(latency_ms=llama_latency_ms)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _configure(graph_url, llama_url, tmpdir, window_ms, max_ms)
+        print(f"ventana={window_ms}ms tope={max_ms}ms  entre mensajes={gap_ms}ms  entre ráfagas={think_ms}ms")
+        try:
+            for k, (label, coalesce) in enumerate((("off", False), ("coalesce", True))):
+                # teléfonos nuevos por modo (mismo guion): nadie arranca con sesión
+                plan = build(phones, 1_000 * (k + 1), seed, gap_ms, think_ms, ai_rate)
+                print(_fmt(label, run_mode(graph, llama, label, coalesce, plan)))
+        finally:
+            import app.main as main
+
+            main.shutdown()
+            graph.shutdown()
+            llama.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--phones", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--window-ms", type=int, default=400)
+    ap.add_argument("--max-ms", type=int, default=1500)
+    ap.add_argument("--gap-ms", type=int, nargs=2, default=(50, 300), help="entre mensajes de una ráfaga")
+    ap.add_argument("--think-ms", type=int, nargs=2, default=(1500, 2500), help="entre ráfagas")
+    ap.add_argument("--ai-rate", type=float, default=0.3)
+    ap.add_argument("--graph-latency-ms", type=float, default=40.0)
+    ap.add_argument("--llama-latency-ms", type=float, default=150.0)
+    args = ap.parse_args()
+    run(args.phones, args.seed, args.window_ms, args.max_ms, tuple(args.gap_ms), tuple(args.think_ms),
+        args.ai_rate, args.graph_latency_ms, args.llama_latency_ms)
@@ -0,0 +1,72 @@
+# bench/bench_extract_stream.py
+"""
+Tokens generados y tiempo-hasta-el-JSON por extracción, contra el server falso
+con costo por token (un modelo sin restringir sigue hablando después del JSON).
+
+Compara:
+  - plain:          sin stream, sin gramática (como era llama_extract)
+  - grammar:        sin stream, json_schema armado desde el menú
+  - stream:         stream + corte apenas cierra el objeto
+  - stream+grammar
+
+    python -m bench.bench_extract_stream --n 100 --clients 8 --token-ms 4 --invalid-rate 0.1
+"""
+from __future__ import annotations
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.llama_client import LlamaBatcher, _parse_completion, build_prompt
+from bench.corpus import ORDER_PHRASES
+from bench.fake_llama import start_fake_llama
+
+MODES = (
+    ("plain", False, "off"),
+    ("grammar", False, "json_schema"),
+    ("stream", True, "off"),
+    ("stream+grammar", True, "json_schema"),
+)
+
+
+def run(n: int, clients: int, slots: int, latency_ms: float, token_ms: float, invalid_rate: float) -> None:
+    srv, base_url = start_fake_llama(
+        slots=slots, latency_ms=latency_ms, token_ms=token_ms, invalid_rate=invalid_rate
+    )
+    texts = [ORDER_PHRASES[i % len(ORDER_PHRASES)] for i in range(n)]
+    try:
+        for label, stream, grammar in MODES:
+            batcher = LlamaBatcher(
+                base_url=base_url, max_concurrency=slots, stream=stream, grammar=grammar
+            )
+            before = srv.tokens_generated
+
+            def one(text: str, batcher: LlamaBatcher = batcher) -> bool:
+                try:
+                    return _parse_completion(batcher.complete(build_prompt(text), timeout=30)).get("ok") is True
+                except Exception:
+                    return False
+
+            with ThreadPoolExecutor(max_workers=clients) as ex:
+                ok = sum(ex.map(one, texts))
+            st = batcher.stats()
+            batcher.close()
+            print(
+                f"{label:15s} ok={ok}/{n}  avg_tokens={st['avg_tokens']:6.1f}"
+                f"  server_tokens={srv.tokens_generated - before:6d}"
+                f"  invalid={st['invalid_json']:3d}  early_stops={st['early_stops']:3d}"
+                f"  ttr={st['time_to_result_ms']}"
+            )
+    finally:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=100)
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--slots", type=int, default=4)
+    ap.add_argument("--latency-ms", type=float, default=20.0)
+    ap.add_argument("--token-ms", type=float, default=4.0)
+    ap.add_argument("--invalid-rate", type=float, default=0.1)
+    args = ap.parse_args()
+    run(args.n, args.clients, args.slots, args.latency_ms, args.token_ms, args.invalid_rate)
@@ -0,0 +1,46 @@
+# bench/bench_intents.py
+"""
+Detección de intenciones sobre el corpus grabado: los 5 helpers originales
+(cada uno normaliza y recorre su lista de substrings) vs intents.classify
+(una normalización + una pasada del autómata Aho-Corasick).
+
+También verifica que den exactamente lo mismo para cada frase.
+
+    python -m bench.bench_intents --rounds 5000
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+from app.services.intents import classify
+from app.services.state_machine import _norm
+from bench import legacy
+from bench.corpus import ORDER_PHRASES, SMALLTALK_PHRASES
+
+CORPUS = SMALLTALK_PHRASES + ORDER_PHRASES
+
+
+def _bench(fn, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for phrase in CORPUS:
+            fn(phrase)
+    return (time.perf_counter() - started) / (rounds * len(CORPUS))
+
+
+def run(rounds: int) -> None:
+    diffs = [p for p in CORPUS if classify(_norm(p)) != legacy.classify(p)]
+    print(f"frases distintas: {len(diffs)}/{len(CORPUS)} {diffs}")
+
+    old = _bench(legacy.classify, rounds)
+    new = _bench(lambda p: classify(_norm(p)), rounds)
+    print(f"helpers (x5)  : {old * 1e6:6.2f} us/msg")
+    print(f"aho-corasick  : {new * 1e6:6.2f} us/msg  ({old / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=5000)
+    args = ap.parse_args()
+    run(args.rounds)
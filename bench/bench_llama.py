@@ -0,0 +1,82 @@
+# bench/bench_llama.py
+"""
+Throughput y latencia de cola de las extracciones contra el server falso.
+
+Compara:
+  - serial: requests.post nuevo por extracción (como era llama_extract)
+  - batcher: LlamaBatcher (pool keep-alive + concurrencia acotada + micro-batching)
+
+    python -m bench.bench_llama --n 200 --clients 32 --slots 4 --latency-ms 80
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.services.llama_client import LlamaBatcher, _parse_completion, build_prompt
+from app.services.stats import LatencyWindow
+from bench.corpus import ORDER_PHRASES
+from bench.fake_llama import start_fake_llama
+
+
+def _serial_extract(base_url: str, text: str) -> dict:
+    r = requests.post(
+        f"{base_url}/v1/completions",
+        json={"model": "m", "prompt": build_prompt(text), "temperature": 0, "max_tokens": 120},
+        timeout=30,
+    )
+    r.raise_for_status()
+    return _parse_completion((r.json().get("choices") or [{}])[0].get("text", ""))
+
+
+def _drive(fn, n: int, clients: int) -> tuple[float, LatencyWindow, int]:
+    lat = LatencyWindow(size=n)
+    texts = [ORDER_PHRASES[i % len(ORDER_PHRASES)] for i in range(n)]
+
+    def one(text: str) -> bool:
+        started = time.perf_counter()
+        try:
+            return fn(text).get("ok") is True
+        except Exception:
+            return False
+        finally:
+            lat.add(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as ex:
+        ok = sum(ex.map(one, texts))
+    return n / (time.perf_counter() - started), lat, ok
+
+
+def run(n: int, clients: int, slots: int, latency_ms: float, mode: str) -> None:
+    srv, base_url = start_fake_llama(slots=slots, latency_ms=latency_ms)
+    try:
+        rate, lat, ok = _drive(lambda t: _serial_extract(base_url, t), n, clients)
+        print(f"serial : {rate:7.1f} ext/s  ok={ok}/{n}  {lat.percentiles()}")
+
+        batcher = LlamaBatcher(base_url=base_url, max_concurrency=slots, mode=mode)
+
+        def batched(text: str) -> dict:
+            return _parse_completion(batcher.complete(build_prompt(text), timeout=30))
+
+        rate, lat, ok = _drive(batched, n, clients)
+        st = batcher.stats()
+        print(f"batcher: {rate:7.1f} ext/s  ok={ok}/{n}  {lat.percentiles()}"
+              f"  avg_batch={st['avg_batch']} mode={mode}")
+        batcher.close()
+    finally:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--slots", type=int, default=4)
+    ap.add_argument("--latency-ms", type=float, default=80.0)
+    ap.add_argument("--mode", default="parallel", choices=["parallel", "prompt_list"])
+    args = ap.parse_args()
+    run(args.n, args.clients, args.slots, args.latency_ms, args.mode)
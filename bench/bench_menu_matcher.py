@@ -0,0 +1,54 @@
+# bench/bench_menu_matcher.py
+"""
+Micro-benchmark del parseo de pedidos: cascada regex original vs MenuMatcher.
+Cada iteración = parsear la frase + calcular el total (como en ASK_CONFIRM).
+
+    python -m bench.bench_menu_matcher --rounds 2000
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+from app.services import state_machine as sm
+from app.services.menu import get_menu
+from bench import legacy
+from bench.corpus import ORDER_PHRASES
+
+
+def _legacy_step(text: str) -> int:
+    items = legacy._parse_items_regex(text)
+    return legacy._calc_total({"items": items})
+
+
+_MENU = get_menu()
+
+
+def _matcher_step(text: str) -> int:
+    items = sm._parse_items(text, _MENU)
+    return sm._calc_total({"items": items}, _MENU)
+
+
+def _bench(fn, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for phrase in ORDER_PHRASES:
+            fn(phrase)
+    return (time.perf_counter() - started) / (rounds * len(ORDER_PHRASES))
+
+
+def run(rounds: int) -> None:
+    old = _bench(_legacy_step, rounds)
+    new = _bench(_matcher_step, rounds)
+    print(f"regex cascade: {old * 1e6:7.2f} us/msg")
+    print(f"menu matcher : {new * 1e6:7.2f} us/msg  ({old / new:.1f}x)")
+
+    misses = [p for p in ORDER_PHRASES if not sm._parse_items(p, _MENU)]
+    print(f"frases sin ítems (matcher): {len(misses)}/{len(ORDER_PHRASES)} {misses}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=2000)
+    args = ap.parse_args()
+    run(args.rounds)
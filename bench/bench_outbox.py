@@ -0,0 +1,168 @@
+# bench/bench_outbox.py
+"""
+Outbox de respuestas contra el mock de Graph API (con latencia), SQLite en un tmp.
+
+Fases:
+  webhook : POST /webhook (INGEST_MODE=inline) mandando dentro del paso vs
+            dejando la respuesta en el outbox; latencia del webhook y cuánto
+            tarda en salir la última respuesta
+  restart : respuestas commiteadas sin sender (el proceso murió antes de
+            mandar); un sender nuevo las retoma
+  errors  : Graph con error_rate (429/500): todo sale igual, con reintentos
+
+Reporta duplicados por idem_key (biz_opaque_callback_data) en cada fase.
+
+    python -m bench.bench_outbox --phones 100 --graph-latency-ms 40
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+from bench import payloads as gen
+from bench.mock_graph import start_mock_graph
+
+
+def _configure(graph_url: str, tmpdir: str) -> None:
+    # antes de importar app.*: los servicios leen la config al importarse
+    os.environ.update({
+        "DB_PATH": os.path.join(tmpdir, "bench.sqlite3"),
+        "GRAPH_BASE_URL": graph_url,
+        "WHATSAPP_TOKEN": "bench-token",
+        "PHONE_NUMBER_ID": gen.PHONE_NUMBER_ID,
+        "AI_ENABLED": "0",
+        "ORDER_TEXT_EXPORT": "0",
+        "INGEST_MODE": "inline",
+        "LOG_LEVEL": "ERROR",
+        # reintentos en escala de bench (default: segundos a minutos)
+        "OUTBOX_BACKOFF_BASE": "0.02",
+        "OUTBOX_BACKOFF_MAX": "0.2",
+        "OUTBOX_POLL_MS": "20",
+    })
+
+
+def _fmt(name: str, res: Dict[str, Any]) -> str:
+    return f"{name:8s} " + "  ".join(f"{k}={v}" for k, v in res.items())
+
+
+def _dups(graph) -> int:
+    return sum(n - 1 for n in graph.accepted_keys.values() if n > 1)
+
+
+def _wait_sends(graph, expected: int, timeout: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout
+    while len(graph.accepted_keys) < expected and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def run_webhook(graph, payloads, outbox: bool) -> Dict[str, Any]:
+    import app.main as main
+    from app.services.stats import LatencyWindow
+
+    main.OUTBOX_ENABLED = outbox
+    client = main.app.test_client()
+    # reintentos de Meta (mismo wamid) los corta el dedupe: una respuesta por wamid
+    expected = len({msg_id for msg_id, _, _ in gen.text_messages(payloads)})
+    before = len(graph.accepted_keys) if outbox else graph.received
+    lat = LatencyWindow(size=len(payloads))
+    started = time.perf_counter()
+    for p in payloads:
+        t0 = time.perf_counter()
+        client.post("/webhook", json=p)
+        lat.add(time.perf_counter() - t0)
+    posted = time.perf_counter() - started
+    if outbox:
+        _wait_sends(graph, before + expected)
+    delivered = time.perf_counter() - started
+    return {
+        "mode": "outbox" if outbox else "inline-send",
+        "msgs": expected,
+        "webhook_ms": lat.percentiles((50, 99)),
+        "posted_s": round(posted, 2),
+        "last_reply_s": round(delivered, 2),
+    }
+
+
+def run_restart(graph, n: int) -> Dict[str, Any]:
+    from app.services.outbox import OutboxSender, outbox_rows
+    from app.services.session_store import SqliteSessionStore
+
+    store = SqliteSessionStore()
+    for i in range(n):
+        phone = gen.phone_for(50_000 + i % 200)
+        store.save(phone, "ASK_PAYMENT", {}, outbox_rows(phone, [f"pendiente {i}"], f"wamid.restart.{i}"))
+    before = len(graph.accepted_keys)
+    started = time.perf_counter()
+    sender = OutboxSender()
+    _wait_sends(graph, before + n)
+    elapsed = time.perf_counter() - started
+    sender.close()
+    return {"pending": n, "resumed": len(graph.accepted_keys) - before, "drain_s": round(elapsed, 2)}
+
+
+def run_errors(n: int, latency_ms: float, error_rate: float) -> Dict[str, Any]:
+    from app.services.outbox import OutboxSender, outbox_rows
+    from app.services.session_store import SqliteSessionStore
+    from app.services.whatsapp_client import WhatsAppClient
+
+    graph, url = start_mock_graph(latency_ms=latency_ms, error_rate=error_rate)
+    # sin reintentos del cliente: todo lo que falla lo reintenta el outbox
+    client = WhatsAppClient("bench-token", gen.PHONE_NUMBER_ID, base_url=url, max_retries=0)
+    try:
+        store = SqliteSessionStore()
+        for i in range(n):
+            phone = gen.phone_for(60_000 + i % 200)
+            store.save(phone, "ASK_PAYMENT", {}, outbox_rows(phone, [f"r {i}"], f"wamid.errors.{i}"))
+        started = time.perf_counter()
+        sender = OutboxSender(send=lambda phone, body, key: client.send_text(phone, body, idem_key=key))
+        _wait_sends(graph, n)
+        elapsed = time.perf_counter() - started
+        sender.close()
+        st = sender.stats()
+        return {
+            "error_rate": error_rate,
+            "sent": len(graph.accepted_keys),
+            "of": n,
+            "retried": st["retried"],
+            "dead": st["dead"],
+            "duplicates": _dups(graph),
+            "drain_s": round(elapsed, 2),
+        }
+    finally:
+        client.close()
+        graph.shutdown()
+
+
+def run(phones: int, latency_ms: float, restart_n: int, error_rate: float) -> None:
+    graph, graph_url = start_mock_graph(latency_ms=latency_ms)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _configure(graph_url, tmpdir)
+        try:
+            print(_fmt("webhook", run_webhook(graph, gen.generate(phones, seed=1), outbox=False)))
+            print(_fmt("webhook", run_webhook(graph, gen.generate(phones, seed=2), outbox=True)))
+
+            from app.services.outbox import close_sender
+            close_sender()
+            print(_fmt("restart", run_restart(graph, restart_n)))
+            print(_fmt("errors", run_errors(restart_n, latency_ms, error_rate)))
+            print(f"{'':8s} duplicates={_dups(graph)}")
+        finally:
+            from app.services.order_writer import get_writer
+            from app.services.session_store import get_store
+
+            getattr(get_store(), "close", lambda: None)()
+            get_writer().close()
+            graph.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--phones", type=int, default=100)
+    ap.add_argument("--graph-latency-ms", type=float, default=40.0)
+    ap.add_argument("--restart", type=int, default=1000)
+    ap.add_argument("--error-rate", type=float, default=0.2)
+    args = ap.parse_args()
+    run(args.phones, args.graph_latency_ms, args.restart, args.error_rate)
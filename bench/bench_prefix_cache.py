@@ -0,0 +1,82 @@
+# bench/bench_prefix_cache.py
+"""
+Evaluación del prompt por extracción con y sin reuso del KV cache del prefijo
+fijo (PROMPT_PREFIX), contra el server falso con costo por token de prompt.
+
+Modos:
+  off        : cache_prompt=false (el server re-evalúa todo el prompt siempre)
+  cache      : cache_prompt=true, el server elige el slot
+  cache+pin  : cache_prompt=true + id_slot fijo por request + warm-up de slots
+
+Reporta prompt_ms (lo que dice "timings" del server), tokens cacheados por
+extracción, tiempo al primer token y tiempo hasta el JSON.
+
+    python -m bench.bench_prefix_cache --n 200 --clients 8 --prompt-token-ms 2
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.llama_client import PROMPT_PREFIX, LlamaBatcher, _parse_completion, build_prompt
+from bench.corpus import ORDER_PHRASES
+from bench.fake_llama import start_fake_llama
+
+MODES = (
+    ("off", False, False),
+    ("cache", True, False),
+    ("cache+pin", True, True),
+)
+
+
+def run(n: int, clients: int, slots: int, latency_ms: float, token_ms: float, prompt_token_ms: float) -> None:
+    texts = [ORDER_PHRASES[i % len(ORDER_PHRASES)] for i in range(n)]
+    print(f"prefijo fijo: {len(PROMPT_PREFIX)} chars, sufijo típico: {len(build_prompt(texts[0])) - len(PROMPT_PREFIX)} chars")
+    for label, cache_prompt, pin in MODES:
+        # server nuevo por modo: slots vacíos, nadie arranca con ventaja
+        srv, base_url = start_fake_llama(
+            slots=slots, latency_ms=latency_ms, token_ms=token_ms, prompt_token_ms=prompt_token_ms
+        )
+        try:
+            batcher = LlamaBatcher(
+                base_url=base_url, max_concurrency=slots, stream=True, grammar="json_schema",
+                cache_prompt=cache_prompt, pin_slots=pin, warm_slots=pin,
+            )
+            # el warm-up corre en background al crear el cliente (arranque del worker)
+            deadline = time.monotonic() + 10
+            while pin and batcher.warmed < slots and time.monotonic() < deadline:
+                time.sleep(0.01)
+            before_tokens, before_cached = srv.prompt_tokens, srv.prompt_tokens_cached
+
+            def one(text: str, batcher: LlamaBatcher = batcher) -> bool:
+                try:
+                    return _parse_completion(batcher.complete(build_prompt(text), timeout=30)).get("ok") is True
+                except Exception:
+                    return False
+
+            with ThreadPoolExecutor(max_workers=clients) as ex:
+                ok = sum(ex.map(one, texts))
+            st = batcher.stats()
+            batcher.close()
+            evaluated = (srv.prompt_tokens - before_tokens) - (srv.prompt_tokens_cached - before_cached)
+            print(
+                f"{label:10s} ok={ok}/{n}  prompt_ms={st['prompt_ms']}"
+                f"  avg_tokens_cached={st['avg_tokens_cached']:5.1f}"
+                f"  prompt_tokens_evaluated={evaluated:6d}"
+                f"  ttft={st['time_to_first_token_ms']}  ttr={st['time_to_result_ms']}"
+            )
+        finally:
+            srv.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200)
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--slots", type=int, default=4)
+    ap.add_argument("--latency-ms", type=float, default=5.0)
+    ap.add_argument("--token-ms", type=float, default=2.0)
+    ap.add_argument("--prompt-token-ms", type=float, default=2.0)
+    args = ap.parse_args()
+    run(args.n, args.clients, args.slots, args.latency_ms, args.token_ms, args.prompt_token_ms)
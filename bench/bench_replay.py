@@ -0,0 +1,218 @@
+# bench/bench_replay.py
+"""
+Carga de punta a punta con webhooks realistas (ver bench/payloads.py), todo local:
+Graph API -> bench/mock_graph.py, llama -> bench/fake_llama.py, SQLite en un tmp.
+
+Fases:
+  direct : handle_message directo (state machine + menú + IA), sesiones en un dict
+  webhook: POST /webhook con el test client de Flask (parseo, dedupe, sesiones,
+           órdenes, envío por WhatsApp)
+  memory : tracemalloc mientras N teléfonos nuevos quedan con sesión activa,
+           primero como el dict de dicts de antes y después en el store (todas
+           residentes: el tope de RAM se sube a N)
+
+Reporta mensajes/s, p50/p99, bytes por sesión y total a N sesiones (junto con
+lo que el store cree que ocupa: de eso salen SESSION_MEM_MAX_MB y el gauge
+vendobot_sessions_bytes).
+
+    python -m bench.bench_replay --phones 300 --sessions 10000
+    python -m bench.bench_replay --replay /tmp/replay.jsonl
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+from bench import payloads as gen
+from bench.corpus import ORDER_PHRASES
+from bench.fake_llama import start_fake_llama
+from bench.mock_graph import start_mock_graph
+
+
+def _configure(graph_url: str, llama_url: str, tmpdir: str, sessions: int) -> None:
+    # antes de importar app.*: los servicios leen la config al importarse
+    os.environ.update({
+        "DB_PATH": os.path.join(tmpdir, "bench.sqlite3"),
+        "GRAPH_BASE_URL": graph_url,
+        "WHATSAPP_TOKEN": "bench-token",
+        "PHONE_NUMBER_ID": gen.PHONE_NUMBER_ID,
+        "LLAMA_BASE_URL": llama_url,
+        "AI_ENABLED": "1",
+        "ORDER_TEXT_EXPORT": "0",
+        "INGEST_MODE": "inline",
+        # fase memory: que entren todas (y que no venzan durante la medición)
+        "SESSION_CACHE_MAX": str(max(10_000, sessions)),
+        "SESSION_MEM_MAX_MB": "4096",
+        # solo errores: la cola de logs no compite con la medición
+        "LOG_LEVEL": "ERROR",
+    })
+
+
+def _fmt(name: str, res: Dict[str, Any]) -> str:
+    return f"{name:8s} " + "  ".join(f"{k}={v}" for k, v in res.items())
+
+
+def run_direct(payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    from app.services.state_machine import handle_message
+    from app.services.stats import LatencyWindow
+
+    msgs = list(gen.text_messages(payloads))
+    lat = LatencyWindow(size=len(msgs))
+    sessions: Dict[str, tuple] = {}
+    seen = set()
+    done = 0
+    started = time.perf_counter()
+    for msg_id, phone, body in msgs:
+        if msg_id in seen:
+            continue
+        seen.add(msg_id)
+        t0 = time.perf_counter()
+        state, data = sessions.get(phone, (None, {}))
+        state, data, _ = handle_message(state, body, data, phone=phone)
+        sessions[phone] = (state, data)
+        lat.add(time.perf_counter() - t0)
+        done += 1
+    elapsed = time.perf_counter() - started
+    return {"msgs": done, "msg_per_s": round(done / elapsed, 1), "latency_ms": lat.percentiles((50, 99))}
+
+
+def run_webhook(payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    from app.main import app
+    from app.services.stats import LatencyWindow
+
+    client = app.test_client()
+    lat = LatencyWindow(size=len(payloads))
+    total_msgs = sum(1 for _ in gen.text_messages(payloads))
+    errors = 0
+    started = time.perf_counter()
+    for p in payloads:
+        t0 = time.perf_counter()
+        r = client.post("/webhook", json=p)
+        lat.add(time.perf_counter() - t0)
+        if r.status_code != 200:
+            errors += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "payloads": len(payloads),
+        "text_msgs": total_msgs,
+        "msg_per_s": round(total_msgs / elapsed, 1),
+        "payload_latency_ms": lat.percentiles((50, 99)),
+        "errors": errors,
+    }
+
+
+def _drain_outbox(timeout: float = 30.0) -> None:
+    # las respuestas salen por el outbox (en background): graph_sends cuenta todas
+    from app.db.repository import pending_outbox
+    from app.services.outbox import OUTBOX_ENABLED
+    from app.services.session_store import get_store
+
+    if not OUTBOX_ENABLED:
+        return
+    getattr(get_store(), "flush", lambda: None)()
+    deadline = time.monotonic() + timeout
+    while pending_outbox() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def _fill(sessions: int, save) -> None:
+    from app.services.state_machine import handle_message
+
+    for i in range(sessions):
+        phone = gen.phone_for(10_000_000 + i)
+        state, data = None, {}
+        for text in ("hola", ORDER_PHRASES[i % len(ORDER_PHRASES)]):
+            state, data, _ = handle_message(state, text, data, phone=phone)
+        save(phone, state, data)
+
+
+def _traced(fn) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fn()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used
+
+
+def run_memory(sessions: int) -> List[Dict[str, Any]]:
+    from app.services.session_store import get_store
+
+    # antes: phone -> (state, data) con los dicts tal cual salen de handle_message
+    legacy: Dict[str, tuple] = {}
+
+    def fill_dict():
+        _fill(sessions, lambda phone, state, data: legacy.__setitem__(phone, (state, data)))
+
+    legacy_used = _traced(fill_dict)
+    legacy.clear()
+
+    store = get_store()
+
+    def fill_store():
+        _fill(sessions, store.save)
+        getattr(store, "flush", lambda: None)()
+
+    used = _traced(fill_store)
+    out = []
+    for name, nbytes, accounted in (
+        ("dict", legacy_used, None),
+        (type(store).__name__, used, getattr(store, "nbytes", lambda: None)()),
+    ):
+        res = {
+            "store": name,
+            "sessions": sessions,
+            "bytes_per_session": round(nbytes / max(1, sessions)),
+            "total_mb": round(nbytes / 1e6, 1),
+        }
+        if accounted is not None:
+            res["accounted_per_session"] = round(accounted / max(1, sessions))
+            res["resident"] = len(store)
+        out.append(res)
+    return out
+
+
+def run(phones: int, sessions: int, replay: str | None, graph_ms: float, llama_ms: float) -> None:
+    graph, graph_url = start_mock_graph(latency_ms=graph_ms)
+    llama, llama_url = start_fake_llama(slots=4, latency_ms=llama_ms)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _configure(graph_url, llama_url, tmpdir, sessions)
+        payloads = gen.load(replay) if replay else gen.generate(phones)
+        try:
+            direct = run_direct(payloads)
+            webhook = run_webhook(payloads)
+            _drain_outbox()
+            memory = run_memory(sessions) if sessions else []
+            print(_fmt("direct", direct))
+            print(_fmt("webhook", webhook))
+            print(f"{'':8s} graph_sends={graph.received} llama_requests={llama.received}")
+            for res in memory:
+                print(_fmt("memory", res))
+        finally:
+            from app.services.order_writer import get_writer
+            from app.services.outbox import close_sender
+            from app.services.session_store import get_store
+
+            getattr(get_store(), "close", lambda: None)()
+            get_writer().close()
+            close_sender()
+            graph.shutdown()
+            llama.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--phones", type=int, default=300)
+    ap.add_argument("--sessions", type=int, default=10_000)
+    ap.add_argument("--replay", default=None, help="JSONL grabado con bench.payloads")
+    ap.add_argument("--graph-latency-ms", type=float, default=0.0)
+    ap.add_argument("--llama-latency-ms", type=float, default=20.0)
+    args = ap.parse_args()
+    run(args.phones, args.sessions, args.replay, args.graph_latency_ms, args.llama_latency_ms)
@@ -0,0 +1,109 @@
+# bench/bench_sessions.py
+"""
+Sesiones/seg (load + save por mensaje) contra una base temporal.
+
+Compara:
+  - per-call: abrir conexión + PRAGMAs + query + cerrar en cada llamada (como era repository.py)
+  - pooled: repository actual (conexiones de larga vida, PRAGMAs una vez, statements cacheados)
+  - behind: CachedSessionStore (cache LRU + flush agrupado); reporta commits por mensaje
+
+    python -m bench.bench_sessions --n 5000 --phones 500 --threads 4
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+_DATA = {"items": [{"name": "hamburguesa doble", "qty": 2}, {"name": "coca", "qty": 1}],
+         "delivery_method": "envio", "address": "San Martín 123"}
+
+
+def _old_connection(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA foreign_keys=ON;")
+    return conn
+
+
+def _old_step(path: str, phone: str) -> None:
+    conn = _old_connection(path)
+    try:
+        row = conn.execute("SELECT state, data FROM sessions WHERE phone = ?", (phone,)).fetchone()
+        if row:
+            json.loads(row["data"])
+    finally:
+        conn.close()
+    conn = _old_connection(path)
+    try:
+        conn.execute(
+            """
+            INSERT INTO sessions (phone, state, data, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(phone) DO UPDATE SET
+              state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            """,
+            (phone, "ASK_DELIVERY", json.dumps(_DATA, ensure_ascii=False),
+             datetime.utcnow().isoformat()),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _timed(fn, n: int, phones: int, threads: int) -> float:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        list(ex.map(lambda i: fn(f"549{i % phones:07d}"), range(n)))
+    return n / (time.perf_counter() - started)
+
+
+def run(n: int, phones: int, threads: int) -> None:
+    tmp = tempfile.mkdtemp(prefix="vendobot-bench-")
+    path = os.path.join(tmp, "bench.sqlite3")
+    os.environ["DB_PATH"] = path
+
+    # import tardío: conn.py lee DB_PATH al crear el pool
+    from app.db import repository
+    from app.db.conn import init_db
+
+    init_db()
+
+    rate_old = _timed(lambda ph: _old_step(path, ph), n, phones, threads)
+    print(f"per-call: {rate_old:8.0f} sesiones/s")
+
+    def new_step(phone: str) -> None:
+        repository.get_session(phone)
+        repository.upsert_session(phone, "ASK_DELIVERY", _DATA)
+
+    rate_new = _timed(new_step, n, phones, threads)
+    print(f"pooled  : {rate_new:8.0f} sesiones/s  ({rate_new / rate_old:.1f}x)  commits={n}")
+
+    from app.services.session_store import CachedSessionStore, SqliteSessionStore
+
+    store = CachedSessionStore(SqliteSessionStore())
+
+    def cached_step(phone: str) -> None:
+        store.load(phone)
+        store.save(phone, "ASK_DELIVERY", _DATA)
+
+    rate_cached = _timed(cached_step, n, phones, threads)
+    store.close()
+    st = store.stats()
+    print(f"behind  : {rate_cached:8.0f} sesiones/s  ({rate_cached / rate_old:.1f}x)"
+          f"  commits={st['commits']}  filas={st['rows_flushed']}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=5000)
+    ap.add_argument("--phones", type=int, default=500)
+    ap.add_argument("--threads", type=int, default=4)
+    args = ap.parse_args()
+    run(args.n, args.phones, args.threads)
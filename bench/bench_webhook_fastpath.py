@@ -0,0 +1,140 @@
+# bench/bench_webhook_fastpath.py
+"""
+POST /webhook con la mezcla de producción (ver with_receipts en bench/payloads.py):
+por cada mensaje de texto llegan sent/delivered/read de la respuesta, más
+imágenes/audios y reintentos de Meta. La app WSGI de Flask llamada directo,
+sesiones y outbox en SQLite en un tmp, sin IA; el outbox no manda (WhatsApp
+sin configurar).
+
+Modos:
+  full     : WEBHOOK_FASTPATH=0, todo se parsea y se recorre
+  fastpath : statuses y no-texto se contestan mirando los bytes, antes de Flask
+  +counts  : fastpath + WEBHOOK_STATUS_COUNTS=1 (statuses por tipo)
+
+Reporta requests/s de la mezcla, µs por entrega según tipo y el costo de
+solo clasificar vs json.loads + recorrido.
+
+    python -m bench.bench_webhook_fastpath --phones 300
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+from bench import payloads as gen
+
+MODES = (
+    ("full", False, False),
+    ("fastpath", True, False),
+    ("+counts", True, True),
+)
+
+
+def _configure(tmpdir: str) -> None:
+    # antes de importar app.*: los servicios leen la config al importarse
+    os.environ.update({
+        "DB_PATH": os.path.join(tmpdir, "bench.sqlite3"),
+        "WHATSAPP_TOKEN": "",
+        "AI_ENABLED": "0",
+        "ORDER_TEXT_EXPORT": "0",
+        "INGEST_MODE": "inline",
+        "LOG_LEVEL": "ERROR",
+    })
+
+
+def _fmt(name: str, res: Dict[str, Any]) -> str:
+    return f"{name:9s} " + "  ".join(f"{k}={v}" for k, v in res.items())
+
+
+def _environs(bodies: List[bytes]) -> List[Dict[str, Any]]:
+    from werkzeug.test import EnvironBuilder
+
+    return [
+        EnvironBuilder(path="/webhook", method="POST", data=b, content_type="application/json").get_environ()
+        for b in bodies
+    ]
+
+
+def _start_response(status, headers, exc_info=None):
+    if not status.startswith("200"):
+        raise RuntimeError(status)
+
+
+def run_mode(bodies: List[bytes], kinds: List[str], phones: int, label: str, fast: bool, counts: bool) -> Dict[str, Any]:
+    import app.main as main
+    from app.services import webhook
+    from app.services.session_store import get_store
+
+    main.WEBHOOK_FASTPATH = fast
+    webhook.WEBHOOK_STATUS_COUNTS = counts
+    store = get_store()
+    for i in range(phones):
+        store.reset(gen.phone_for(i))
+    # wamids propios por modo: el dedupe no arrastra lo del modo anterior
+    environs = _environs([b.replace(b'"wamid.', f'"wamid.{label}.'.encode()) for b in bodies])
+
+    # la app WSGI directo (como la llama gunicorn), sin el test client en el medio
+    spent: Dict[str, float] = Counter()
+    for environ, kind in zip(environs, kinds):
+        t0 = time.perf_counter()
+        b"".join(main.app(environ, _start_response))
+        spent[kind] += time.perf_counter() - t0
+    n = Counter(kinds)
+    return {
+        "req_s": round(len(bodies) / sum(spent.values())),
+        **{f"{k}_us": round(spent[k] / n[k] * 1e6, 1) for k in ("status", "nontext", "text") if n[k]},
+    }
+
+
+def run_classify(bodies: List[bytes], kinds: List[str], rounds: int) -> Dict[str, Any]:
+    from app.services.webhook import classify, iter_messages, text_message
+
+    status = [b for b, k in zip(bodies, kinds) if k == "status"]
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for b in status:
+            classify(b)
+    fast = (time.perf_counter() - started) / (rounds * len(status))
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for b in status:
+            for msg in iter_messages(json.loads(b)):
+                text_message(msg)
+    full = (time.perf_counter() - started) / (rounds * len(status))
+    return {"classify_us": round(fast * 1e6, 2), "json_walk_us": round(full * 1e6, 2)}
+
+
+def run(phones: int, seed: int, rounds: int) -> None:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _configure(tmpdir)
+        from app.services.webhook import classify
+
+        payloads = gen.with_receipts(gen.generate(phones, seed=seed), seed=seed)
+        bodies = [json.dumps(p, ensure_ascii=False).encode() for p in payloads]
+        kinds = [classify(b) for b in bodies]
+        mix = Counter(kinds)
+        print(f"entregas={len(bodies)}  " + "  ".join(f"{k}={v}" for k, v in mix.most_common()))
+        try:
+            for label, fast, counts in MODES:
+                print(_fmt(label, run_mode(bodies, kinds, phones, label, fast, counts)))
+            print(_fmt("status", run_classify(bodies, kinds, rounds)))
+        finally:
+            from app.services.order_writer import get_writer
+            from app.services.session_store import get_store
+
+            getattr(get_store(), "close", lambda: None)()
+            get_writer().close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--phones", type=int, default=300)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--rounds", type=int, default=20)
+    args = ap.parse_args()
+    run(args.phones, args.seed, args.rounds)
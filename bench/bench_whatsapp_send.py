@@ -0,0 +1,76 @@
+# bench/bench_whatsapp_send.py
+"""
+Throughput de envíos a la Graph API contra el mock local (sin red real).
+
+Compara:
+  - naive: requests.post suelto por mensaje (como era send_whatsapp_text)
+  - pooled: WhatsAppClient compartido (keep-alive + tope en vuelo + reintentos)
+
+    python -m bench.bench_whatsapp_send --n 2000 --concurrency 16 --latency-ms 5
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.services.stats import LatencyWindow
+from app.services.whatsapp_client import WhatsAppClient
+from bench.mock_graph import start_mock_graph
+
+
+def _naive_send(base_url: str, to: str, text: str, lat: LatencyWindow) -> bool:
+    started = time.perf_counter()
+    r = requests.post(
+        f"{base_url}/v19.0/123/messages",
+        headers={"Authorization": "Bearer x", "Content-Type": "application/json"},
+        json={"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": text}},
+        timeout=15,
+    )
+    lat.add(time.perf_counter() - started)
+    return r.status_code < 400
+
+
+def run(n: int, concurrency: int, latency_ms: float, error_rate: float) -> None:
+    srv, base_url = start_mock_graph(latency_ms=latency_ms, error_rate=error_rate)
+    msgs = [(f"549{i % 500:07d}", f"respuesta {i}") for i in range(n)]
+    try:
+        # naive
+        lat = LatencyWindow(size=n)
+        conns_before = srv.connections
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as ex:
+            ok = sum(ex.map(lambda m: _naive_send(base_url, m[0], m[1], lat), msgs))
+        dt = time.perf_counter() - started
+        print(f"naive : {n / dt:8.0f} msg/s  ok={ok}/{n}  conns={srv.connections - conns_before}"
+              f"  {lat.percentiles()}")
+
+        # pooled
+        client = WhatsAppClient(
+            token="x", phone_number_id="123", base_url=base_url,
+            max_inflight=concurrency, pool_size=concurrency,
+        )
+        client.latency = LatencyWindow(size=n)
+        conns_before = srv.connections
+        started = time.perf_counter()
+        res = client.send_many(msgs)
+        dt = time.perf_counter() - started
+        ok = sum(1 for r in res if r["ok"])
+        st = client.stats()
+        print(f"pooled: {n / dt:8.0f} msg/s  ok={ok}/{n}  conns={srv.connections - conns_before}"
+              f"  retries={st['retries']}  {st['latency_ms']}")
+        client.close()
+    finally:
+        srv.shutdown()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--latency-ms", type=float, default=5.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    run(args.n, args.concurrency, args.latency_ms, args.error_rate)
@@ -0,0 +1,51 @@
+# bench/corpus.py
+"""
+Frases de clientes reales (anonimizadas) para los benchmarks del camino caliente.
+"""
+
+ORDER_PHRASES = [
+    "2 hamburguesas y 1 coca",
+    "2 hamb + 1 coca",
+    "quiero 12 hamburguesas",
+    "quiero doce hamburguesas",
+    "hola quiero 2 hamburguesas dobles y una coca",
+    "2 hamburguesas dobles y una coca",
+    "una hamburguesa simple con papas",
+    "3 empanadas de pollo, 2 de carne y 1 coca",
+    "6 empanadas de carne",
+    "dame 2 tallarines y una coca",
+    "mandame 1 hamburguesa doble, 1 papas y 2 cocas",
+    "1 papas / 1 coca",
+    "quiero dos fideos",
+    "4 empanadas pollo y 4 carne",
+    "una coca cola",
+    "2 hamb dobles + 2 papas + 2 coca",
+    "me das 3 hamburguesas simples",
+    "buenas, 1 tallarines por favor",
+    "10 empanadas de carne y 2 cocas",
+    "quiero una hamburguesa",
+]
+
+SMALLTALK_PHRASES = [
+    "hola",
+    "buenas tardes",
+    "buen dia",
+    "menu",
+    "que tienen hoy?",
+    "qué hay",
+    "envio",
+    "lo paso a buscar",
+    "retiro en local",
+    "mandalo a casa porfa",
+    "efectivo",
+    "transferencia",
+    "te paso por mp",
+    "alias o cbu?",
+    "si",
+    "sí",
+    "dale",
+    "no",
+    "cancelar",
+    "soy Juan",
+    "San Martín 1234, piso 2",
+]
@@ -0,0 +1,355 @@
+# bench/fake_llama.py
+"""
+Server de completions falso (estilo llama.cpp / OpenAI) para medir sin modelo.
+
+- POST /v1/completions       ("prompt" string o lista de strings, "stream": true por SSE)
+- POST /v1/chat/completions
+- GET /slots                  (un dict por slot, como llama.cpp)
+- POST /slots/<id>?action=save|restore  ({"filename": ...}, como --slot-save-path)
+
+Simula N slots paralelos: cada generación ocupa un slot `latency_ms` más
+`prompt_token_ms` por token de prompt NO cacheado más `token_ms` por token
+generado; el resto espera. Cada slot recuerda su último prompt: con
+"cache_prompt": true solo se evalúa lo que no comparte con él ("id_slot" elige
+el slot). Responde "timings" (prompt_n, prompt_ms, cache_n) como llama.cpp: al
+final, o en cada evento del stream con "timings_per_token": true.
+La "respuesta del modelo" sale del MenuMatcher sobre la línea "Usuario: ...",
+así el JSON es realista.
+
+Sin "json_schema"/"grammar" en el request se porta como un modelo sin restringir:
+después del JSON sigue hablando hasta max_tokens y, con `invalid_rate`, a veces
+devuelve JSON roto. En streaming, si el cliente corta, el slot se libera.
+
+    python -m bench.fake_llama --port 8081 --slots 4 --latency-ms 120 --token-ms 4 --prompt-token-ms 0.5
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from app.services.menu import get_menu
+
+
+def fake_extract(user_text: str) -> str:
+    menu = get_menu()
+    items = [
+        {"name": menu.matcher.items[item_id]["name"], "qty": qty}
+        for item_id, qty in menu.matcher.parse(user_text)
+    ]
+    if not items:
+        return json.dumps({"ok": False})
+    return json.dumps({"ok": True, "items": items}, ensure_ascii=False)
+
+
+_RAMBLE = " Listo! Si querés agregar algo más, avisame y lo sumo al pedido."
+_TOKEN_CHARS = 3
+
+
+def _tokens(text: str) -> List[str]:
+    return [text[i: i + _TOKEN_CHARS] for i in range(0, len(text), _TOKEN_CHARS)]
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class _Slot:
+    __slots__ = ("id", "busy", "cached")
+
+    def __init__(self, slot_id: int):
+        self.id = slot_id
+        self.busy = False
+        self.cached = ""
+
+
+def _user_line(prompt: str) -> str:
+    for line in reversed(prompt.splitlines()):
+        if line.startswith("Usuario:"):
+            return line[len("Usuario:"):].strip()
+    return prompt
+
+
+class FakeLlamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(
+        self, addr, slots: int = 4, latency_ms: float = 100.0,
+        token_ms: float = 0.0, invalid_rate: float = 0.0, prompt_token_ms: float = 0.0,
+    ):
+        super().__init__(addr, _Handler)
+        self.slots = [_Slot(i) for i in range(max(1, slots))]
+        self.slot_cond = threading.Condition()
+        self.slot_files: Dict[str, str] = {}
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.prompt_token_ms = prompt_token_ms
+        self.invalid_rate = invalid_rate
+        self.lock = threading.Lock()
+        self.received = 0
+        self.generations = 0
+        self.tokens_generated = 0
+        self.prompt_tokens = 0
+        self.prompt_tokens_cached = 0
+
+    def _acquire(self, id_slot: Any) -> _Slot:
+        with self.slot_cond:
+            while True:
+                if isinstance(id_slot, int) and 0 <= id_slot < len(self.slots):
+                    free = [self.slots[id_slot]] if not self.slots[id_slot].busy else []
+                else:
+                    free = [s for s in self.slots if not s.busy]
+                if free:
+                    slot = free[0]
+                    slot.busy = True
+                    return slot
+                self.slot_cond.wait()
+
+    def _release(self, slot: _Slot) -> None:
+        with self.slot_cond:
+            slot.busy = False
+            self.slot_cond.notify_all()
+
+    def _eval_prompt(self, slot: _Slot, prompt: str, cache_prompt: bool) -> Dict[str, Any]:
+        """
+        "Evalúa" el prompt en el slot: duerme por cada token no cacheado.
+        """
+        n = -(-len(prompt) // _TOKEN_CHARS)
+        cached = _common_prefix(slot.cached, prompt) // _TOKEN_CHARS if cache_prompt else 0
+        cached = min(cached, n)
+        ms = (n - cached) * self.prompt_token_ms
+        time.sleep(ms / 1000.0)
+        slot.cached = prompt if cache_prompt else ""
+        with self.lock:
+            self.prompt_tokens += n
+            self.prompt_tokens_cached += cached
+        return {"prompt_n": n - cached, "prompt_ms": ms, "cache_n": cached}
+
+    def slot_action(self, slot_id: int, action: str, filename: str) -> bool:
+        if not (0 <= slot_id < len(self.slots)) or not filename:
+            return False
+        slot = self._acquire(slot_id)
+        try:
+            if action == "save":
+                self.slot_files[filename] = slot.cached
+                return True
+            if action == "restore" and filename in self.slot_files:
+                slot.cached = self.slot_files[filename]
+                return True
+            return False
+        finally:
+            self._release(slot)
+
+    def output_tokens(self, prompt: str, constrained: bool, max_tokens: int) -> List[str]:
+        text = fake_extract(_user_line(prompt))
+        if not constrained:
+            if self.invalid_rate and random.random() < self.invalid_rate:
+                text = text.replace("}]", "},]", 1) if "}]" in text else text[:-1]
+            while len(text) < max_tokens * _TOKEN_CHARS:
+                text += _RAMBLE
+        return _tokens(text)[:max_tokens]
+
+    def _count(self, tokens: int) -> None:
+        with self.lock:
+            self.generations += 1
+            self.tokens_generated += tokens
+
+    def generate(
+        self, prompt: str, constrained: bool = True, max_tokens: int = 120,
+        cache_prompt: bool = False, id_slot: Any = None,
+    ) -> Tuple[str, int, Dict[str, Any]]:
+        toks = self.output_tokens(prompt, constrained, max_tokens)
+        slot = self._acquire(id_slot)
+        try:
+            timings = self._eval_prompt(slot, prompt, cache_prompt)
+            time.sleep((self.latency_ms + self.token_ms * len(toks)) / 1000.0)
+        finally:
+            self._release(slot)
+        self._count(len(toks))
+        return "".join(toks), len(toks), timings
+
+    def generate_stream(
+        self, prompt: str, constrained: bool, max_tokens: int, emit,
+        cache_prompt: bool = False, id_slot: Any = None,
+    ) -> Dict[str, Any] | None:
+        """
+        emit(token, timings) por token; si emit levanta (cliente cortó) se deja de generar
+        y devuelve None. Si no, los timings para el último evento.
+        """
+        toks = self.output_tokens(prompt, constrained, max_tokens)
+        sent = 0
+        timings = None
+        slot = self._acquire(id_slot)
+        try:
+            timings = self._eval_prompt(slot, prompt, cache_prompt)
+            time.sleep(self.latency_ms / 1000.0)
+            for tok in toks:
+                time.sleep(self.token_ms / 1000.0)
+                emit(tok, timings)
+                sent += 1
+        except OSError:
+            timings = None
+        finally:
+            self._release(slot)
+        self._count(sent)
+        return timings
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _reply(self, status: int, body: Any):
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _sse(self, event) -> None:
+        raw = b"data: " + (event if isinstance(event, bytes) else json.dumps(event).encode("utf-8")) + b"\n\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(raw), raw))
+        self.wfile.flush()
+
+    def _stream(self, srv, prompt: str, constrained: bool, max_tokens: int, cache_prompt: bool, id_slot: Any,
+                per_token: bool):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def emit(tok: str, timings: Dict[str, Any]):
+            event = {"object": "text_completion", "choices": [{"index": 0, "text": tok, "finish_reason": None}]}
+            if per_token:
+                event["timings"] = timings
+            self._sse(event)
+
+        timings = srv.generate_stream(prompt, constrained, max_tokens, emit, cache_prompt, id_slot)
+        if timings is None:
+            self.close_connection = True
+            return
+        try:
+            self._sse({"object": "text_completion", "timings": timings,
+                       "choices": [{"index": 0, "text": "", "finish_reason": "stop"}]})
+            self._sse(b"[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            self.close_connection = True
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/slots":
+            return self._reply(200, [{"id": s.id, "is_processing": s.busy} for s in self.server.slots])
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        srv = self.server
+        with srv.lock:
+            srv.received += 1
+
+        constrained = "json_schema" in body or "grammar" in body
+        max_tokens = int(body.get("max_tokens") or 120)
+        cache_prompt = bool(body.get("cache_prompt"))
+        id_slot = body.get("id_slot")
+        url = urlsplit(self.path)
+
+        if url.path == "/v1/completions":
+            prompts = body.get("prompt")
+            if body.get("stream") and isinstance(prompts, str):
+                return self._stream(srv, prompts, constrained, max_tokens, cache_prompt, id_slot,
+                                    bool(body.get("timings_per_token")))
+            if isinstance(prompts, str):
+                prompts = [prompts]
+            else:
+                id_slot = None
+            # un prompt por slot, en paralelo (como el batching de llama.cpp)
+            out: List[Tuple[str, int, Dict[str, Any]]] = [("", 0, {})] * len(prompts)
+
+            def gen(i: int, p: str):
+                out[i] = srv.generate(p, constrained, max_tokens, cache_prompt, id_slot)
+
+            ths = [threading.Thread(target=gen, args=(i, p)) for i, p in enumerate(prompts)]
+            for th in ths:
+                th.start()
+            for th in ths:
+                th.join()
+            return self._reply(200, {
+                "object": "text_completion",
+                "choices": [{"index": i, "text": t, "finish_reason": "stop"} for i, (t, _, _) in enumerate(out)],
+                "usage": {"completion_tokens": sum(n for _, n, _ in out)},
+                "timings": out[0][2],
+            })
+
+        if url.path == "/v1/chat/completions":
+            msgs = body.get("messages") or []
+            # como la plantilla de chat: system primero, el mensaje del cliente al final
+            system = "".join(m.get("content", "") for m in msgs if m.get("role") == "system")
+            user = next((m.get("content", "") for m in reversed(msgs) if m.get("role") == "user"), "")
+            content, n, timings = srv.generate(f"{system}\nUsuario: {user}", constrained, max_tokens, cache_prompt, id_slot)
+            return self._reply(200, {
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"completion_tokens": n},
+                "timings": timings,
+            })
+
+        if url.path.startswith("/slots/"):
+            try:
+                slot_id = int(url.path.rsplit("/", 1)[-1])
+            except ValueError:
+                slot_id = -1
+            action = (parse_qs(url.query).get("action") or [""])[0]
+            if srv.slot_action(slot_id, action, str(body.get("filename") or "")):
+                return self._reply(200, {"id_slot": slot_id, "action": action})
+            return self._reply(400, {"error": f"slot {action} failed"})
+
+        return self._reply(404, {"error": "unknown path"})
+
+
+def start_fake_llama(
+    port: int = 0, slots: int = 4, latency_ms: float = 100.0,
+    token_ms: float = 0.0, invalid_rate: float = 0.0, prompt_token_ms: float = 0.0,
+) -> Tuple[FakeLlamaServer, str]:
+    """
+    Levanta el server en un thread. Devuelve (server, base_url).
+    """
+    srv = FakeLlamaServer(
+        ("127.0.0.1", port), slots=slots, latency_ms=latency_ms,
+        token_ms=token_ms, invalid_rate=invalid_rate, prompt_token_ms=prompt_token_ms,
+    )
+    th = threading.Thread(target=srv.serve_forever, name="fake-llama", daemon=True)
+    th.start()
+    return srv, f"http://127.0.0.1:{srv.server_address[1]}"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--slots", type=int, default=4)
+    ap.add_argument("--latency-ms", type=float, default=100.0)
+    ap.add_argument("--token-ms", type=float, default=0.0)
+    ap.add_argument("--invalid-rate", type=float, default=0.0)
+    ap.add_argument("--prompt-token-ms", type=float, default=0.0)
+    args = ap.parse_args()
+    srv = FakeLlamaServer(
+        ("127.0.0.1", args.port), slots=args.slots, latency_ms=args.latency_ms,
+        token_ms=args.token_ms, invalid_rate=args.invalid_rate, prompt_token_ms=args.prompt_token_ms,
+    )
+    print(f"fake llama en http://127.0.0.1:{args.port}")
+    srv.serve_forever()
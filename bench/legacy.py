@@ -0,0 +1,187 @@
+# bench/legacy.py
+"""
+Copia congelada de los parsers originales de state_machine.py, solo como
+referencia para comparar en los benchmarks. No usar desde app/.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List
+
+_WORD_NUM = {
+    "un": 1, "una": 1, "uno": 1,
+    "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6,
+    "siete": 7, "ocho": 8, "nueve": 9, "diez": 10,
+    "once": 11, "doce": 12,
+    "trece": 13, "catorce": 14, "quince": 15,
+    "dieciseis": 16, "dieciséis": 16, "diecisiete": 17, "dieciocho": 18, "diecinueve": 19,
+    "veinte": 20,
+}
+
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", " ", s.strip().lower())
+
+
+def _parse_qty_token(tok: str) -> int | None:
+    tok = _norm(tok)
+    if tok.isdigit():
+        try:
+            return int(tok)
+        except Exception:
+            return None
+    return _WORD_NUM.get(tok)
+
+
+def _clean_item_name(name: str) -> str:
+    n = _norm(name)
+    n = n.replace("+", " ")
+    n = re.sub(r"[^a-záéíóúüñ\s]", " ", n)
+    n = re.sub(r"\s+", " ", n).strip()
+
+    # Normalizaciones típicas
+    # (ajustá acá si querés mapping más estricto)
+    if n in ("hamb", "hamburguesa", "hamburguesas"):
+        return "hamburguesa"
+    if "hamburguesa doble" in n:
+        return "hamburguesa doble"
+    if "hamburguesa simple" in n:
+        return "hamburguesa simple"
+    if "papa" in n or "papas" in n:
+        return "papas"
+    if "tallar" in n or "fideo" in n:
+        return "tallarines"
+    if "empanada" in n and "pollo" in n:
+        return "empanadas de pollo"
+    if "empanada" in n and "carne" in n:
+        return "empanadas de carne"
+    if "coca" in n:
+        return "coca"
+
+    return n
+
+
+def _parse_items_regex(text: str) -> List[Dict[str, Any]]:
+    """
+    Soporta:
+      - "2 hamburguesas y 1 coca"
+      - "2 hamb + 1 coca"
+      - "quiero 12 hamburguesas"
+      - "quiero doce hamburguesas"
+    """
+    t = _norm(text)
+
+    # atajo: "quiero 12 hamburguesas"
+    m = re.search(r"\b(quiero|dame|mandame|mandáme)?\s*(\d+|[a-záéíóúüñ]+)\s+([a-záéíóúüñ\s]+)\b", t)
+    # pero esto puede capturar basura; lo usamos solo si hay número/palabra-número clara
+    items: List[Dict[str, Any]] = []
+
+    # patrón clásico: "2 hamb", "1 coca", separados por y/+/, etc.
+    parts = re.split(r"\s*(?:,| y |\+|\/)\s*", t)
+    for p in parts:
+        p = _norm(p)
+        mm = re.match(r"^(?:(?:quiero|dame|mandame|mandáme)\s+)?(\d+|[a-záéíóúüñ]+)\s+(.+)$", p)
+        if not mm:
+            continue
+        qty = _parse_qty_token(mm.group(1))
+        if qty is None:
+            continue
+        name = _clean_item_name(mm.group(2))
+        if not name:
+            continue
+        items.append({"name": name, "qty": qty})
+
+    # si no detectó por parts, probamos captura simple "doce hamburguesas"
+    if not items and m:
+        qty = _parse_qty_token(m.group(2))
+        if qty is not None:
+            name = _clean_item_name(m.group(3))
+            if name:
+                items.append({"name": name, "qty": qty})
+
+    return items
+
+
+_PRICE = {
+    "hamburguesa": 9000,            # por defecto "hamburguesa" -> simple
+    "hamburguesa simple": 9000,
+    "hamburguesa doble": 12000,
+    "papas": 5000,
+    "tallarines": 10000,
+    "empanadas de pollo": 1500,
+    "empanadas de carne": 1500,
+    "coca": 2000,
+}
+
+def _calc_total(data: Dict[str, Any]) -> int:
+    total = 0
+    for it in (data.get("items") or []):
+        name = _clean_item_name(str(it.get("name", "")))
+        qty = int(it.get("qty") or 0)
+        price = _PRICE.get(name)
+        if price is None:
+            # fallback: si viene "hamburguesas" etc
+            if "doble" in name and "hamb" in name:
+                price = _PRICE["hamburguesa doble"]
+            elif "hamb" in name:
+                price = _PRICE["hamburguesa"]
+            else:
+                price = 0
+        total += price * qty
+
+    if data.get("delivery_method") == "envio":
+        total += 3000
+    return total
+
+
+# ---- detección de intenciones original (cada helper normaliza y escanea su lista) ----
+def _looks_like_menu_request(text: str) -> bool:
+    t = _norm(text)
+    if t in ("menu", "menú", "carta", "que tienen", "qué tienen", "que hay", "qué hay"):
+        return True
+    if "menu" in t or "menú" in t:
+        return True
+    if "que" in t and "tienen" in t:
+        return True
+    return False
+
+
+def _is_greeting(text: str) -> bool:
+    t = _norm(text)
+    return any(x in t for x in ["hola", "buenas", "buen día", "buen dia", "buenas tardes", "buenas noches"])
+
+
+def _parse_delivery(text: str) -> str | None:
+    t = _norm(text)
+    if any(x in t for x in ["envio", "envío", "enviar", "delivery", "mandalo", "mandalo a casa", "a domicilio"]):
+        return "envio"
+    if any(x in t for x in ["retiro", "retira", "paso a buscar", "lo busco", "buscar", "retiro en local"]):
+        return "retiro"
+    return None
+
+
+def _parse_payment(text: str) -> str | None:
+    t = _norm(text)
+    if "efectivo" in t:
+        return "efectivo"
+    if any(x in t for x in ["transfer", "transferencia", "tranfer", "trasnfer", "alias", "cbu", "mercadopago", "mp"]):
+        return "transferencia"
+    return None
+
+
+def _parse_yes_no(text: str) -> bool | None:
+    t = _norm(text)
+    if t in ("si", "sí", "s", "dale", "ok", "oka", "confirmo", "confirmar", "confirmo si"):
+        return True
+    if t in ("no", "n", "cancelar", "cancelo"):
+        return False
+    return None
+
+
+def classify(text: str) -> Dict[str, Any]:
+    return {
+        "greeting": _is_greeting(text),
+        "menu": _looks_like_menu_request(text),
+        "delivery": _parse_delivery(text),
+        "payment": _parse_payment(text),
+        "yes_no": _parse_yes_no(text),
+    }
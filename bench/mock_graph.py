@@ -0,0 +1,117 @@
+# bench/mock_graph.py
+"""
+Mock local de la Graph API de WhatsApp (POST /<version>/<phone_number_id>/messages).
+
+Uso standalone:
+    python -m bench.mock_graph --port 8090 --latency-ms 40 --error-rate 0.05
+
+y apuntar el bot con GRAPH_BASE_URL=http://127.0.0.1:8090
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+
+class MockGraphServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, addr, latency_ms: float = 0.0, error_rate: float = 0.0):
+        super().__init__(addr, _Handler)
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.received = 0
+        self.connections = 0
+        # biz_opaque_callback_data de los envíos aceptados (outbox: detectar duplicados)
+        self.accepted_keys: Counter = Counter()
+        # idem_key -> primera vez aceptado (monotonic): latencia hasta la respuesta
+        self.accepted_at: Dict[str, float] = {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 para que el cliente pueda reusar la conexión
+    protocol_version = "HTTP/1.1"
+    # headers y body salen en writes separados: sin esto Nagle + delayed ACK suman ~40ms
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _reply(self, status: int, body: dict, headers: dict | None = None):
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        srv = self.server
+        with srv.lock:
+            srv.received += 1
+
+        if srv.latency_ms:
+            time.sleep(srv.latency_ms / 1000.0)
+
+        if not self.path.endswith("/messages"):
+            return self._reply(404, {"error": {"message": "unknown path"}})
+
+        if srv.error_rate and random.random() < srv.error_rate:
+            if random.random() < 0.5:
+                return self._reply(429, {"error": {"code": 130429, "message": "rate limit"}},
+                                   {"Retry-After": "0"})
+            return self._reply(500, {"error": {"code": 1, "message": "internal"}})
+
+        key = body.get("biz_opaque_callback_data")
+        if key:
+            with srv.lock:
+                srv.accepted_keys[key] += 1
+                srv.accepted_at.setdefault(key, time.monotonic())
+        wamid = f"wamid.mock{next(srv.ids)}"
+        return self._reply(200, {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": body.get("to"), "wa_id": body.get("to")}],
+            "messages": [{"id": wamid}],
+        })
+
+
+def start_mock_graph(
+    port: int = 0, latency_ms: float = 0.0, error_rate: float = 0.0
+) -> Tuple[MockGraphServer, str]:
+    """
+    Levanta el mock en un thread. Devuelve (server, base_url). Cortar con server.shutdown().
+    """
+    srv = MockGraphServer(("127.0.0.1", port), latency_ms=latency_ms, error_rate=error_rate)
+    th = threading.Thread(target=srv.serve_forever, name="mock-graph", daemon=True)
+    th.start()
+    return srv, f"http://127.0.0.1:{srv.server_address[1]}"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--latency-ms", type=float, default=0.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    args = ap.parse_args()
+    srv = MockGraphServer(("127.0.0.1", args.port), args.latency_ms, args.error_rate)
+    print(f"mock graph api en http://127.0.0.1:{args.port}")
+    srv.serve_forever()
@@ -0,0 +1,218 @@
+# bench/payloads.py
+"""
+Webhooks de WhatsApp Cloud API realistas para cargar el bot.
+
+- Cada teléfono recorre una conversación completa (hola -> pedido -> envío/retiro
+  -> dirección -> pago -> nombre -> si) y algunos mandan texto que solo entiende la IA.
+- Los mensajes de todos los teléfonos se intercalan (respetando el orden de cada uno)
+  y se empaquetan con varios entry / varios messages por entrega.
+- Se mezclan reintentos de Meta (mismo wamid), imágenes/audios/stickers y
+  entregas que solo traen statuses.
+
+Se puede grabar a JSONL y re-jugar lo mismo después:
+
+    python -m bench.payloads --phones 500 --out /tmp/replay.jsonl
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+from typing import Any, Dict, Iterator, List, Tuple
+
+from bench.corpus import ORDER_PHRASES
+
+PHONE_NUMBER_ID = "100000000000001"
+WABA_ID = "200000000000002"
+
+_NONTEXT = ("image", "audio", "sticker", "location", "reaction")
+_RECEIPTS = ("sent", "delivered", "read")
+_UNKNOWN_ORDERS = ["me tentaste con algo rico", "lo de siempre porfa", "quiero algo para 3 personas"]
+_ADDRESSES = ["San Martín 1234", "Belgrano 55 piso 2", "Av. Rivadavia 9000 dto B", "Mitre 301"]
+_NAMES = ["Juan", "soy Ana", "Carla", "soy Pedro Gómez", "Lucía"]
+
+
+def phone_for(i: int) -> str:
+    return f"54911{i:08d}"
+
+
+def conversation(rnd: random.Random, ai_rate: float = 0.1) -> List[str]:
+    texts = [rnd.choice(["hola", "buenas", "buen dia", "menu"])]
+    if rnd.random() < ai_rate:
+        texts.append(rnd.choice(_UNKNOWN_ORDERS))
+    texts.append(rnd.choice(ORDER_PHRASES))
+    if rnd.random() < 0.5:
+        texts += ["envio", rnd.choice(_ADDRESSES)]
+    else:
+        texts.append(rnd.choice(["retiro", "lo paso a buscar"]))
+    texts.append(rnd.choice(["efectivo", "transferencia", "te paso por mp"]))
+    texts.append(rnd.choice(_NAMES))
+    texts.append(rnd.choice(["si", "dale", "no"]))
+    return texts
+
+
+def _text_message(phone: str, msg_id: str, ts: int, body: str) -> Dict[str, Any]:
+    return {"from": phone, "id": msg_id, "timestamp": str(ts), "type": "text", "text": {"body": body}}
+
+
+def _nontext_message(phone: str, msg_id: str, ts: int, kind: str) -> Dict[str, Any]:
+    return {"from": phone, "id": msg_id, "timestamp": str(ts), "type": kind,
+            kind: {"id": f"media-{msg_id}", "mime_type": "application/octet-stream"}}
+
+
+def _status(phone: str, msg_id: str, ts: int, status: str = "delivered") -> Dict[str, Any]:
+    return {"id": msg_id, "status": status, "timestamp": str(ts), "recipient_id": phone}
+
+
+def _value(messages: List[Dict[str, Any]] | None = None, statuses: List[Dict[str, Any]] | None = None) -> Dict[str, Any]:
+    value: Dict[str, Any] = {
+        "messaging_product": "whatsapp",
+        "metadata": {"display_phone_number": "5491100000000", "phone_number_id": PHONE_NUMBER_ID},
+    }
+    if messages:
+        value["contacts"] = [{"profile": {"name": "Cliente"}, "wa_id": m["from"]} for m in messages]
+        value["messages"] = messages
+    if statuses:
+        value["statuses"] = statuses
+    return value
+
+
+def _payload(entries: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [
+            {"id": WABA_ID, "changes": [{"value": v, "field": "messages"} for v in changes]}
+            for changes in entries
+        ],
+    }
+
+
+def generate(
+    phones: int,
+    seed: int = 7,
+    dup_rate: float = 0.05,
+    nontext_rate: float = 0.05,
+    status_rate: float = 0.3,
+    max_messages: int = 3,
+    max_entries: int = 2,
+    ai_rate: float = 0.1,
+) -> List[Dict[str, Any]]:
+    """
+    Lista de payloads de webhook. Con el mismo seed sale siempre lo mismo.
+    """
+    rnd = random.Random(seed)
+    convs: List[Tuple[str, List[str]]] = [(phone_for(i), conversation(rnd, ai_rate)) for i in range(phones)]
+    cursors = [0] * phones
+    live = list(range(phones))
+    ts = 1_700_000_000
+    seq = 0
+
+    # cola intercalada de mensajes (orden por teléfono preservado)
+    stream: List[Dict[str, Any]] = []
+    while live:
+        k = rnd.randrange(len(live))
+        i = live[k]
+        phone, texts = convs[i]
+        ts += 1
+        seq += 1
+        msg_id = f"wamid.{seed}.{seq}"
+        if rnd.random() < nontext_rate:
+            stream.append(_nontext_message(phone, msg_id, ts, rnd.choice(_NONTEXT)))
+            continue
+        stream.append(_text_message(phone, msg_id, ts, texts[cursors[i]]))
+        cursors[i] += 1
+        if cursors[i] >= len(texts):
+            live[k] = live[-1]
+            live.pop()
+
+    payloads: List[Dict[str, Any]] = []
+    pos = 0
+    recent: List[Dict[str, Any]] = []
+    while pos < len(stream):
+        entries = []
+        for _ in range(rnd.randint(1, max_entries)):
+            if pos >= len(stream):
+                break
+            n = rnd.randint(1, max_messages)
+            batch = stream[pos: pos + n]
+            pos += n
+            changes = [_value(messages=batch)]
+            if rnd.random() < status_rate:
+                m = batch[0]
+                changes.append(_value(statuses=[_status(m["from"], f"wamid.out.{m['id']}", ts)]))
+            entries.append(changes)
+            recent = (recent + batch)[-50:]
+        payloads.append(_payload(entries))
+        # Meta reintenta entregas: re-mandamos algún mensaje ya visto
+        if recent and rnd.random() < dup_rate:
+            payloads.append(_payload([[_value(messages=[rnd.choice(recent)])]]))
+        # entregas que solo traen statuses (las más comunes en producción)
+        if rnd.random() < status_rate:
+            m = rnd.choice(recent)
+            payloads.append(_payload([[_value(statuses=[_status(m["from"], f"wamid.out.{m['id']}", ts)])]]))
+    return payloads
+
+
+def text_messages(payloads: List[Dict[str, Any]]) -> Iterator[Tuple[str, str, str]]:
+    """
+    (msg_id, from, body) de cada mensaje de texto, en orden de llegada (con duplicados).
+    """
+    for p in payloads:
+        for e in p.get("entry", []):
+            for ch in e.get("changes", []):
+                for m in ch.get("value", {}).get("messages", []) or []:
+                    if m.get("type") == "text":
+                        yield m["id"], m["from"], m["text"]["body"]
+
+
+def with_receipts(payloads: List[Dict[str, Any]], seed: int = 7) -> List[Dict[str, Any]]:
+    """
+    Las mismas entregas más los statuses de cada respuesta del bot (sent,
+    delivered, read: una entrega cada uno, en ese orden), intercalados después
+    del mensaje que la originó. Es la mezcla de producción: ~3 entregas de
+    statuses por mensaje de texto.
+    """
+    rnd = random.Random(seed)
+    ts = 1_800_000_000
+    out: List[Dict[str, Any]] = []
+    pending: List[List[Dict[str, Any]]] = []
+    for p in payloads:
+        out.append(p)
+        for msg_id, phone, _ in text_messages([p]):
+            ts += 1
+            pending.append([
+                _payload([[_value(statuses=[_status(phone, f"wamid.out.{msg_id}", ts, st)])]])
+                for st in _RECEIPTS
+            ])
+        keep = []
+        for receipts in pending:
+            if rnd.random() < 0.5:
+                out.append(receipts.pop(0))
+            if receipts:
+                keep.append(receipts)
+        pending = keep
+    for receipts in pending:
+        out.extend(receipts)
+    return out
+
+
+def dump(path: str, payloads: List[Dict[str, Any]]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for p in payloads:
+            f.write(json.dumps(p, ensure_ascii=False) + "\n")
+
+
+def load(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--phones", type=int, default=500)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--out", required=True)
+    args = ap.parse_args()
+    ps = generate(args.phones, seed=args.seed)
+    dump(args.out, ps)
+    print(f"{len(ps)} payloads -> {args.out}")
@@ -0,0 +1,54 @@
+# gunicorn.conf.py
+"""
+Modo producción (Linux):
+
+    pip install ".[prod]"
+    gunicorn -c gunicorn.conf.py "app.main:create_app()"
+
+- N workers (procesos) x M threads (gthread). Cada worker importa la app
+  por su cuenta (preload_app=False) y arma sus propios pools después del fork.
+- post_worker_init: calienta DB/menú/pools antes de la primera request.
+- worker_exit: drenado ordenado (cola de ingest, envíos en vuelo, flush de
+  sesiones/órdenes) dentro de graceful_timeout.
+"""
+import logging
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+preload_app = False
+accesslog = os.getenv("GUNICORN_ACCESSLOG") or None
+
+# Con varios procesos el estado por teléfono tiene que vivir en SQLite:
+# - el cache write-behind de sesiones asume que un solo proceso es dueño de
+#   cada teléfono -> escritura directa
+# - el dedupe por proceso deja pasar reintentos que caen en otro worker
+# Se fuerza aunque el entorno diga otra cosa (ej: EnvironmentFile/env_file
+# copiado de .env.example): con más de un proceso esos modos pierden datos.
+_SHARED_STATE = {"SESSION_WRITE_MODE": "through", "DEDUPE_BACKEND": "sqlite"}
+if workers > 1:
+    for _key, _safe in _SHARED_STATE.items():
+        if os.environ.get(_key, "").strip().lower() != _safe:
+            if os.environ.get(_key):
+                logging.getLogger("gunicorn.error").warning(
+                    "%s=%s no es seguro con %d workers: uso %s", _key, os.environ[_key], workers, _safe
+                )
+            os.environ[_key] = _safe
+
+
+def post_worker_init(worker):
+    from app.main import init_worker
+
+    init_worker()
+
+
+def worker_exit(server, worker):
+    from app.main import shutdown
+
+    # un poco menos que graceful_timeout: el master mata al worker al vencer
+    shutdown(timeout=max(1.0, graceful_timeout - 5))
@@ -0,0 +1,66 @@
+import time
+
+from app.services.coalesce import Coalescer
+
+
+def _recorder(refuse: int = 0):
+    """
+    flush que anota lo despachado; las primeras `refuse` veces devuelve False (pool lleno).
+    """
+    calls = []
+    refused = [0]
+
+    def flush(phone, text, msg_id):
+        if refused[0] < refuse:
+            refused[0] += 1
+            return False
+        calls.append((phone, text, msg_id))
+        return True
+
+    return calls, flush
+
+
+def _wait(calls, n, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while len(calls) < n and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_bursts_go_out_joined_and_in_arrival_order():
+    calls, flush = _recorder()
+    c = Coalescer(flush, window_ms=50, max_ms=1000)
+    c.add("111", "2 hamburguesas", "m1")
+    c.add("222", "hola", "m2")
+    c.add("111", "y una coca", "m3")
+    c.add("111", "para envio", "m4")
+    _wait(calls, 2)
+    c.add("111", "efectivo", "m5")
+    _wait(calls, 3)
+    c.close()
+    # entre teléfonos sale primero la ventana que vence antes; dentro de uno, en orden
+    assert [call for call in calls if call[0] == "111"] == [
+        ("111", "2 hamburguesas\ny una coca\npara envio", "m1"),
+        ("111", "efectivo", "m5"),
+    ]
+    assert [call for call in calls if call[0] == "222"] == [("222", "hola", "m2")]
+
+
+def test_refused_burst_keeps_its_place_ahead_of_newer_messages():
+    calls, flush = _recorder(refuse=2)
+    c = Coalescer(flush, window_ms=20, max_ms=1000)
+    c.add("111", "2 hamburguesas", "m1")
+    time.sleep(0.04)
+    c.add("111", "y una coca", "m2")
+    _wait(calls, 1)
+    c.close()
+    assert calls == [("111", "2 hamburguesas\ny una coca", "m1")]
+
+
+def test_close_flushes_open_bursts_and_rejects_new_ones():
+    calls, flush = _recorder()
+    c = Coalescer(flush, window_ms=10_000, max_ms=10_000)
+    c.add("111", "hola", "m1")
+    c.add("222", "menu", "m2")
+    c.close(timeout=1)
+    assert calls == [("111", "hola", "m1"), ("222", "menu", "m2")]
+    assert c.add("111", "otra", "m3") is False
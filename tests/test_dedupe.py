@@ -0,0 +1,24 @@
+from app.services.dedupe import MemoryDedupe
+
+
+def test_duplicate_within_ttl():
+    d = MemoryDedupe(ttl_sec=60)
+    assert d.seen("wamid.1", now=1000.0) is False
+    assert d.seen("wamid.1", now=1030.0) is True
+    assert d.seen("wamid.2", now=1030.0) is False
+
+
+def test_expires_after_ttl():
+    d = MemoryDedupe(ttl_sec=60)
+    assert d.seen("wamid.1", now=1000.0) is False
+    assert d.seen("wamid.1", now=1060.0) is False
+    # y queda registrado de nuevo desde ahí
+    assert d.seen("wamid.1", now=1100.0) is True
+
+
+def test_forget_lets_the_retry_in():
+    d = MemoryDedupe(ttl_sec=60)
+    assert d.seen("wamid.1", now=1000.0) is False
+    d.forget("wamid.1")
+    assert d.seen("wamid.1", now=1001.0) is False
+    assert d.seen("wamid.1", now=1002.0) is True
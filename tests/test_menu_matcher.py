@@ -0,0 +1,27 @@
+from app.services.menu_matcher import MenuMatcher
+
+ITEMS = [
+    {"id": "hamburguesa_simple", "name": "hamburguesa simple", "price": 9000, "aliases": ["hamburguesa", "hamb"]},
+    {"id": "papas", "name": "papas", "price": 5000, "aliases": ["papas fritas"]},
+    {"id": "coca", "name": "coca", "price": 2000, "aliases": ["coca cola"]},
+]
+
+
+def test_quantities_and_default_one():
+    m = MenuMatcher(ITEMS)
+    assert m.parse("2 hamburguesas y una coca") == [("hamburguesa_simple", 2), ("coca", 1)]
+    assert m.parse("quiero coca") == [("coca", 1)]
+
+
+def test_negated_item_is_not_ordered():
+    m = MenuMatcher(ITEMS)
+    assert m.parse("no quiero coca") == []
+    assert m.parse("2 hamburguesas sin papas") == [("hamburguesa_simple", 2)]
+    assert m.parse("ni coca ni papas") == []
+
+
+def test_negation_does_not_leak():
+    m = MenuMatcher(ITEMS)
+    # cantidad explícita o conector: ya no está negado
+    assert m.parse("no, quiero 2 hamburguesas") == [("hamburguesa_simple", 2)]
+    assert m.parse("hamburguesa sin cebolla y coca") == [("hamburguesa_simple", 1), ("coca", 1)]
@@ -0,0 +1,38 @@
+import time
+
+import pytest
+
+from app.db import conn, repository
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_PATH", str(tmp_path / "vendobot.sqlite3"))
+    monkeypatch.setattr(conn, "_pool", None)
+    conn.init_db()
+    yield
+    conn.close_pool()
+
+
+def test_claim_never_splits_a_phone_between_senders(db):
+    repository.enqueue_outbox([
+        ("a1", "111", "hola"), ("a2", "111", "pedido"), ("b1", "222", "hola"),
+        ("a3", "111", "total"), ("b2", "222", "pedido"),
+    ])
+    now = time.time() + 1
+    first = repository.claim_outbox(now, now + 30, limit=2)
+    second = repository.claim_outbox(now, now + 30, limit=10)
+    assert [r["idem_key"] for r in first] == ["a1", "a2"]
+    # a3 espera: la más vieja de 111 la tiene el primer sender
+    assert [r["idem_key"] for r in second] == ["b1", "b2"]
+    assert repository.claim_outbox(now, now + 30, limit=10) == []
+
+
+def test_phone_waits_for_its_oldest_pending_reply(db):
+    repository.enqueue_outbox([("a1", "111", "hola"), ("a2", "111", "pedido")])
+    now = time.time() + 1
+    [a1, a2] = repository.claim_outbox(now, now + 30, limit=10)
+    # a1 falla y se reintenta más tarde; a2 no se intentó
+    repository.finish_outbox([], [(now + 60, "503", a1["id"])], [], [(now, a2["id"])])
+    assert repository.claim_outbox(now + 1, now + 31, limit=10) == []
+    assert [r["idem_key"] for r in repository.claim_outbox(now + 61, now + 91, limit=10)] == ["a1", "a2"]
@@ -0,0 +1,30 @@
+from app.domain.session import pack, unpack
+
+MENU = {
+    "coca": {"id": "coca", "name": "coca", "price": 2000},
+    "papas": {"id": "papas", "name": "papas", "price": 5000},
+}
+
+
+def test_round_trip_is_exact():
+    data = {
+        "items": [
+            {"id": "coca", "name": "coca", "qty": 2, "price": 2000},
+            {"name": "flan casero", "qty": 1},
+        ],
+        "delivery_method": "envio",
+        "address": "Calle Falsa 123",
+        "payment_method": "transferencia",
+        "name": "Ana",
+        "nota": "sin hielo",
+    }
+    assert unpack(pack("ASK_CONFIRM", data, MENU), MENU) == ("ASK_CONFIRM", data)
+
+
+def test_item_keeps_name_and_price_from_when_it_was_added():
+    data = {"items": [{"id": "coca", "name": "coca", "qty": 1, "price": 2000}]}
+    s = pack("ASK_DELIVERY", data, MENU)
+    # se recargó el menú: la coca sube y cambia de nombre
+    reloaded = dict(MENU, coca={"id": "coca", "name": "coca cola", "price": 2500})
+    _, out = unpack(s, reloaded)
+    assert out["items"] == [{"id": "coca", "name": "coca", "qty": 1, "price": 2000}]
@@ -0,0 +1,47 @@
+import pytest
+
+from app.services import state_machine as sm
+
+
+@pytest.fixture
+def orders(monkeypatch):
+    written = []
+    monkeypatch.setattr(sm, "write_order", lambda phone, data: written.append((phone, data)))
+    return written
+
+
+def test_full_conversation_new_to_done(orders):
+    state, data = None, None
+    steps = [
+        ("hola", "AWAITING_ORDER"),
+        ("2 hamburguesas y una coca", "ASK_DELIVERY"),
+        ("envio", "ASK_ADDRESS"),
+        ("Calle Falsa 123", "ASK_PAYMENT"),
+        ("efectivo", "ASK_NAME"),
+        ("soy Juan", "ASK_CONFIRM"),
+        ("si", "DONE"),
+    ]
+    for text, expected in steps:
+        state, data, reply = sm.handle_message(state, text, data, phone="549111")
+        assert state == expected, (text, reply)
+
+    assert [(it["id"], it["qty"]) for it in data["items"]] == [("hamburguesa_simple", 2), ("coca", 1)]
+    assert data["delivery_method"] == "envio"
+    assert data["address"] == "Calle Falsa 123"
+    assert data["payment_method"] == "efectivo"
+    assert data["name"] == "Juan"
+    # 2 x 9000 + 2000 + envío 3000
+    assert data["total"] == 23000
+    assert reply.startswith("Pedido confirmado")
+    assert orders == [("549111", data)]
+
+
+def test_burst_answers_the_next_question_too():
+    data = {"items": [{"id": "coca", "name": "coca", "qty": 1, "price": 2000}]}
+    state, data, _ = sm.handle_message("ASK_PAYMENT", "efectivo\nJuan", data, phone="1")
+    assert state == "ASK_CONFIRM"
+    assert (data["payment_method"], data["name"]) == ("efectivo", "Juan")
+
+    state, data, _ = sm.handle_message("ASK_DELIVERY", "envio\ncalle 123", {}, phone="1")
+    assert state == "ASK_PAYMENT"
+    assert data["address"] == "calle 123"